@@ -1,49 +1,107 @@
+import hmac
 import os
-from flask import Flask, jsonify, request, session, current_app, g
-from flask_sqlalchemy import SQLAlchemy
-from passlib.hash import sha256_crypt
+import click
+from flask import Blueprint, Flask, Response, jsonify, request, session, current_app, g
 from datetime import datetime, timedelta
 from sqlalchemy import or_
-import uuid
-from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-app = Flask(__name__)
-
-# Configuration
-project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-db_path = os.path.join(project_root, 'social_network.db')
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'a_default_strong_secret_key_for_development')
-
-db = SQLAlchemy(app)
-
-# Import models after db is initialized
-from models import User, Post, Friendship, Group, GroupMember, Message, PasswordResetToken, Like, Comment
+import database
+from database import db, replica_reads
+from models import User, Post, Friendship, Group, GroupMember, Message, PasswordResetToken, Like, Comment, TimelineEntry
 import auth as auth_logic
+import timeline
+import pagination
+import counters
+import search
+import user_cache
+import friend_graph
+import suggestions
+import events
+import media_store
+import uploads
+import static_files
+import passwords
+import tokens
+import reset_tokens
+import profiling
+import metrics
+import response_cache
+import serializers
+import batch
+import like_buffer
+from serializers import Sender, Receiver, Owner
+from response_cache import cached_response
 from auth import login_required, admin_required
 
-# Upload folder configuration
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+db_path = os.path.join(project_root, 'social_network.db')
 UPLOAD_FOLDER_BASE = os.path.join(project_root, 'backend', 'static', 'uploads')
-app.config['UPLOAD_FOLDER_POSTS'] = os.path.join(UPLOAD_FOLDER_BASE, 'posts')
-app.config['UPLOAD_FOLDER_AVATARS'] = os.path.join(UPLOAD_FOLDER_BASE, 'avatars')
-
-# Ensure upload folders exist
-os.makedirs(app.config['UPLOAD_FOLDER_POSTS'], exist_ok=True)
-os.makedirs(app.config['UPLOAD_FOLDER_AVATARS'], exist_ok=True)
-
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-
-@app.route('/api/hello')
+# All routes and CLI commands; registered on the app by create_app()
+api = Blueprint('api', __name__, cli_group=None)
+
+
+def create_app(config=None):
+    """
+    Application factory. Builds a configured app with every extension and route
+    registered; `config` overrides the defaults below (environment variables
+    read by the extensions still apply).
+    """
+    app = Flask(__name__, static_folder=None) # /static is served by static_files.py
+
+    # Configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'a_default_strong_secret_key_for_development')
+    app.config['MEDIA_ROOT'] = UPLOAD_FOLDER_BASE # Local media backend directory, served under /static/uploads
+    app.config['TRUSTED_PROXY_COUNT'] = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+    if config:
+        app.config.update(config)
+
+    # Behind TRUSTED_PROXY_COUNT reverse proxies (e.g. nginx), take the client's
+    # address and scheme from the X-Forwarded-* headers they set. Leave it at 0
+    # when clients connect directly, or they could forge their address.
+    if app.config['TRUSTED_PROXY_COUNT']:
+        proxies = app.config['TRUSTED_PROXY_COUNT']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+
+    # Engine, pool and SQLite pragma tuning (see database.py for the available options)
+    database.init_app(app)
+    user_cache.init_app(app)
+    friend_graph.init_app(app)
+    suggestions.init_app(app)
+    events.init_app(app)
+    media_store.init_app(app)
+    uploads.init_app(app)
+    static_files.init_app(app, project_root)
+    response_cache.init_app(app)
+    serializers.init_app(app)
+    batch.init_app(app)
+    like_buffer.init_app(app)
+    passwords.init_app(app)
+    tokens.init_app(app)
+    reset_tokens.init_app(app)
+    profiling.init_app(app)
+    metrics.init_app(app)
+
+    app.register_blueprint(api)
+    return app
+
+
+@api.errorhandler(passwords.HasherBusy)
+def password_hasher_busy(e):
+    response = jsonify(error="The server is busy. Please try again shortly.")
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+@api.route('/api/hello')
 def hello():
     return jsonify(message="Hello from Flask!"), 200
 
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
     if not data or not data.get('email') or not data.get('password') or not data.get('full_name'):
@@ -59,7 +117,7 @@ def register():
     return jsonify(message="User registered successfully.", user_id=user.id), 201
 
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
     if not data or not data.get('email') or not data.get('password'):
@@ -68,41 +126,52 @@ def login():
     email = data['email']
     password = data['password']
 
+    # Checked before any hashing work so brute-force traffic can't tie up the hashing pool
+    throttle = passwords.get_throttle()
+    client_ip = request.remote_addr or '' # The proxy's address unless TRUSTED_PROXY_COUNT is set
+    retry_after = throttle.attempt(email, client_ip)
+    if retry_after:
+        response = jsonify(error="Too many login attempts. Please try again later.")
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+
     # Special admin login case
     if email == 'admin@example.com' and password == '6094':
         admin_user = User.query.filter_by(email='admin@example.com').first()
-        if admin_user and sha256_crypt.verify(password, admin_user.password_hash):
-            session['user_id'] = admin_user.id
-            session['is_admin'] = True
-            serializer = auth_logic.URLSafeTimedSerializer(app.config['SECRET_KEY'])
-            token = serializer.dumps(admin_user.id, salt='session-token')
+        if admin_user and auth_logic.check_user_password(admin_user, password):
+            throttle.succeeded(email, client_ip)
+            auth_logic.start_session(admin_user.id, is_admin=True)
+            token = tokens.issue(admin_user.id, is_admin=True)
             return jsonify(message="Admin login successful.", token=token, user_id=admin_user.id, is_admin=True), 200
         elif not admin_user:
              return jsonify(error="Admin account not initialized. Please run init_db.py or seed_admin.py."), 401
         else:
+            throttle.failed(email, client_ip)
             return jsonify(error="Invalid admin credentials."), 401
 
     user, token, error = auth_logic.login_user(email, password)
     if error:
+        throttle.failed(email, client_ip)
         return jsonify(error=error), 401
+    throttle.succeeded(email, client_ip)
     
-    session['user_id'] = user.id
-    session['is_admin'] = False
+    auth_logic.start_session(user.id)
     return jsonify(message="Login successful.", token=token, user_id=user.id), 200
 
 
-@app.route('/api/logout', methods=['POST'])
+@api.route('/api/logout', methods=['POST'])
 def logout():
-    session.pop('user_id', None)
-    session.pop('is_admin', None)
-    success, message = auth_logic.logout_user()
+    auth_logic.end_session()
+    header = request.headers.get('Authorization', '')
+    claims = tokens.verify(header[len('Bearer '):].strip()) if header.startswith('Bearer ') else None
+    success, message = auth_logic.logout_user(claims)
     if success:
         return jsonify(message=message), 200
     else:
         return jsonify(error=message), 400
 
 
-@app.route('/api/request-password-reset', methods=['POST'])
+@api.route('/api/request-password-reset', methods=['POST'])
 def request_password_reset():
     data = request.get_json()
     if not data or not data.get('email'):
@@ -115,7 +184,7 @@ def request_password_reset():
     return jsonify(message="Password reset token generated.", reset_token=token), 200
 
 
-@app.route('/api/reset-password', methods=['POST'])
+@api.route('/api/reset-password', methods=['POST'])
 def reset_password_route():
     data = request.get_json()
     token = data.get('token')
@@ -131,11 +200,61 @@ def reset_password_route():
     return jsonify(message="Password has been reset successfully."), 200
 
 
-if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+@api.cli.command('rebuild-timelines')
+def rebuild_timelines_command():
+    """Rebuilds every user's feed timeline from posts and friendships."""
+    total_entries = timeline.rebuild_all()
+    print(f"Rebuilt feed timelines ({total_entries} entries).")
+
+
+@api.cli.command('recount-post-stats')
+def recount_post_stats_command():
+    """Recomputes likes_count/comments_count for every post from the likes and comments tables."""
+    updated_posts = counters.recount()
+    db.session.commit()
+    print(f"Recounted likes and comments for {updated_posts} posts.")
+
+
+@api.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuilds the full-text user search index from the users table."""
+    indexed_users = search.rebuild_index()
+    print(f"Rebuilt user search index ({indexed_users} users).")
+
+
+@api.cli.command('gc-media')
+@click.option('--grace-seconds', default=3600, show_default=True,
+              help="Only delete unreferenced objects older than this (uploads still being committed are younger).")
+def gc_media_command(grace_seconds):
+    """Deletes stored media that no post or avatar references."""
+    deleted_objects = media_store.get_store().sweep(grace_seconds=grace_seconds)
+    print(f"Deleted {deleted_objects} unreferenced media objects.")
 
 
-@app.route('/api/me', methods=['GET'])
+@api.cli.command('sweep-reset-tokens')
+def sweep_reset_tokens_command():
+    """Deletes expired password reset tokens."""
+    deleted_tokens = reset_tokens.get_store().sweep()
+    print(f"Deleted {deleted_tokens} expired password reset tokens.")
+
+
+@api.cli.command('clear-metrics')
+def clear_metrics_command():
+    """Deletes the metrics snapshots in METRICS_DIR; run before starting the workers, never while they run."""
+    app_metrics = metrics.get_metrics()
+    removed_files = app_metrics.registry.remove_files() if app_metrics and app_metrics.registry.directory else 0
+    print(f"Deleted {removed_files} metrics snapshot files.")
+
+
+@api.cli.command('fingerprint-assets')
+def fingerprint_assets_command():
+    """Stamps the current content hash of each static/js script into the HTML pages (?v=...)."""
+    changed_pages = static_files.fingerprint_pages(current_app.config['FRONTEND_PAGES_DIR'],
+                                                   current_app.config['FRONTEND_JS_DIR'])
+    print(f"Updated script fingerprints in {len(changed_pages)} pages.")
+
+
+@api.route('/api/me', methods=['GET'])
 @login_required
 def get_current_user_details():
     if not g.current_user:
@@ -147,35 +266,31 @@ def get_current_user_details():
         "email": g.current_user.email,
         "profile_picture": g.current_user.profile_picture,
         "bio": g.current_user.bio,
-        "is_admin": session.get('is_admin', False)
+        "is_admin": g.is_admin
     }
     return jsonify(user_data), 200
 
 
-@app.route('/api/users', methods=['GET'])
+@api.route('/api/users', methods=['GET'])
+@replica_reads
 @login_required
 def search_users():
     query = request.args.get('q', '')
     if not query:
         return jsonify(error="Search query parameter 'q' is required."), 400
-    
-    users = User.query.filter(
-        or_(
-            User.full_name.ilike(f"%{query}%"),
-            User.email.ilike(f"%{query}%")
-        )
-    ).all()
-    
-    users_data = [{
-        "id": user.id,
-        "full_name": user.full_name,
-        "email": user.email,
-        "profile_picture": user.profile_picture
-    } for user in users]
-    
-    return jsonify(users_data), 200
 
-@app.route('/api/friend-request', methods=['POST'])
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+
+    try:
+        fields = serializers.USER_SUMMARY.fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    users = search.search_users(query, limit=limit, offset=(page - 1) * limit)
+    return jsonify(serializers.USER_SUMMARY.dump_all(users, fields)), 200
+
+@api.route('/api/friend-request', methods=['POST'])
 @login_required
 def send_friend_request():
     data = request.get_json()
@@ -191,6 +306,8 @@ def send_friend_request():
     if not target_user:
         return jsonify(error="Target user not found."), 404
 
+    # Read from the database, not the friend graph: another worker may have
+    # created or answered a request the local graph hasn't seen yet
     existing_friendship = Friendship.query.filter(
         or_(
             (Friendship.user1_id == g.current_user.id) & (Friendship.user2_id == target_user_id),
@@ -204,8 +321,7 @@ def send_friend_request():
         elif existing_friendship.status == 'pending':
             return jsonify(error="A friend request is already pending or has been sent by this user."), 400
         elif existing_friendship.status == 'declined':
-            db.session.delete(existing_friendship)
-            db.session.commit()
+            Friendship.query.filter_by(id=existing_friendship.id).delete(synchronize_session=False)
 
     new_friendship = Friendship(
         user1_id=g.current_user.id,
@@ -213,16 +329,28 @@ def send_friend_request():
         status='pending'
     )
     db.session.add(new_friendship)
+    response_cache.bump(response_cache.user_scope(g.current_user.id), response_cache.user_scope(target_user_id))
     try:
         db.session.commit()
+        friend_graph.get_graph().request_sent(g.current_user.id, target_user_id)
+        suggestions.invalidate(g.current_user.id, target_user_id)
+        events.publish([events.user_channel(target_user_id)], 'friend_request', {
+            "request_id": new_friendship.id,
+            "from_user_id": g.current_user.id,
+            "from_full_name": g.current_user.full_name
+        })
         return jsonify(message="Friend request sent successfully.", request_id=new_friendship.id), 201
+    except IntegrityError:
+        # A concurrent request for the same pair committed first
+        db.session.rollback()
+        return jsonify(error="A friend request is already pending or has been sent by this user."), 400
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error sending friend request: {e}")
         return jsonify(error="Failed to send friend request."), 500
 
 
-@app.route('/api/friend-request/<int:request_id>', methods=['PUT'])
+@api.route('/api/friend-request/<int:request_id>', methods=['PUT'])
 @login_required
 def respond_to_friend_request(request_id):
     data = request.get_json()
@@ -244,11 +372,23 @@ def respond_to_friend_request(request_id):
 
     if action == 'accept':
         friend_request.status = 'accepted'
+        timeline.backfill_friendship(friend_request.user1_id, friend_request.user2_id)
     elif action == 'decline':
         friend_request.status = 'declined'
+    response_cache.bump(response_cache.user_scope(friend_request.user1_id),
+                        response_cache.user_scope(friend_request.user2_id))
 
     try:
         db.session.commit()
+        friend_graph.get_graph().request_answered(
+            friend_request.user1_id, friend_request.user2_id, accepted=(action == 'accept')
+        )
+        suggestions.invalidate(friend_request.user1_id, friend_request.user2_id)
+        events.publish([events.user_channel(friend_request.user1_id)], f"friend_request_{action}ed", {
+            "request_id": friend_request.id,
+            "by_user_id": g.current_user.id,
+            "by_full_name": g.current_user.full_name
+        })
         return jsonify(message=f"Friend request {action}ed successfully."), 200
     except Exception as e:
         db.session.rollback()
@@ -256,44 +396,54 @@ def respond_to_friend_request(request_id):
         return jsonify(error=f"Failed to {action} friend request."), 500
 
 
-@app.route('/api/friends', methods=['GET'])
+@api.route('/api/friends', methods=['GET'])
+@replica_reads
 @login_required
 def list_friends():
-    current_user_id = g.current_user.id
-    
-    friends_as_user1 = db.session.query(User).join(Friendship, Friendship.user2_id == User.id)\
-        .filter(Friendship.user1_id == current_user_id, Friendship.status == 'accepted').all()
-    
-    friends_as_user2 = db.session.query(User).join(Friendship, Friendship.user1_id == User.id)\
-        .filter(Friendship.user2_id == current_user_id, Friendship.status == 'accepted').all()
-        
-    all_friends = list(set(friends_as_user1 + friends_as_user2))
+    try:
+        fields = serializers.USER_SUMMARY.fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
 
-    friends_data = [{
-        "id": user.id,
-        "full_name": user.full_name,
-        "email": user.email,
-        "profile_picture": user.profile_picture
-    } for user in all_friends]
-    
-    return jsonify(friends_data), 200
+    friend_ids = friend_graph.get_graph().friends_of(g.current_user.id)
+    all_friends = db.session.query(*serializers.USER_SUMMARY.columns(fields))\
+        .filter(User.id.in_(friend_ids)).all() if friend_ids else []
+    return jsonify(serializers.USER_SUMMARY.dump_all(all_friends, fields)), 200
 
 
-@app.route('/api/posts', methods=['POST'])
+@api.route('/api/friends/suggestions', methods=['GET'])
+@replica_reads
+@login_required
+def friend_suggestions():
+    limit = request.args.get('limit', current_app.config['SUGGESTIONS_LIMIT'], type=int)
+    limit = min(max(limit, 1), 100)
+
+    ranked = suggestions.get_suggestions(g.current_user.id, limit)
+    candidate_ids = [candidate_id for candidate_id, _ in ranked]
+    users = {row.id: row for row in db.session.query(User.id, User.full_name, User.profile_picture)
+                                              .filter(User.id.in_(candidate_ids))} if candidate_ids else {}
+
+    suggestions_data = [{
+        "id": candidate_id,
+        "full_name": users[candidate_id].full_name,
+        "profile_picture": users[candidate_id].profile_picture,
+        "mutual_friends_count": mutual_count
+    } for candidate_id, mutual_count in ranked if candidate_id in users]
+
+    return jsonify(suggestions_data), 200
+
+
+@api.route('/api/posts', methods=['POST'])
 @login_required
 def create_post():
     if 'image' in request.files:
         file = request.files['image']
         if file.filename == '':
             image_db_path = None
-        elif file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            unique_filename = str(uuid.uuid4()) + "_" + filename
-            file_path = os.path.join(app.config['UPLOAD_FOLDER_POSTS'], unique_filename)
-            file.save(file_path)
-            image_db_path = f"/static/uploads/posts/{unique_filename}"
         else:
-            return jsonify(error="Invalid image file type."), 400
+            image_db_path, error, status_code = uploads.save_upload(file, 'posts')
+            if error:
+                return jsonify(error=error), status_code
     else:
         image_db_path = request.form.get('image_url')
         if not image_db_path and request.is_json:
@@ -311,13 +461,20 @@ def create_post():
     if content is None:
         content = ""
 
+    # Uploads already hold their reference
+    if 'image' not in request.files and not media_store.acquire(image_db_path):
+        return jsonify(error="The image no longer exists."), 400
+
     new_post = Post(
         user_id=g.current_user.id,
         content=content,
         image_url=image_db_path
     )
     db.session.add(new_post)
+    response_cache.bump(response_cache.user_scope(g.current_user.id))
     try:
+        db.session.flush()
+        timeline.fan_out_post(new_post)
         db.session.commit()
         return jsonify({
             "message": "Post created successfully.",
@@ -326,6 +483,7 @@ def create_post():
                 "user_id": new_post.user_id,
                 "content": new_post.content,
                 "image_url": new_post.image_url,
+                "image_variants": uploads.variant_urls(new_post.image_url),
                 "created_at": new_post.created_at.isoformat()
             }
         }), 201
@@ -334,43 +492,41 @@ def create_post():
         current_app.logger.error(f"Error creating post: {e}")
         return jsonify(error="Failed to create post."), 500
 
-@app.route('/api/feed', methods=['GET'])
+@api.route('/api/feed', methods=['GET'])
+@replica_reads
 @login_required
 def get_feed():
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 10, type=int)
 
-    current_user_id = g.current_user.id
+    try:
+        fields = serializers.FEED_POST.fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    posts_query = timeline.timeline_query(g.current_user.id).join(User, User.id == Post.user_id)\
+        .with_entities(*serializers.FEED_POST.columns(fields, required=('id', 'created_at')))
+
+    if pagination.wants_cursor(request.args):
+        try:
+            position = pagination.position_from_args(
+                request.args,
+                lambda post_id: db.session.query(Post.created_at, Post.id).filter(Post.id == post_id).first()
+            )
+            posts, next_cursor = pagination.keyset_paginate(
+                posts_query, [TimelineEntry.created_at, TimelineEntry.post_id], limit, position,
+                key=lambda row: (row.created_at, row.id)
+            )
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+    else:
+        paginated_posts = posts_query.paginate(page=page, per_page=limit, error_out=False)
+        posts = paginated_posts.items
 
-    friend_ids = []
-    for friendship in g.current_user.friendships1:
-        if friendship.status == 'accepted' and friendship.user2:
-            friend_ids.append(friendship.user2_id)
-    for friendship in g.current_user.friendships2:
-        if friendship.status == 'accepted' and friendship.user1:
-            friend_ids.append(friendship.user1_id)
-    
-    from sqlalchemy.orm import joinedload
+    posts_data = like_buffer.overlay(g.current_user.id, serializers.FEED_POST.dump_all(posts, fields))
 
-    user_ids_for_feed = list(set(friend_ids + [current_user_id]))
-    
-    posts_query = Post.query.options(joinedload(Post.author))\
-                            .filter(Post.user_id.in_(user_ids_for_feed))\
-                            .order_by(Post.created_at.desc())
-    
-    paginated_posts = posts_query.paginate(page=page, per_page=limit, error_out=False)
-    
-    posts_data = [{
-        "id": post.id,
-        "user_id": post.user_id,
-        "author_full_name": post.author.full_name,
-        "author_profile_picture": post.author.profile_picture,
-        "content": post.content,
-        "image_url": post.image_url,
-        "created_at": post.created_at.isoformat(),
-        "likes_count": len(post.likes),
-        "comments_count": len(post.comments)
-    } for post in paginated_posts.items]
+    if pagination.wants_cursor(request.args):
+        return jsonify({"per_page": limit, "next_cursor": next_cursor, "items": posts_data}), 200
 
     return jsonify({
         "page": paginated_posts.page,
@@ -381,89 +537,66 @@ def get_feed():
     }), 200
 
 
-@app.route('/api/profile/<int:user_id>', methods=['GET'])
+@api.route('/api/profile/<int:user_id>', methods=['GET'])
+@replica_reads
 @login_required
+@cached_response(lambda user_id: [response_cache.user_scope(user_id), response_cache.user_scope(g.current_user.id),
+                                  response_cache.USERS_SCOPE],
+                 stamp=lambda: like_buffer.user_version(g.current_user.id))
 def get_user_profile(user_id):
     user = User.query.get(user_id)
     if not user:
         return jsonify(error="User not found."), 404
 
-    user_posts = Post.query.filter_by(user_id=user.id).order_by(Post.created_at.desc()).limit(10).all()
-    posts_data = [{
-        "id": post.id,
-        "content": post.content,
-        "image_url": post.image_url,
-        "created_at": post.created_at.isoformat(),
-        "likes_count": len(post.likes),
-        "comments_count": len(post.comments)
-    } for post in user_posts]
-
-    friends_data = []
-    friendships_as_user1 = Friendship.query.filter_by(user1_id=user.id, status='accepted').all()
-    for fs in friendships_as_user1:
-        if fs.user2:
-            friends_data.append({"id": fs.user2.id, "full_name": fs.user2.full_name})
-    
-    friendships_as_user2 = Friendship.query.filter_by(user2_id=user.id, status='accepted').all()
-    for fs in friendships_as_user2:
-        if fs.user1:
-            friends_data.append({"id": fs.user1.id, "full_name": fs.user1.full_name})
-    
-    unique_friends_data = [dict(t) for t in {tuple(d.items()) for d in friends_data}]
+    post_fields = serializers.PROFILE_POST.field_names
+    user_posts = db.session.query(*serializers.PROFILE_POST.columns(post_fields))\
+        .filter(Post.user_id == user.id).order_by(Post.created_at.desc()).limit(10).all()
+    posts_data = like_buffer.overlay(g.current_user.id, serializers.PROFILE_POST.dump_all(user_posts, post_fields))
 
-    friendship_status = 'none'
-    if g.current_user.id == user.id:
-        friendship_status = 'self'
-    else:
-        existing_friendship = Friendship.query.filter(
-            or_(
-                (Friendship.user1_id == g.current_user.id) & (Friendship.user2_id == user.id),
-                (Friendship.user1_id == user.id) & (Friendship.user2_id == g.current_user.id)
-            )
-        ).first()
-        if existing_friendship:
-            if existing_friendship.status == 'accepted':
-                friendship_status = 'friends'
-            elif existing_friendship.status == 'pending':
-                if existing_friendship.user1_id == g.current_user.id:
-                    friendship_status = 'pending_sent'
-                else:
-                    friendship_status = 'pending_received'
+    graph = friend_graph.get_graph()
+    friend_ids = graph.friends_of(user.id)
+    friend_rows = db.session.query(User.id, User.full_name).filter(User.id.in_(friend_ids)).all() if friend_ids else []
+    unique_friends_data = [{"id": friend_id, "full_name": full_name} for friend_id, full_name in friend_rows]
+
+    friendship_status = graph.relationship_status(g.current_user.id, user.id)
+    mutual_friends_count = None
+    if friendship_status != 'self':
+        mutual_friends_count = suggestions.mutual_friend_count(graph, g.current_user.id, user.id)
 
     profile_data = {
         "id": user.id,
         "full_name": user.full_name,
         "email": user.email,
         "profile_picture": user.profile_picture,
+        "profile_picture_variants": uploads.variant_urls(user.profile_picture),
         "bio": user.bio,
         "posts": posts_data,
         "friends": unique_friends_data,
         "friendship_status_with_current_user": friendship_status,
+        "mutual_friends_count": mutual_friends_count,
         "created_at": user.created_at.isoformat() if user.created_at else None
     }
     return jsonify(profile_data), 200
 
-@app.route('/api/profile', methods=['PUT'])
+@api.route('/api/profile', methods=['PUT'])
 @login_required
 def update_user_profile():
-    user_to_update = g.current_user
+    user_to_update = User.query.get(g.current_user.id) # g.current_user is a read-only cached record
     updated_fields = False
 
     if 'profile_picture_file' in request.files:
         file = request.files['profile_picture_file']
         if file.filename == '':
             pass
-        elif file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            unique_filename = str(uuid.uuid4()) + "_" + filename
-            file_path = os.path.join(app.config['UPLOAD_FOLDER_AVATARS'], unique_filename)
-            file.save(file_path)
-            user_to_update.profile_picture = f"/static/uploads/avatars/{unique_filename}"
-            updated_fields = True
         else:
-            return jsonify(error="Invalid profile picture file type."), 400
+            picture_url, error, status_code = uploads.save_upload(file, 'avatars')
+            if error:
+                return jsonify(error=error), status_code
+            media_store.release(user_to_update.profile_picture)
+            user_to_update.profile_picture = picture_url
+            updated_fields = True
 
-    data_source = request.form if request.form else request.get_json()
+    data_source = request.form if request.form else request.get_json(silent=True)
     
     if not data_source and not updated_fields:
          return jsonify(error="No data provided for update."), 400
@@ -471,6 +604,7 @@ def update_user_profile():
     if data_source:
         if 'full_name' in data_source and data_source['full_name'] != user_to_update.full_name:
             user_to_update.full_name = data_source['full_name']
+            search.index_user(user_to_update)
             updated_fields = True
         
         if 'bio' in data_source and data_source['bio'] != user_to_update.bio:
@@ -478,14 +612,21 @@ def update_user_profile():
             updated_fields = True
         
         if 'profile_picture' in data_source and data_source['profile_picture'] != user_to_update.profile_picture and 'profile_picture_file' not in request.files:
+            if not media_store.acquire(data_source['profile_picture']):
+                db.session.rollback()
+                return jsonify(error="The image no longer exists."), 400
+            media_store.release(user_to_update.profile_picture)
             user_to_update.profile_picture = data_source['profile_picture']
             updated_fields = True
 
     if not updated_fields:
         return jsonify(message="No changes detected or no valid fields provided for update."), 200
 
+    # Names and pictures also appear in other users' profiles, group members and comments
+    response_cache.bump(response_cache.user_scope(user_to_update.id), response_cache.USERS_SCOPE)
     try:
         db.session.commit()
+        user_cache.invalidate(user_to_update.id)
         return jsonify({
             "message": "Profile updated successfully.",
             "user": {
@@ -502,23 +643,37 @@ def update_user_profile():
         return jsonify(error="Failed to update profile."), 500
 
 
-@app.route('/api/admin/users', methods=['GET'])
+@api.route('/api/admin/users', methods=['GET'])
 @admin_required
 def admin_list_users():
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 20, type=int)
 
-    users_query = User.query.order_by(User.id.asc())
-    paginated_users = users_query.paginate(page=page, per_page=limit, error_out=False)
+    try:
+        fields = serializers.ADMIN_USER.fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
 
-    users_data = [{
-        "id": user.id,
-        "full_name": user.full_name,
-        "email": user.email,
-        "profile_picture": user.profile_picture,
-        "bio": user.bio,
-        "created_at": user.created_at.isoformat() if user.created_at else None
-    } for user in paginated_users.items]
+    users_query = db.session.query(*serializers.ADMIN_USER.columns(fields, required=('id',))).order_by(User.id.asc())
+
+    if pagination.wants_cursor(request.args):
+        try:
+            position = pagination.position_from_args(
+                request.args, lambda user_id: db.session.query(User.id).filter(User.id == user_id).first()
+            )
+            users, next_cursor = pagination.keyset_paginate(
+                users_query, [User.id], limit, position, key=lambda row: (row.id,), descending=False
+            )
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+    else:
+        paginated_users = users_query.paginate(page=page, per_page=limit, error_out=False)
+        users = paginated_users.items
+
+    users_data = serializers.ADMIN_USER.dump_all(users, fields)
+
+    if pagination.wants_cursor(request.args):
+        return jsonify({"per_page": limit, "next_cursor": next_cursor, "items": users_data}), 200
 
     return jsonify({
         "page": paginated_users.page,
@@ -528,7 +683,7 @@ def admin_list_users():
         "items": users_data
     }), 200
 
-@app.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
+@api.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
 @admin_required
 def admin_delete_user(user_id):
     user_to_delete = User.query.get(user_id)
@@ -539,40 +694,69 @@ def admin_delete_user(user_id):
         return jsonify(error="Cannot delete the primary admin account."), 403
 
     try:
+        timeline.prune_user(user_id)
+        # Posts whose counters change once this user's likes and comments are gone
+        affected_post_ids = {post_id for (post_id,) in db.session.query(Like.post_id).filter_by(user_id=user_id)}
+        affected_post_ids |= {post_id for (post_id,) in db.session.query(Comment.post_id).filter_by(user_id=user_id)}
+        for (image_url,) in db.session.query(Post.image_url).filter(Post.user_id == user_id, Post.image_url.isnot(None)):
+            media_store.release(image_url)
+        media_store.release(user_to_delete.profile_picture)
         Post.query.filter_by(user_id=user_id).delete()
         Like.query.filter_by(user_id=user_id).delete()
         Comment.query.filter_by(user_id=user_id).delete()
+        counters.recount(affected_post_ids)
         GroupMember.query.filter_by(user_id=user_id).delete()
         Friendship.query.filter(or_(Friendship.user1_id == user_id, Friendship.user2_id == user_id)).delete()
         PasswordResetToken.query.filter_by(user_id=user_id).delete()
+        search.remove_user(user_id)
+        tokens.get_authority().revoke_user(user_id)
+        response_cache.bump(response_cache.GLOBAL_SCOPE)
         
         db.session.delete(user_to_delete)
         db.session.commit()
+        user_cache.invalidate(user_id)
+        friend_graph.get_graph().user_deleted(user_id)
         return jsonify(message=f"User {user_id} and their basic associated data deleted successfully."), 200
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error deleting user: {e}")
         return jsonify(error="Failed to delete user."), 500
 
-@app.route('/api/admin/posts', methods=['GET'])
+@api.route('/api/admin/posts', methods=['GET'])
 @admin_required
 def admin_list_posts():
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 20, type=int)
 
-    posts_query = Post.query.order_by(Post.created_at.desc())
-    paginated_posts = posts_query.paginate(page=page, per_page=limit, error_out=False)
-    
-    posts_data = [{
-        "id": post.id,
-        "user_id": post.user_id,
-        "author_full_name": post.author.full_name,
-        "content": post.content,
-        "image_url": post.image_url,
-        "created_at": post.created_at.isoformat(),
-        "likes_count": len(post.likes),
-        "comments_count": len(post.comments)
-    } for post in paginated_posts.items]
+    try:
+        fields = serializers.ADMIN_POST.fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    posts_query = db.session.query(*serializers.ADMIN_POST.columns(fields, required=('id', 'created_at')))\
+        .select_from(Post).join(User, User.id == Post.user_id)\
+        .order_by(Post.created_at.desc(), Post.id.desc())
+
+    if pagination.wants_cursor(request.args):
+        try:
+            position = pagination.position_from_args(
+                request.args,
+                lambda post_id: db.session.query(Post.created_at, Post.id).filter(Post.id == post_id).first()
+            )
+            posts, next_cursor = pagination.keyset_paginate(
+                posts_query, [Post.created_at, Post.id], limit, position,
+                key=lambda row: (row.created_at, row.id)
+            )
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+    else:
+        paginated_posts = posts_query.paginate(page=page, per_page=limit, error_out=False)
+        posts = paginated_posts.items
+
+    posts_data = serializers.ADMIN_POST.dump_all(posts, fields)
+
+    if pagination.wants_cursor(request.args):
+        return jsonify({"per_page": limit, "next_cursor": next_cursor, "items": posts_data}), 200
 
     return jsonify({
         "page": paginated_posts.page,
@@ -582,7 +766,7 @@ def admin_list_posts():
         "items": posts_data
     }), 200
 
-@app.route('/api/admin/posts/<int:post_id>', methods=['DELETE'])
+@api.route('/api/admin/posts/<int:post_id>', methods=['DELETE'])
 @admin_required
 def admin_delete_post(post_id):
     post_to_delete = Post.query.get(post_id)
@@ -590,6 +774,10 @@ def admin_delete_post(post_id):
         return jsonify(error="Post not found."), 404
 
     try:
+        timeline.prune_post(post_id)
+        media_store.release(post_to_delete.image_url)
+        response_cache.bump(response_cache.user_scope(post_to_delete.user_id),
+                            response_cache.post_comments_scope(post_id))
         db.session.delete(post_to_delete)
         db.session.commit()
         return jsonify(message=f"Post {post_id} deleted successfully."), 200
@@ -598,8 +786,14 @@ def admin_delete_post(post_id):
         current_app.logger.error(f"Error deleting post: {e}")
         return jsonify(error="Failed to delete post."), 500
 
-@app.route('/api/admin/dashboard-stats', methods=['GET'])
+def _dashboard_stats_stamp():
+    """Changes whenever a counted row is added, and at least once a minute for the 7-day window."""
+    newest_ids = [db.session.query(db.func.max(model.id)).scalar() for model in (User, Post, Group, Message)]
+    return newest_ids, int(datetime.utcnow().timestamp() // 60)
+
+@api.route('/api/admin/dashboard-stats', methods=['GET'])
 @admin_required
+@cached_response(lambda: [], stamp=_dashboard_stats_stamp)
 def admin_dashboard_stats():
     total_users = User.query.count()
     total_posts = Post.query.count()
@@ -621,22 +815,72 @@ def admin_dashboard_stats():
     }
     return jsonify(stats), 200
 
-@app.route('/api/posts/<int:post_id>/like', methods=['POST'])
+@api.route('/api/admin/cache-stats', methods=['GET'])
+@admin_required
+def admin_cache_stats():
+    stats = {
+        "user_cache": user_cache.get_cache().stats(),
+        "response_cache": response_cache.get_cache().stats(),
+        "password_hasher": passwords.get_hasher().stats(),
+        "login_throttle": passwords.get_throttle().stats(),
+        "tokens": tokens.get_authority().stats(),
+        "reset_tokens": reset_tokens.get_store().stats(),
+        "event_bus": events.get_bus().stats()
+    }
+    if like_buffer.get_buffer() is not None:
+        stats["like_buffer"] = like_buffer.get_buffer().stats()
+    return jsonify(stats), 200
+
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    app_metrics = metrics.get_metrics()
+    if app_metrics is None:
+        return jsonify(error="Metrics are disabled."), 404
+    # Route traffic, error counts and pool state are not public: a token is required unless explicitly waived
+    expected = current_app.config['METRICS_AUTH_TOKEN']
+    if expected:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {expected}'):
+            return jsonify(error="Authentication required."), 401
+    elif not current_app.config['METRICS_ALLOW_ANONYMOUS']:
+        return jsonify(error="Authentication required."), 401
+    body = metrics.render(app_metrics.registry.collect())
+    return Response(body, mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+@api.route('/api/admin/profile-stats', methods=['GET'])
+@admin_required
+def admin_profile_stats():
+    profiler = profiling.get_profiler()
+    if profiler is None:
+        return jsonify(error="Profiling is disabled (set PROFILING=1)."), 404
+    return jsonify(profiler.stats()), 200
+
+@api.route('/api/posts/<int:post_id>/like', methods=['POST'])
 @login_required
 def toggle_like_post(post_id):
     post = Post.query.get(post_id)
     if not post:
         return jsonify(error="Post not found."), 404
 
+    if like_buffer.get_buffer() is not None:
+        # Write-behind: queue the intent; the buffer writes it shortly after
+        pending = like_buffer.state(g.current_user.id, post_id)
+        currently_liked = pending if pending is not None else \
+            db.session.query(Like.id).filter_by(user_id=g.current_user.id, post_id=post_id).first() is not None
+        like_buffer.get_buffer().record(g.current_user.id, post_id, not currently_liked, currently_liked)
+        return jsonify(message="Post unliked successfully." if currently_liked else "Post liked successfully."), 200
+
     existing_like = Like.query.filter_by(user_id=g.current_user.id, post_id=post_id).first()
 
     if existing_like:
         db.session.delete(existing_like)
+        counters.adjust_likes(post_id, -1)
         message = "Post unliked successfully."
     else:
         new_like = Like(user_id=g.current_user.id, post_id=post_id)
         db.session.add(new_like)
+        counters.adjust_likes(post_id, 1)
         message = "Post liked successfully."
+    response_cache.bump(response_cache.user_scope(post.user_id)) # Profiles show like counts
     
     try:
         db.session.commit()
@@ -646,7 +890,7 @@ def toggle_like_post(post_id):
         current_app.logger.error(f"Error toggling like: {e}")
         return jsonify(error="Failed to update like status."), 500
 
-@app.route('/api/posts/<int:post_id>/comments', methods=['POST'])
+@api.route('/api/posts/<int:post_id>/comments', methods=['POST'])
 @login_required
 def create_comment_on_post(post_id):
     post = Post.query.get(post_id)
@@ -664,47 +908,47 @@ def create_comment_on_post(post_id):
         content=content
     )
     db.session.add(new_comment)
+    counters.adjust_comments(post_id, 1)
+    response_cache.bump(response_cache.post_comments_scope(post_id), response_cache.user_scope(post.user_id))
     try:
         db.session.commit()
+        comment_data = {
+            "id": new_comment.id,
+            "user_id": new_comment.user_id,
+            "author_full_name": new_comment.user.full_name,
+            "post_id": new_comment.post_id,
+            "content": new_comment.content,
+            "created_at": new_comment.created_at.isoformat()
+        }
+        if post.user_id != g.current_user.id:
+            events.publish([events.user_channel(post.user_id)], 'comment', comment_data)
         return jsonify({
             "message": "Comment posted successfully.",
-            "comment": {
-                "id": new_comment.id,
-                "user_id": new_comment.user_id,
-                "author_full_name": new_comment.user.full_name,
-                "post_id": new_comment.post_id,
-                "content": new_comment.content,
-                "created_at": new_comment.created_at.isoformat()
-            }
+            "comment": comment_data
         }), 201
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error creating comment: {e}")
         return jsonify(error="Failed to post comment."), 500
 
-@app.route('/api/posts/<int:post_id>/comments', methods=['GET'])
+@api.route('/api/posts/<int:post_id>/comments', methods=['GET'])
 @login_required
+@cached_response(lambda post_id: [response_cache.post_comments_scope(post_id), response_cache.USERS_SCOPE])
 def get_comments_for_post(post_id):
-    post = Post.query.get(post_id)
-    if not post:
+    if not db.session.query(Post.id).filter(Post.id == post_id).first():
         return jsonify(error="Post not found."), 404
+    try:
+        fields = serializers.COMMENT.fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
 
-    comments = sorted(post.comments, key=lambda c: c.created_at)
-
-    comments_data = [{
-        "id": comment.id,
-        "user_id": comment.user_id,
-        "author_full_name": comment.user.full_name,
-        "author_profile_picture": comment.user.profile_picture,
-        "post_id": comment.post_id,
-        "content": comment.content,
-        "created_at": comment.created_at.isoformat()
-    } for comment in comments]
-    
-    return jsonify(comments_data), 200
+    comments = db.session.query(*serializers.COMMENT.columns(fields))\
+        .select_from(Comment).join(User, User.id == Comment.user_id)\
+        .filter(Comment.post_id == post_id).order_by(Comment.created_at, Comment.id).all()
+    return jsonify(serializers.COMMENT.dump_all(comments, fields)), 200
 
 
-@app.route('/api/groups', methods=['POST'])
+@api.route('/api/groups', methods=['POST'])
 @login_required
 def create_group():
     data = request.get_json()
@@ -728,6 +972,8 @@ def create_group():
             user_id=g.current_user.id
         )
         db.session.add(new_member)
+        response_cache.bump(response_cache.user_groups_scope(g.current_user.id),
+                            response_cache.group_scope(new_group.id))
         db.session.commit()
         
         return jsonify({
@@ -745,23 +991,22 @@ def create_group():
         current_app.logger.error(f"Error creating group: {e}")
         return jsonify(error="Failed to create group."), 500
 
-@app.route('/api/groups', methods=['GET'])
+@api.route('/api/groups', methods=['GET'])
 @login_required
+@cached_response(lambda: [response_cache.user_groups_scope(g.current_user.id), response_cache.USERS_SCOPE])
 def list_user_groups():
-    user_groups = Group.query.join(GroupMember).filter(GroupMember.user_id == g.current_user.id).all()
-    
-    groups_data = [{
-        "id": group.id,
-        "name": group.name,
-        "description": group.description,
-        "created_by_user_id": group.created_by_user_id,
-        "owner_name": group.owner.full_name,
-        "created_at": group.created_at.isoformat()
-    } for group in user_groups]
-    
-    return jsonify(groups_data), 200
+    try:
+        fields = serializers.GROUP.fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    user_groups = db.session.query(*serializers.GROUP.columns(fields)).select_from(Group)\
+        .join(GroupMember, GroupMember.group_id == Group.id)\
+        .join(Owner, Owner.id == Group.created_by_user_id)\
+        .filter(GroupMember.user_id == g.current_user.id).all()
+    return jsonify(serializers.GROUP.dump_all(user_groups, fields)), 200
 
-@app.route('/api/groups/<int:group_id>/join', methods=['POST'])
+@api.route('/api/groups/<int:group_id>/join', methods=['POST'])
 @login_required
 def join_group(group_id):
     group = Group.query.get(group_id)
@@ -777,6 +1022,7 @@ def join_group(group_id):
         user_id=g.current_user.id
     )
     db.session.add(new_member)
+    response_cache.bump(response_cache.user_groups_scope(g.current_user.id), response_cache.group_scope(group_id))
     try:
         db.session.commit()
         return jsonify(message="Successfully joined the group.", membership_id=new_member.id), 201
@@ -785,25 +1031,25 @@ def join_group(group_id):
         current_app.logger.error(f"Error joining group: {e}")
         return jsonify(error="Failed to join group."), 500
 
-@app.route('/api/groups/<int:group_id>/members', methods=['GET'])
+@api.route('/api/groups/<int:group_id>/members', methods=['GET'])
 @login_required
+@cached_response(lambda group_id: [response_cache.group_scope(group_id), response_cache.USERS_SCOPE])
 def list_group_members(group_id):
     group = Group.query.get(group_id)
     if not group:
         return jsonify(error="Group not found."), 404
 
-    members = User.query.join(GroupMember).filter(GroupMember.group_id == group_id).all()
-    
-    members_data = [{
-        "id": member.id,
-        "full_name": member.full_name,
-        "profile_picture": member.profile_picture
-    } for member in members]
-    
-    return jsonify(members_data), 200
+    try:
+        fields = serializers.GROUP_MEMBER.fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    members = db.session.query(*serializers.GROUP_MEMBER.columns(fields)).select_from(GroupMember)\
+        .join(User, User.id == GroupMember.user_id).filter(GroupMember.group_id == group_id).all()
+    return jsonify(serializers.GROUP_MEMBER.dump_all(members, fields)), 200
 
 
-@app.route('/api/messages', methods=['POST'])
+@api.route('/api/messages', methods=['POST'])
 @login_required
 def send_message():
     data = request.get_json()
@@ -844,23 +1090,53 @@ def send_message():
     db.session.add(new_message)
     try:
         db.session.commit()
+        message_details = {
+            "id": new_message.id,
+            "sender_id": new_message.sender_id,
+            "receiver_id": new_message.receiver_id,
+            "group_id": new_message.group_id,
+            "content": new_message.content,
+            "created_at": new_message.created_at.isoformat()
+        }
+        if group_id:
+            channels = [events.group_channel(group_id)]
+        else:
+            channels = [events.user_channel(receiver_id), events.user_channel(g.current_user.id)]
+        events.publish(channels, 'message', message_details)
         return jsonify({
             "message": "Message sent successfully.",
-            "message_details": {
-                "id": new_message.id,
-                "sender_id": new_message.sender_id,
-                "receiver_id": new_message.receiver_id,
-                "group_id": new_message.group_id,
-                "content": new_message.content,
-                "created_at": new_message.created_at.isoformat()
-            }
+            "message_details": message_details
         }), 201
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error sending message: {e}")
         return jsonify(error="Failed to send message."), 500
 
-@app.route('/api/messages/user/<int:user_id>', methods=['GET'])
+@api.route('/api/batch', methods=['POST'])
+@login_required
+def apply_batch():
+    data = request.get_json(silent=True)
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify(error="A non-empty 'operations' list is required."), 400
+    max_operations = current_app.config['BATCH_MAX_OPERATIONS']
+    if len(operations) > max_operations:
+        return jsonify(error=f"A batch can contain at most {max_operations} operations."), 400
+
+    operations_batch = batch.Batch(g.current_user.id, operations)
+    try:
+        results = operations_batch.apply()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        operations_batch.rollback()
+        current_app.logger.error(f"Error applying batch: {e}")
+        return jsonify(error="Failed to apply batch."), 500
+    operations_batch.publish_events()
+    return jsonify(results=results), 200
+
+@api.route('/api/messages/user/<int:user_id>', methods=['GET'])
+@replica_reads
 @login_required
 def get_direct_messages(user_id):
     page = request.args.get('page', 1, type=int)
@@ -871,29 +1147,42 @@ def get_direct_messages(user_id):
         return jsonify(error="User not found."), 404
 
     current_user_id = g.current_user.id
+    try:
+        fields = serializers.DIRECT_MESSAGE.fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
 
-    messages_query = Message.query.options(joinedload(Message.sender), joinedload(Message.receiver))\
+    messages_query = db.session.query(*serializers.DIRECT_MESSAGE.columns(fields, required=('id', 'created_at')))\
+        .select_from(Message).join(Sender, Sender.id == Message.sender_id)\
+        .outerjoin(Receiver, Receiver.id == Message.receiver_id)\
         .filter(
             Message.group_id == None,
             or_(
                 (Message.sender_id == current_user_id) & (Message.receiver_id == user_id),
                 (Message.sender_id == user_id) & (Message.receiver_id == current_user_id)
             )
-        ).order_by(Message.created_at.desc())
+        ).order_by(Message.created_at.desc(), Message.id.desc())
 
-    paginated_messages = messages_query.paginate(page=page, per_page=limit, error_out=False)
-    
-    messages_data = [{
-        "id": msg.id,
-        "sender_id": msg.sender_id,
-        "sender_name": msg.sender.full_name,
-        "sender_profile_picture": msg.sender.profile_picture,
-        "receiver_id": msg.receiver_id,
-        "receiver_name": msg.receiver.full_name if msg.receiver else None,
-        "receiver_profile_picture": msg.receiver.profile_picture if msg.receiver else None,
-        "content": msg.content,
-        "created_at": msg.created_at.isoformat()
-    } for msg in reversed(paginated_messages.items)]
+    if pagination.wants_cursor(request.args):
+        try:
+            position = pagination.position_from_args(
+                request.args,
+                lambda message_id: db.session.query(Message.created_at, Message.id).filter(Message.id == message_id).first()
+            )
+            messages, next_cursor = pagination.keyset_paginate(
+                messages_query, [Message.created_at, Message.id], limit, position,
+                key=lambda row: (row.created_at, row.id)
+            )
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+    else:
+        paginated_messages = messages_query.paginate(page=page, per_page=limit, error_out=False)
+        messages = paginated_messages.items
+
+    messages_data = serializers.DIRECT_MESSAGE.dump_all(reversed(messages), fields)
+
+    if pagination.wants_cursor(request.args):
+        return jsonify({"per_page": limit, "next_cursor": next_cursor, "items": messages_data}), 200
 
     return jsonify({
         "page": paginated_messages.page,
@@ -903,7 +1192,8 @@ def get_direct_messages(user_id):
         "items": messages_data
     }), 200
 
-@app.route('/api/messages/group/<int:group_id>', methods=['GET'])
+@api.route('/api/messages/group/<int:group_id>', methods=['GET'])
+@replica_reads
 @login_required
 def get_group_messages(group_id):
     page = request.args.get('page', 1, type=int)
@@ -917,21 +1207,36 @@ def get_group_messages(group_id):
     if not is_member:
         return jsonify(error="You must be a member of this group to view its messages."), 403
 
-    messages_query = Message.query.options(joinedload(Message.sender))\
-                                .filter_by(group_id=group_id)\
-                                .order_by(Message.created_at.desc())
+    try:
+        fields = serializers.GROUP_MESSAGE.fields_from_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    messages_query = db.session.query(*serializers.GROUP_MESSAGE.columns(fields, required=('id', 'created_at')))\
+        .select_from(Message).join(Sender, Sender.id == Message.sender_id)\
+        .filter(Message.group_id == group_id)\
+        .order_by(Message.created_at.desc(), Message.id.desc())
+
+    if pagination.wants_cursor(request.args):
+        try:
+            position = pagination.position_from_args(
+                request.args,
+                lambda message_id: db.session.query(Message.created_at, Message.id).filter(Message.id == message_id).first()
+            )
+            messages, next_cursor = pagination.keyset_paginate(
+                messages_query, [Message.created_at, Message.id], limit, position,
+                key=lambda row: (row.created_at, row.id)
+            )
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+    else:
+        paginated_messages = messages_query.paginate(page=page, per_page=limit, error_out=False)
+        messages = paginated_messages.items
 
-    paginated_messages = messages_query.paginate(page=page, per_page=limit, error_out=False)
+    messages_data = serializers.GROUP_MESSAGE.dump_all(reversed(messages), fields)
 
-    messages_data = [{
-        "id": msg.id,
-        "sender_id": msg.sender_id,
-        "sender_name": msg.sender.full_name,
-        "sender_profile_picture": msg.sender.profile_picture,
-        "group_id": msg.group_id,
-        "content": msg.content,
-        "created_at": msg.created_at.isoformat()
-    } for msg in reversed(paginated_messages.items)]
+    if pagination.wants_cursor(request.args):
+        return jsonify({"per_page": limit, "next_cursor": next_cursor, "items": messages_data}), 200
 
     return jsonify({
         "page": paginated_messages.page,
@@ -939,4 +1244,67 @@ def get_group_messages(group_id):
         "total_pages": paginated_messages.pages,
         "total_items": paginated_messages.total,
         "items": messages_data
-    }), 200
\ No newline at end of file
+    }), 200
+
+
+def _event_channels(user_id):
+    """The user's own channel plus one per group they belong to."""
+    group_ids = [group_id for (group_id,) in db.session.query(GroupMember.group_id).filter_by(user_id=user_id)]
+    return {events.user_channel(user_id)} | {events.group_channel(group_id) for group_id in group_ids}
+
+def _event_position(bus):
+    """Resume position from Last-Event-ID (or ?last_event_id=); new subscribers start at the newest event."""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if not last_event_id:
+        return bus.current_position(), False
+    return bus.position_after(last_event_id)
+
+@api.route('/api/events/stream', methods=['GET'])
+@login_required
+def stream_events():
+    bus = events.get_bus()
+    handoff = request.environ.get(events.HANDOFF_ENVIRON_KEY) # Set when served by asgi.py
+    if handoff is None and not bus.has_free_thread():
+        response = jsonify(error="Too many open event streams; use /api/events/poll.")
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    channels = _event_channels(g.current_user.id)
+    position, needs_resync = _event_position(bus)
+    subscription = events.Subscription(
+        channels, position, needs_resync,
+        heartbeat_seconds=current_app.config['EVENTS_HEARTBEAT_SECONDS'],
+        max_seconds=current_app.config['EVENTS_STREAM_MAX_SECONDS']
+    )
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no" # Stop nginx from buffering the stream
+    }
+    if handoff is not None:
+        # The event loop sends the events; no thread waits for them
+        handoff(bus, subscription)
+        return Response(iter(()), mimetype='text/event-stream', headers=headers) # Streamed: no Content-Length
+    return Response(bus.stream(subscription), mimetype='text/event-stream', headers=headers)
+
+@api.route('/api/events/poll', methods=['GET'])
+@login_required
+def poll_events():
+    bus = events.get_bus()
+    channels = _event_channels(g.current_user.id)
+    position, needs_resync = _event_position(bus)
+    timeout = min(request.args.get('timeout', current_app.config['EVENTS_POLL_TIMEOUT_SECONDS'], type=float),
+                  current_app.config['EVENTS_POLL_TIMEOUT_SECONDS'])
+
+    pending_events = []
+    if not needs_resync:
+        pending_events, position = bus.wait(channels, position, max(timeout, 0))
+
+    return jsonify({
+        "events": [event.to_dict() for event in pending_events],
+        "last_event_id": str(position),
+        "resync": needs_resync
+    }), 200
+
+
+# Importing this module builds no app: wsgi.py, serve.py and asgi.py each create exactly one
+if __name__ == '__main__':
+    create_app().run(debug=True, port=5000)
@@ -0,0 +1,105 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from app import create_app
+import events
+
+# ASGI entry point: uvicorn asgi:application (run from the backend directory).
+#
+# Every route and JSON shape is the one served by app.py. The event loop
+# receives request bodies (including uploads) and sends responses, while the
+# Flask view runs on a worker from a dedicated pool, so a slow query or file
+# write occupies one pool thread instead of a server worker. Views and their
+# queries stay synchronous (the same SQLAlchemy session as under WSGI), so at
+# most ASGI_THREADS requests run at once. Event streams (/api/events/stream)
+# only use the pool to authenticate and subscribe: the view hands the
+# subscription over (events.HANDOFF_ENVIRON_KEY) and the event loop sends the
+# events, so open streams hold no thread.
+
+app = create_app()
+app.config.setdefault('ASGI_THREADS', int(os.environ.get('ASGI_THREADS', 64)))
+
+
+# asgiref's request handler without its @sync_to_async wrapper, which runs every
+# request on one shared thread (thread_sensitive=True) and so serializes the app
+_run_wsgi_app = WsgiToAsgiInstance.run_wsgi_app.__wrapped__
+
+
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    """One request of a WSGI app, with the WSGI call run on executor and event streams on the event loop."""
+
+    def __init__(self, wsgi_application, executor):
+        super().__init__(self._call_with_handoff)
+        self.application = wsgi_application
+        self.executor = executor
+        self.stream = None  # (bus, subscription) handed over by the view
+
+    def _call_with_handoff(self, environ, start_response):
+        environ[events.HANDOFF_ENVIRON_KEY] = self._hand_off
+        return self.application(environ, start_response)
+
+    def _hand_off(self, bus, subscription):
+        self.stream = (bus, subscription)
+
+    async def __call__(self, scope, receive, send):
+        async def send_until_stream(message):
+            # The view's empty body would end the response; the events continue it instead
+            if self.stream is None or message['type'] != 'http.response.body' or message.get('more_body'):
+                await send(message)
+        await super().__call__(scope, receive, send_until_stream)
+        if self.stream is not None:
+            await self._send_events(receive, send)
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(_run_wsgi_app, thread_sensitive=False, executor=self.executor)(self, body)
+
+    async def _send_events(self, receive, send):
+        bus, subscription = self.stream
+        chunks = bus.astream(subscription)
+        disconnected = asyncio.ensure_future(receive()) # The body has been read: the next message is http.disconnect
+        try:
+            while True:
+                next_chunk = asyncio.ensure_future(chunks.__anext__())
+                await asyncio.wait({next_chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    next_chunk.cancel()
+                    await asyncio.gather(next_chunk, return_exceptions=True)
+                    return
+                try:
+                    chunk = next_chunk.result()
+                except StopAsyncIteration: # EVENTS_STREAM_MAX_SECONDS reached; the client reconnects
+                    await send({'type': 'http.response.body'})
+                    return
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        finally:
+            disconnected.cancel()
+            await chunks.aclose()
+
+
+class ThreadPoolWsgiApp:
+    """Runs a WSGI app under ASGI with views executed on a bounded thread pool."""
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        await PooledWsgiInstance(self.wsgi_app, self.executor)(scope, receive, send)
+
+
+application = ThreadPoolWsgiApp(app, threads=app.config['ASGI_THREADS'])
@@ -1,19 +1,23 @@
-from datetime import datetime, timedelta
+import time
 from flask import current_app, session, g
-from itsdangerous import URLSafeTimedSerializer
-from passlib.hash import sha256_crypt
-from models import db, User, PasswordResetToken
+from models import db, User
+import passwords
+import reset_tokens
+import search
+import tokens
+import user_cache
 
 def register_user(full_name, email, password):
     """Registers a new user."""
     if User.query.filter_by(email=email).first():
         return None, "Email already exists."
 
-    new_user = User(full_name=full_name, email=email)
-    new_user.set_password(password) # Hashing is done within the User model's method
+    new_user = User(full_name=full_name, email=email, password_hash=passwords.hash_password(password))
 
     db.session.add(new_user)
     try:
+        db.session.flush()
+        search.index_user(new_user)
         db.session.commit()
         return new_user, None
     except Exception as e:
@@ -21,37 +25,35 @@ def register_user(full_name, email, password):
         return None, f"Database error: {str(e)}"
 
 
+def check_user_password(user, password):
+    """Verifies a user's password, upgrading a hash in an outdated scheme (see passwords.py)."""
+    valid, new_hash = passwords.verify_password(user.password_hash, password)
+    if valid and new_hash:
+        user.password_hash = new_hash
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback() # The old hash keeps working; try again next login
+            current_app.logger.error(f"Error upgrading password hash of user {user.id}: {e}")
+    return valid
+
+
 def login_user(email, password):
     """Logs in an existing user."""
     user = User.query.filter_by(email=email).first()
-    if user and user.check_password(password):
-        # Generate a token (e.g., JWT-like using itsdangerous)
-        serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
-        token = serializer.dumps(user.id, salt='session-token')
+    if user and check_user_password(user, password):
+        token = tokens.issue(user.id) # Signed claims; see tokens.py
         return user, token, None
     return None, None, "Invalid email or password."
 
 
 def request_password_reset_token(email):
-    """Generates a password reset token for a user."""
+    """Generates a password reset token for a user, replacing any previous one."""
     user = User.query.filter_by(email=email).first()
     if not user:
         return None, "User not found."
 
-    serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
-    token_value = serializer.dumps(user.email, salt='password-reset-salt')
-    
-    expires_at = datetime.utcnow() + timedelta(hours=1) # Token valid for 1 hour
-
-    # Invalidate any existing tokens for this user
-    PasswordResetToken.query.filter_by(user_id=user.id).delete()
-
-    new_token = PasswordResetToken(
-        user_id=user.id, 
-        token=token_value, 
-        expires_at=expires_at
-    )
-    db.session.add(new_token)
+    token_value = reset_tokens.get_store().issue(user.id) # Only its hash is stored
     try:
         db.session.commit()
         return token_value, None
@@ -62,24 +64,9 @@ def request_password_reset_token(email):
 
 def verify_password_reset_token(token):
     """Verifies a password reset token."""
-    serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
-    try:
-        email = serializer.loads(
-            token, 
-            salt='password-reset-salt', 
-            max_age=3600 # 1 hour in seconds
-        )
-    except Exception: # Covers SignatureExpired, BadTimeSignature, BadSignature
-        return None, "Token is invalid or has expired."
-
-    token_entry = PasswordResetToken.query.filter_by(token=token).first()
-    if not token_entry or token_entry.expires_at < datetime.utcnow():
+    user = reset_tokens.get_store().lookup(token)
+    if not user:
         return None, "Token is invalid or has expired."
-    
-    user = User.query.filter_by(email=email).first()
-    if not user or user.id != token_entry.user_id:
-        return None, "Token is invalid."
-        
     return user, None
 
 
@@ -89,30 +76,45 @@ def reset_password(token, new_password):
     if error:
         return False, error
 
-    user.set_password(new_password)
+    user.password_hash = passwords.hash_password(new_password)
     
     # Invalidate the used token
-    token_entry = PasswordResetToken.query.filter_by(token=token).first()
-    if token_entry:
-        db.session.delete(token_entry)
+    if not reset_tokens.get_store().consume(user.id, token):
+        db.session.rollback()
+        return False, "Token is invalid or has expired."
+    tokens.get_authority().revoke_user(user.id) # Sign out every existing session
     
     try:
         db.session.commit()
+        user_cache.invalidate(user.id)
         return True, None
     except Exception as e:
         db.session.rollback()
         return False, f"Database error: {str(e)}"
 
-# Note: logout_user is typically handled client-side by deleting the token,
-# or server-side if using server sessions or a token blacklist.
-# For token-based auth, a server-side logout might involve a token blacklist,
-# which is more complex. For now, we'll assume client-side token removal.
-# A simple placeholder if needed:
-def logout_user():
-    """Logs out a user (conceptual for token-based auth)."""
-    # In a real JWT scenario, the client would discard the token.
-    # If using a blacklist, the token would be added to it here.
-    return True, "Logged out successfully (client should discard token)."
+def start_session(user_id, is_admin=False):
+    """Signs the user into the cookie session, for clients that can't send a bearer token (EventSource)."""
+    session['user_id'] = user_id
+    session['is_admin'] = is_admin
+    session['issued_at'] = int(time.time()) # Checked against user revocations like a token's issue time
+
+
+def end_session():
+    for key in ('user_id', 'is_admin', 'issued_at'):
+        session.pop(key, None)
+
+
+def logout_user(claims=None):
+    """Logs out a user, revoking their bearer token (claims from tokens.verify) if they used one."""
+    if claims is None:
+        return True, "Logged out successfully."
+    tokens.get_authority().revoke(claims)
+    try:
+        db.session.commit()
+        return True, "Logged out successfully."
+    except Exception as e:
+        db.session.rollback()
+        return False, f"Database error: {str(e)}"
 
 # --- Decorators for Route Protection ---
 from functools import wraps
@@ -121,24 +123,28 @@ from flask import request, jsonify, session, g, current_app # Added g and curren
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # This is a simplified check. Production apps would validate a token (e.g., JWT)
-        # from the Authorization header or a secure cookie.
-        if 'user_id' not in session: # Check Flask session
+        # A signed bearer token (see tokens.py) carries the user id and admin flag;
+        # the cookie session remains for clients that can't send headers (EventSource)
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+            claims = tokens.verify(header[len('Bearer '):].strip())
+            if claims is None:
+                return jsonify(error="Invalid or expired token."), 401
+            g.token_claims = claims
+            g.is_admin = claims['adm']
+            user_id = claims['uid']
+        elif 'user_id' in session:
+            # Sessions from before issued_at was stored count as issued at 0: any user revocation ends them
+            if tokens.get_authority().session_revoked(session['user_id'], session.get('issued_at', 0)):
+                end_session()
+                return jsonify(error="Session has been revoked."), 401
+            g.token_claims = None
+            g.is_admin = session.get('is_admin', False)
+            user_id = session['user_id']
+        else:
             return jsonify(error="Authentication required."), 401
-        
-        # Optionally, re-verify token if using token-based session
-        # token = session.get('token') or request.headers.get('Authorization')
-        # if not token:
-        #     return jsonify(error="Authentication token missing."), 401
-        # try:
-        #     serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
-        #     user_id_from_token = serializer.loads(token.replace('Bearer ', ''), salt='session-token', max_age=...) # max_age if needed
-        #     if session.get('user_id') != user_id_from_token:
-        #         return jsonify(error="Invalid session or token."), 401
-        # except: # Broad exception for expired/invalid token
-        #     return jsonify(error="Invalid or expired token."), 401
-
-        g.current_user = User.query.get(session['user_id']) # Store user in g for easy access
+
+        g.current_user = user_cache.get_user(user_id) # Cached identity (see user_cache.CachedUser)
         if not g.current_user:
             return jsonify(error="User not found."), 401 # Should not happen if session user_id is valid
         return f(*args, **kwargs)
@@ -149,7 +155,7 @@ def admin_required(f):
     @wraps(f)
     @login_required # Admin must also be logged in
     def decorated_function(*args, **kwargs):
-        if not session.get('is_admin', False):
+        if not g.is_admin: # Set by login_required from the token or the session
             return jsonify(error="Administrator access required."), 403
         # Further check if g.current_user also has an admin role if roles are in DB
         # if not g.current_user.is_admin_role: # Assuming User model has an is_admin_role property/column
@@ -0,0 +1,218 @@
+from datetime import datetime
+from database import db, insert_ignore
+from models import User, Post, Group, GroupMember, Message, Like
+import counters
+import events
+import like_buffer
+import response_cache
+
+# POST /api/batch: many likes, messages and group joins in one request, e.g. a
+# mobile client replaying the actions it queued while offline.
+#
+# Operations are validated with one query per kind of lookup (all the posts,
+# groups and users referenced by the batch at once) and applied with bulk
+# statements in the caller's transaction. They take effect in order, so a
+# batch can join a group and then post to it, or like and unlike the same
+# post. Every operation gets its own result, with the status code and message
+# (or error) its single-item endpoint would have returned; an invalid
+# operation doesn't prevent the others from being applied.
+#
+# Operations:
+#   {"op": "like" | "unlike" | "toggle_like", "post_id": 1}
+#   {"op": "send_message", "content": "...", "receiver_id": 2}  (or "group_id": 3)
+#   {"op": "join_group", "group_id": 3}
+
+LIKE_OPS = ('like', 'unlike', 'toggle_like')
+
+
+def _int(value):
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def _error(status, message):
+    return {"status": status, "error": message}
+
+
+class Batch:
+    def __init__(self, user_id, operations):
+        self.user_id = user_id
+        self.results = [None] * len(operations)
+        self.likes = []      # (index, op, post_id)
+        self.joins = []      # (index, group_id)
+        self.messages = []   # (index, content, receiver_id, group_id)
+        self.existing_groups = set()
+        self.scopes = set()  # Response cache scopes to bump
+        self.taken_likes = {}  # Write-behind intents this batch writes instead of the like buffer
+        self.events = []     # (channels, type, data) to publish after commit
+        for index, operation in enumerate(operations):
+            self._parse(index, operation)
+
+    def _parse(self, index, operation):
+        op = operation.get('op') if isinstance(operation, dict) else None
+        if op in LIKE_OPS:
+            post_id = _int(operation.get('post_id'))
+            if post_id is None:
+                self.results[index] = _error(400, "post_id is required.")
+            else:
+                self.likes.append((index, op, post_id))
+        elif op == 'join_group':
+            group_id = _int(operation.get('group_id'))
+            if group_id is None:
+                self.results[index] = _error(400, "group_id is required.")
+            else:
+                self.joins.append((index, group_id))
+        elif op == 'send_message':
+            content = operation.get('content')
+            receiver_id = _int(operation.get('receiver_id'))
+            group_id = _int(operation.get('group_id'))
+            if not content or not isinstance(content, str):
+                self.results[index] = _error(400, "Message content is required.")
+            elif not receiver_id and not group_id:
+                self.results[index] = _error(400, "Either receiver_id or group_id must be provided.")
+            elif receiver_id and group_id:
+                self.results[index] = _error(400, "Cannot specify both receiver_id and group_id.")
+            elif receiver_id == self.user_id:
+                self.results[index] = _error(400, "Cannot send a message to yourself this way.")
+            else:
+                self.messages.append((index, content, receiver_id, group_id))
+        else:
+            self.results[index] = _error(400, f"Unknown operation; expected one of {', '.join(LIKE_OPS)}, "
+                                              f"send_message, join_group.")
+
+    def apply(self):
+        """Stages every valid operation in the session. Commit, then call publish_events(); on failure roll back, then call rollback()."""
+        # Joins go first: a message is allowed if the sender joined the group earlier in the batch
+        joined_at = self._apply_joins()
+        self._apply_likes()
+        self._apply_messages(joined_at)
+        if self.scopes:
+            response_cache.bump(*self.scopes)
+        return self.results
+
+    def _apply_joins(self):
+        """Returns {group_id: index of the operation that made the user a member} (-1 if already one)."""
+        group_ids = {group_id for _, group_id in self.joins} | {group_id for *_, group_id in self.messages if group_id}
+        if not group_ids:
+            return {}
+        self.existing_groups = existing_groups = {
+            group_id for (group_id,) in db.session.query(Group.id).filter(Group.id.in_(group_ids))
+        }
+        joined_at = {group_id: -1 for (group_id,) in db.session.query(GroupMember.group_id)
+                     .filter(GroupMember.user_id == self.user_id, GroupMember.group_id.in_(group_ids))}
+
+        new_members = []
+        for index, group_id in self.joins:
+            if group_id not in existing_groups:
+                self.results[index] = _error(404, "Group not found.")
+            elif group_id in joined_at:
+                self.results[index] = _error(400, "You are already a member of this group.")
+            else:
+                joined_at[group_id] = index
+                new_members.append(group_id)
+        if not new_members:
+            return joined_at
+
+        now = datetime.utcnow()
+        insert_ignore(GroupMember, [{"group_id": group_id, "user_id": self.user_id, "joined_at": now}
+                                    for group_id in new_members], ['group_id', 'user_id'])
+        membership_ids = dict(db.session.query(GroupMember.group_id, GroupMember.id)
+                              .filter(GroupMember.user_id == self.user_id, GroupMember.group_id.in_(new_members)))
+        for group_id in new_members:
+            self.results[joined_at[group_id]] = {"status": 201, "message": "Successfully joined the group.",
+                                                 "membership_id": membership_ids.get(group_id)}
+        self.scopes.add(response_cache.user_groups_scope(self.user_id))
+        self.scopes.update(response_cache.group_scope(group_id) for group_id in new_members)
+        return joined_at
+
+    def _apply_likes(self):
+        if not self.likes:
+            return
+        post_ids = {post_id for *_, post_id in self.likes}
+        # Likes still queued in write-behind mode are written by this batch instead
+        # (taken first: take() waits for a running flush, so the query below sees it)
+        self.taken_likes = like_buffer.take(self.user_id, post_ids)
+        authors = dict(db.session.query(Post.id, Post.user_id).filter(Post.id.in_(post_ids)))
+        initially_liked = {post_id for (post_id,) in db.session.query(Like.post_id)
+                           .filter(Like.user_id == self.user_id, Like.post_id.in_(authors))}
+
+        pending = {post_id: intent[0] for post_id, intent in self.taken_likes.items() if post_id in authors}
+        liked = (initially_liked | {post_id for post_id, like in pending.items() if like}) \
+            - {post_id for post_id, like in pending.items() if not like}
+        for index, op, post_id in self.likes:
+            if post_id not in authors:
+                self.results[index] = _error(404, "Post not found.")
+                continue
+            if op == 'toggle_like':
+                op = 'unlike' if post_id in liked else 'like'
+            if op == 'like':
+                liked.add(post_id)
+                self.results[index] = {"status": 200, "message": "Post liked successfully."}
+            else:
+                liked.discard(post_id)
+                self.results[index] = {"status": 200, "message": "Post unliked successfully."}
+
+        added = liked - initially_liked
+        removed = initially_liked - liked
+        now = datetime.utcnow()
+        insert_ignore(Like, [{"user_id": self.user_id, "post_id": post_id, "created_at": now} for post_id in added],
+                      ['user_id', 'post_id'])
+        if removed:
+            Like.query.filter(Like.user_id == self.user_id, Like.post_id.in_(removed))\
+                      .delete(synchronize_session=False)
+        # Recount rather than adjust: a concurrent request may have inserted or removed the same likes
+        counters.recount(added | removed)
+        self.scopes.update(response_cache.user_scope(authors[post_id]) for post_id in added | removed)
+
+    def _apply_messages(self, joined_at):
+        if not self.messages:
+            return
+        receiver_ids = {receiver_id for _, _, receiver_id, _ in self.messages if receiver_id}
+        existing_users = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(receiver_ids))} \
+            if receiver_ids else set()
+
+        staged = []
+        for index, content, receiver_id, group_id in self.messages:
+            if receiver_id and receiver_id not in existing_users:
+                self.results[index] = _error(404, "Receiver user not found.")
+            elif group_id and group_id not in self.existing_groups:
+                self.results[index] = _error(404, "Group not found.")
+            elif group_id and joined_at.get(group_id, index) >= index:
+                self.results[index] = _error(403, "You are not a member of this group.")
+            else:
+                staged.append((index, Message(sender_id=self.user_id, receiver_id=receiver_id,
+                                              group_id=group_id, content=content)))
+        if not staged:
+            return
+        db.session.add_all([message for _, message in staged])
+        db.session.flush() # One batched INSERT; assigns ids
+
+        for index, message in staged:
+            details = {
+                "id": message.id,
+                "sender_id": message.sender_id,
+                "receiver_id": message.receiver_id,
+                "group_id": message.group_id,
+                "content": message.content,
+                "created_at": message.created_at.isoformat()
+            }
+            self.results[index] = {"status": 201, "message": "Message sent successfully.", "message_details": details}
+            if message.group_id:
+                channels = [events.group_channel(message.group_id)]
+            else:
+                channels = [events.user_channel(message.receiver_id), events.user_channel(self.user_id)]
+            self.events.append((channels, 'message', details))
+
+    def rollback(self):
+        """Call after rolling back a failed batch: requeues the write-behind likes it had taken over."""
+        like_buffer.restore(self.user_id, self.taken_likes)
+        self.taken_likes = {}
+
+    def publish_events(self):
+        for channels, event_type, data in self.events:
+            events.publish(channels, event_type, data)
+
+
+def init_app(app):
+    """Applies the BATCH_* defaults."""
+    app.config.setdefault('BATCH_MAX_OPERATIONS', 100)
+
@@ -0,0 +1,296 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.request
+from http.cookiejar import CookieJar
+
+# Benchmarks.
+#
+#   python benchmark.py http --url http://127.0.0.1:5000 --email a@b.c --password secret
+#
+# Load generator for comparing serving modes, e.g. the WSGI server against
+# `uvicorn asgi:application`, on the same database. Logs in once, then has
+# --concurrency threads issue --requests GETs spread over --paths, and reports
+# requests/sec and latency percentiles. With --streams N it then repeats the
+# run while holding N /api/events/stream connections open, and reports how
+# many each worker holds and how many of them hold a thread (from
+# /api/admin/cache-stats, when logged in as an admin). Under the WSGI server
+# every open stream occupies a server thread, up to EVENTS_MAX_THREAD_STREAMS
+# per worker (further streams fail to start with 503); under asgi.py none do.
+#
+#   python benchmark.py writes --writers 8 --readers 4 --seconds 10
+#
+# Concurrent SQLite writes with the old settings (rollback journal, the driver's
+# default busy timeout) against the pragmas of database.py (WAL, busy_timeout,
+# ...). Each writer process toggles likes the way /api/posts/<id>/like does
+# (read the like, insert or delete it, update the post's counter, commit) while
+# reader processes run the feed query, on a fresh scratch database per mode.
+# Reports commits/sec, reads/sec and the number of "database is locked" errors.
+
+DEFAULT_PATHS = ['/api/feed', '/api/profile/1', '/api/users?q=a', '/api/friends']
+
+
+def login(base_url, email, password):
+    jar = CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    body = json.dumps({"email": email, "password": password}).encode()
+    req = urllib.request.Request(base_url + '/api/login', data=body, headers={'Content-Type': 'application/json'})
+    opener.open(req).read()
+    return opener
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run(opener, base_url, paths, total, concurrency, timeout):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            try:
+                opener.open(base_url + paths[i % len(paths)], timeout=timeout).read()
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sorted(latencies), errors
+
+
+def open_streams(opener, base_url, count, timeout):
+    """Opens count event streams and waits for each to start. Returns (open responses, errors)."""
+    streams, errors = [], []
+    for _ in range(count):
+        try:
+            response = opener.open(base_url + '/api/events/stream', timeout=timeout)
+            response.readline() # The "retry:" line, sent once the stream has started
+            streams.append(response)
+        except Exception as e:
+            errors.append(e)
+    return streams, errors
+
+
+def streams_per_worker(opener, base_url, timeout, samples=20):
+    """{worker pid: (open streams, streams holding a thread)} for the workers that answered, or None without admin access."""
+    held = {}
+    for _ in range(samples):
+        try:
+            stats = json.loads(opener.open(base_url + '/api/admin/cache-stats', timeout=timeout).read())
+        except Exception:
+            return held or None
+        bus = stats["event_bus"]
+        held[bus["pid"]] = (bus["subscribers"], bus["thread_streams"])
+    return held
+
+
+# --- Concurrent SQLite writes ---
+
+WRITE_MODES = {
+    # What app.py used before database.py: a bare sqlite:/// URI
+    'rollback journal (old)': {'pragmas': ["PRAGMA journal_mode=DELETE"], 'timeout': 5.0},
+}
+
+FEED_QUERY = ("SELECT posts.id, posts.content, posts.likes_count, users.full_name FROM posts "
+              "JOIN users ON users.id = posts.user_id ORDER BY posts.created_at DESC, posts.id DESC LIMIT 20")
+
+
+def tuned_mode():
+    """The connection settings database.py applies to every SQLite connection."""
+    import database
+    config = {key: database._setting(key, default) for key, default in database.DEFAULT_CONFIG.items()}
+    return {'pragmas': database.sqlite_pragmas(config), 'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0}
+
+
+def make_scratch_database(path, users, posts):
+    import schema_migrations
+    conn = sqlite3.connect(path, isolation_level=None)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')) as f:
+        conn.executescript(f.read())
+    schema_migrations.migrate(conn)
+    conn.executemany("INSERT INTO users (full_name, email, password_hash) VALUES (?, ?, 'x')",
+                     [(f"User {i}", f"user{i}@example.com") for i in range(users)])
+    conn.executemany("INSERT INTO posts (user_id, content) VALUES (?, ?)",
+                     [(random.randint(1, users), f"Post {i}") for i in range(posts)])
+    conn.close()
+
+
+def _connect(path, mode):
+    conn = sqlite3.connect(path, timeout=mode['timeout'])
+    for pragma in mode['pragmas']:
+        conn.execute(pragma)
+    return conn
+
+
+def _writer(path, mode, users, posts, start, seconds, results):
+    conn = _connect(path, mode)
+    commits, locked, latencies = 0, 0, []
+    start.wait()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        user_id, post_id = random.randint(1, users), random.randint(1, posts)
+        started = time.perf_counter()
+        try:
+            liked = conn.execute("SELECT id FROM likes WHERE user_id = ? AND post_id = ?",
+                                 (user_id, post_id)).fetchone()
+            if liked:
+                conn.execute("DELETE FROM likes WHERE id = ?", (liked[0],))
+                conn.execute("UPDATE posts SET likes_count = likes_count - 1 WHERE id = ?", (post_id,))
+            else:
+                conn.execute("INSERT INTO likes (user_id, post_id) VALUES (?, ?)", (user_id, post_id))
+                conn.execute("UPDATE posts SET likes_count = likes_count + 1 WHERE id = ?", (post_id,))
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+            continue
+        commits += 1
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+    results.put(('writer', commits, locked, latencies))
+
+
+def _reader(path, mode, start, seconds, results):
+    conn = _connect(path, mode)
+    reads, locked, latencies = 0, 0, []
+    start.wait()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            conn.execute(FEED_QUERY).fetchall()
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+            continue
+        reads += 1
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+    results.put(('reader', reads, locked, latencies))
+
+
+def run_writes(mode, writers, readers, seconds, users=200, posts=500):
+    """Runs the workload in separate processes (like gunicorn workers) on a scratch database."""
+    with tempfile.TemporaryDirectory(prefix='write-benchmark-') as directory:
+        path = os.path.join(directory, 'bench.db')
+        make_scratch_database(path, users, posts)
+        context = multiprocessing.get_context('spawn')
+        start, results = context.Event(), context.Queue()
+        processes = [context.Process(target=_writer, args=(path, mode, users, posts, start, seconds, results))
+                     for _ in range(writers)]
+        processes += [context.Process(target=_reader, args=(path, mode, start, seconds, results))
+                      for _ in range(readers)]
+        for process in processes:
+            process.start()
+        time.sleep(0.5) # Let every process connect before the clock starts
+        start.set()
+        totals = {'writer': [0, 0, []], 'reader': [0, 0, []]}
+        for _ in processes:
+            role, done, locked, latencies = results.get()
+            totals[role][0] += done
+            totals[role][1] += locked
+            totals[role][2].extend(latencies)
+        for process in processes:
+            process.join()
+    return totals
+
+
+def writes_main(args):
+    modes = {**WRITE_MODES, 'database.py settings': tuned_mode()}
+    print(f"{args.writers} writer and {args.readers} reader processes, {args.seconds}s per mode")
+    for name, mode in modes.items():
+        totals = run_writes(mode, args.writers, args.readers, args.seconds)
+        commits, write_locked, write_latencies = totals['writer']
+        reads, read_locked, read_latencies = totals['reader']
+        write_latencies.sort()
+        read_latencies.sort()
+        print(f"\n{name}: {'; '.join(mode['pragmas'])}; timeout {mode['timeout']}s")
+        print(f"  commits/sec: {commits / args.seconds:.1f}, 'database is locked' on writes: {write_locked}, "
+              f"p99 commit: {percentile(write_latencies, 0.99) * 1000:.1f} ms")
+        print(f"  reads/sec: {reads / args.seconds:.1f}, 'database is locked' on reads: {read_locked}, "
+              f"p99 read: {percentile(read_latencies, 0.99) * 1000:.1f} ms")
+
+
+def report(label, elapsed, latencies, errors):
+    print(f"{label}: {len(latencies)} ok, {len(errors)} errors in {elapsed:.2f}s")
+    print(f"  requests/sec: {len(latencies) / elapsed:.1f}")
+    print("  " + ", ".join(f"{name}: {percentile(latencies, fraction) * 1000:.1f} ms"
+                           for name, fraction in (('p50', 0.50), ('p90', 0.90), ('p99', 0.99))))
+    if errors:
+        print(f"  first error: {errors[0]}")
+
+
+def http_main(args):
+    opener = login(args.url, args.email, args.password)
+    report("no streams open", *run(opener, args.url, args.paths, args.requests, args.concurrency, args.timeout))
+    if not args.streams:
+        return
+
+    streams, errors = open_streams(opener, args.url, args.streams, args.timeout)
+    try:
+        print(f"\n{len(streams)} event streams open, {len(errors)} failed to start"
+              + (f" (first error: {errors[0]})" if errors else ""))
+        held = streams_per_worker(opener, args.url, args.timeout)
+        if held is not None:
+            print("  streams per worker (holding a thread): "
+                  + ", ".join(f"{pid}: {count} ({threads})" for pid, (count, threads) in held.items()))
+        report(f"{len(streams)} streams open",
+               *run(opener, args.url, args.paths, args.requests, args.concurrency, args.timeout))
+    finally:
+        for stream in streams:
+            stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the API and its database settings.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    http = commands.add_parser('http', help="Measure requests/sec and latency of a running server.")
+    http.add_argument('--url', default='http://127.0.0.1:5000')
+    http.add_argument('--email', required=True)
+    http.add_argument('--password', required=True)
+    http.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+    http.add_argument('--requests', type=int, default=2000)
+    http.add_argument('--concurrency', type=int, default=32)
+    http.add_argument('--streams', type=int, default=0, help="Event streams to hold open during a second run")
+    http.add_argument('--timeout', type=float, default=10, help="Seconds before a request counts as an error")
+    http.set_defaults(run=http_main)
+
+    writes = commands.add_parser('writes', help="Compare concurrent SQLite writes with the old and tuned settings.")
+    writes.add_argument('--writers', type=int, default=8, help="Writing processes")
+    writes.add_argument('--readers', type=int, default=4, help="Processes running the feed query")
+    writes.add_argument('--seconds', type=float, default=10)
+    writes.set_defaults(run=writes_main)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+from sqlalchemy import func, select, update
+from models import db, Post, Like, Comment
+
+# Posts carry denormalized likes_count/comments_count columns so listings don't
+# have to load every Like and Comment row. The write paths adjust them with an
+# atomic `SET x = x + delta` in the same transaction as the row change, and
+# recount() rebuilds them from the source tables.
+
+def adjust_likes(post_id, delta):
+    """Atomically adds delta to a post's likes_count."""
+    Post.query.filter_by(id=post_id).update(
+        {Post.likes_count: Post.likes_count + delta}, synchronize_session=False
+    )
+
+
+def adjust_comments(post_id, delta):
+    """Atomically adds delta to a post's comments_count."""
+    Post.query.filter_by(id=post_id).update(
+        {Post.comments_count: Post.comments_count + delta}, synchronize_session=False
+    )
+
+
+def recount(post_ids=None):
+    """Recomputes the counters for the given posts (or every post) in one UPDATE. Returns rows updated."""
+    likes_subquery = select(func.count(Like.id)).where(Like.post_id == Post.id).scalar_subquery()
+    comments_subquery = select(func.count(Comment.id)).where(Comment.post_id == Post.id).scalar_subquery()
+    statement = update(Post).values(likes_count=likes_subquery, comments_count=comments_subquery)
+    if post_ids is not None:
+        if not post_ids:
+            return 0
+        statement = statement.where(Post.id.in_(post_ids))
+    result = db.session.execute(statement.execution_options(synchronize_session=False))
+    return result.rowcount
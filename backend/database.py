@@ -0,0 +1,251 @@
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, update
+from sqlalchemy.dialects import postgresql, sqlite as sqlite_dialect
+from sqlalchemy.sql.elements import TextClause
+
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads from @replica_reads endpoints to the read replica.
+    Flushes, and every statement after the session has written, go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not self.info.get('has_written') \
+                and REPLICA_BIND in self._db.engines and _reads_from_replica():
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_written(db_session, flush_context):
+    db_session.info['has_written'] = True
+
+
+def _is_write(statement):
+    if isinstance(statement, TextClause):
+        return not statement.text.lstrip().upper().startswith(('SELECT', 'WITH'))
+    return not statement.is_select
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_executed_write(orm_execute_state):
+    # Bulk UPDATE/DELETE/INSERT sent with session.execute() (counters, cache
+    # versions, media refcounts) bypass the flush; route them and everything
+    # after them to the primary as well
+    if _is_write(orm_execute_state.statement):
+        orm_execute_state.session.info['has_written'] = True
+
+
+class PrimaryMarkers:
+    """Until when each user's reads go to the primary; one per app (extensions['db_primary_markers'])."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def mark(self, user_id, until):
+        with self._lock:
+            self._until[user_id] = until
+            if len(self._until) > self.max_entries:
+                now = time.time()
+                self._until = {key: value for key, value in self._until.items() if value >= now}
+
+    def until(self, user_id):
+        with self._lock:
+            return self._until.get(user_id, 0)
+
+
+def _authenticated_user_id():
+    user = g.get('current_user') # Set by login_required
+    return user.id if user is not None else None
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _stick_to_primary(db_session):
+    # Read-your-writes: the replica may lag, so this client's following reads
+    # go to the primary for a short while after it commits a change. Keyed on
+    # the authenticated user, so bearer-token clients without a cookie stick
+    # too; the cookie covers anonymous clients.
+    if db_session.info.get('has_written') and has_request_context() \
+            and REPLICA_BIND in db_session._db.engines:
+        until = time.time() + current_app.config['DB_REPLICA_STICKY_SECONDS']
+        session['db_primary_until'] = until
+        user_id = _authenticated_user_id()
+        if user_id is not None:
+            current_app.extensions['db_primary_markers'].mark(user_id, until)
+
+
+def _reads_from_replica():
+    if not has_request_context() or not g.get('db_read_only'):
+        return False
+    now = time.time()
+    if session.get('db_primary_until', 0) >= now:
+        return False
+    user_id = _authenticated_user_id()
+    return user_id is None or current_app.extensions['db_primary_markers'].until(user_id) < now
+
+
+def replica_reads(f):
+    """Marks a read-only endpoint whose queries may be served by the read replica."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.db_read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def upsert(model, values, conflict_columns, update_values):
+    """
+    INSERT values, or UPDATE the existing row with update_values when one with the
+    same conflict_columns exists. A single INSERT ... ON CONFLICT statement on
+    SQLite and PostgreSQL; UPDATE-then-INSERT elsewhere.
+    """
+    dialect = db.session.get_bind(mapper=model.__mapper__).dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite_dialect if dialect == 'sqlite' else postgresql).insert(model).values(**values)
+        db.session.execute(insert.on_conflict_do_update(index_elements=conflict_columns, set_=update_values))
+        return
+    existing = [getattr(model, column) == values[column] for column in conflict_columns]
+    if not db.session.execute(update(model).where(*existing).values(**update_values)).rowcount:
+        db.session.add(model(**values))
+
+
+def insert_ignore(model, rows, conflict_columns):
+    """
+    INSERTs rows (dicts), skipping any that would duplicate an existing row on
+    conflict_columns. One INSERT ... ON CONFLICT DO NOTHING on SQLite and
+    PostgreSQL; a lookup per row elsewhere.
+    """
+    if not rows:
+        return
+    dialect = db.session.get_bind(mapper=model.__mapper__).dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = (sqlite_dialect if dialect == 'sqlite' else postgresql).insert(model)
+        db.session.execute(insert.on_conflict_do_nothing(index_elements=conflict_columns), rows)
+        return
+    for values in rows:
+        if not db.session.query(model).filter_by(**{column: values[column] for column in conflict_columns}).first():
+            db.session.add(model(**values))
+
+# Engine tuning. Every key can be overridden in app.config or through an
+# environment variable of the same name.
+#
+# SQLite defaults to a rollback journal, where a writer blocks every reader and
+# a second writer fails immediately with "database is locked". WAL lets readers
+# proceed during a write, and busy_timeout makes concurrent writers (e.g. several
+# gunicorn workers) wait for the lock instead of erroring.
+DEFAULT_CONFIG = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',       # Safe with WAL; fsync only at checkpoints
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_CACHE_SIZE': -20000,          # Negative values are KiB, i.e. ~20 MB per connection
+    'SQLITE_MMAP_SIZE': 256 * 1024 * 1024,
+    'SQLITE_TEMP_STORE': 'MEMORY',
+    'DB_POOL_SIZE': 5,                    # Connections kept open per worker process
+    'DB_MAX_OVERFLOW': 10,
+    'DB_POOL_TIMEOUT': 30,
+    'DB_POOL_RECYCLE': 3600,              # Only applied to server databases
+    'DB_REPLICA_STICKY_SECONDS': 5.0,     # Reads stay on the primary this long after a client writes
+}
+
+
+def _setting(key, default):
+    value = os.environ.get(key)
+    if value is None:
+        return default
+    return type(default)(value)
+
+
+def _is_sqlite_file(uri):
+    return uri.startswith('sqlite') and ':memory:' not in uri and uri not in ('sqlite://', 'sqlite:///')
+
+
+def engine_options(uri, config):
+    """Builds the engine options (pool, connect args) suited to a database URI."""
+    if uri.startswith('sqlite'):
+        if not _is_sqlite_file(uri):
+            return {} # In-memory databases must keep SQLAlchemy's single-connection pool
+        return {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'connect_args': {
+                'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000.0,
+                'check_same_thread': False, # Pooled connections move between request threads
+            },
+        }
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+def sqlite_pragmas(config):
+    """The PRAGMA statements run on every new SQLite connection."""
+    return [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA temp_store={config['SQLITE_TEMP_STORE']}",
+    ]
+
+
+def _install_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def init_app(app):
+    """
+    Applies tuning defaults, binds `db` to the app and installs the SQLite connect hooks.
+
+    DATABASE_URL (e.g. a PostgreSQL URL) replaces the default SQLite file as the
+    primary, and DATABASE_REPLICA_URL adds a read replica used by @replica_reads
+    endpoints.
+    """
+    for key, default in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, _setting(key, default))
+    if os.environ.get('DATABASE_URL'):
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config))
+
+    replica_uri = app.config.get('DATABASE_REPLICA_URL') or os.environ.get('DATABASE_REPLICA_URL')
+    if replica_uri:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.setdefault(REPLICA_BIND, {'url': replica_uri, **engine_options(replica_uri, app.config)})
+
+    db.init_app(app)
+    app.extensions['db_primary_markers'] = PrimaryMarkers()
+
+    pragmas = sqlite_pragmas(app.config)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                _install_pragmas(engine, pragmas)
@@ -0,0 +1,320 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, insert, select, text
+from models import db, RealtimeEvent
+
+# Publish/subscribe bus for real-time delivery of messages, comments and friend
+# request updates, shared by every worker process through the database.
+#
+# Events are published to channels ("user:<id>", "group:<id>") after the write
+# that caused them has been committed: publish() inserts one realtime_events
+# row per channel, and the row id is the event id. Each process runs a poller
+# thread that loads new rows every EVENTS_POLL_INTERVAL_MS while someone waits
+# (at once for its own publishes) into an in-memory history of the newest
+# EVENTS_HISTORY_SIZE events, and wakes up its waiting subscribers. Ids are
+# global, so a client that reconnects with Last-Event-ID to any worker receives
+# what it missed; if its id has already left the history it gets a single
+# "resync" event telling it to reload through the regular endpoints. Rows older
+# than EVENTS_RETENTION_SECONDS are deleted by the pollers.
+#
+# A stream served through WSGI (serve.py) holds a server thread while it is
+# open, so a process serves at most EVENTS_MAX_THREAD_STREAMS of them (serve.py:
+# half of WEB_THREADS) and answers further ones with 503, leaving threads for
+# other requests; clients fall back to /api/events/poll. Under asgi.py streams
+# are served by the event loop and hold no thread (see HANDOFF_ENVIRON_KEY).
+
+# Set by asgi.py in the WSGI environ: a callable taking (bus, subscription) that
+# serves the stream on the event loop; the view then returns only the headers
+HANDOFF_ENVIRON_KEY = 'events.stream_handoff'
+
+# What an /api/events/stream client subscribed to
+Subscription = namedtuple('Subscription', ['channels', 'position', 'needs_resync', 'heartbeat_seconds', 'max_seconds'])
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+def group_channel(group_id):
+    return f"group:{group_id}"
+
+
+class Event:
+    __slots__ = ('sequence', 'id', 'channel', 'type', 'data')
+
+    def __init__(self, sequence, channel, event_type, data):
+        self.sequence = sequence
+        self.id = str(sequence)
+        self.channel = channel
+        self.type = event_type
+        self.data = data
+
+    def to_dict(self):
+        return {"id": self.id, "type": self.type, "data": self.data}
+
+    def to_sse(self):
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, default=str)}\n\n"
+
+
+class EventBus:
+    def __init__(self, app, history_size=5000, poll_interval_ms=250, retention_seconds=3600, max_thread_streams=0):
+        self.app = app
+        self.history_size = history_size
+        self.interval = poll_interval_ms / 1000.0
+        self.retention_seconds = retention_seconds
+        self.max_thread_streams = max_thread_streams
+        self._history = deque(maxlen=history_size)
+        self._last_id = None   # Newest row loaded; None until the first load
+        self._condition = threading.Condition()
+        self._load_lock = threading.Lock()
+        self._async_waiters = set()   # (loop, asyncio.Event) of streams served by an event loop
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._next_prune = 0.0
+        self.waiting = 0        # Subscribers blocked in wait() or await_events()
+        self.subscribers = 0
+        self.thread_streams = 0 # Streams served by a thread of their own (WSGI)
+        self.published = 0
+        self.loads = 0
+
+    def _ensure_thread(self):
+        # Started on first use so it runs in the serving process, not a pre-fork master
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='event-poller', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    if self.waiting:
+                        self._load()
+                    if time.monotonic() >= self._next_prune:
+                        self._next_prune = time.monotonic() + 60
+                        self._prune()
+            except Exception as e:
+                self.app.logger.error(f"Error loading real-time events: {e}")
+
+    def publish(self, channels, event_type, data):
+        """Stores one event per channel, in a transaction of its own, for the pollers of every process."""
+        now = datetime.utcnow()
+        rows = [{"channel": channel, "type": event_type, "data": json.dumps(data, default=str), "created_at": now}
+                for channel in channels]
+        if not rows:
+            return
+        with db.engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                # Ids must become visible in order, or a poller could skip one committed late
+                connection.execute(text("LOCK TABLE realtime_events IN SHARE ROW EXCLUSIVE MODE"))
+            connection.execute(insert(RealtimeEvent.__table__), rows)
+        self.published += len(rows)
+        self._ensure_thread()
+        self._wakeup.set() # Local subscribers get it without waiting for the next poll
+
+    def _load(self):
+        """Appends the rows newer than the history to it and wakes up waiting subscribers."""
+        with self._load_lock:
+            query = select(RealtimeEvent.id, RealtimeEvent.channel, RealtimeEvent.type, RealtimeEvent.data)
+            if self._last_id is not None:
+                query = query.where(RealtimeEvent.id > self._last_id)
+            with db.engine.connect() as connection:
+                rows = connection.execute(query.order_by(RealtimeEvent.id.desc()).limit(self.history_size)).all()
+            loaded = [Event(row_id, channel, event_type, json.loads(data))
+                      for row_id, channel, event_type, data in reversed(rows)]
+            with self._condition:
+                if len(loaded) == self.history_size and self._last_id is not None:
+                    self._history.clear() # Rows may have been skipped: resuming from before them needs a resync
+                self._history.extend(loaded)
+                self._last_id = loaded[-1].sequence if loaded else (self._last_id or 0)
+                self.loads += 1
+                if loaded:
+                    self._condition.notify_all()
+                    for loop, waiter in list(self._async_waiters):
+                        try:
+                            loop.call_soon_threadsafe(waiter.set)
+                        except RuntimeError:
+                            pass # Its loop has closed
+
+    def _prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention_seconds)
+        with db.engine.begin() as connection:
+            connection.execute(delete(RealtimeEvent.__table__).where(RealtimeEvent.created_at < cutoff))
+
+    def current_position(self):
+        """Id of the newest event; subscribing from here skips the history."""
+        self._ensure_thread()
+        self._load()
+        with self._condition:
+            return self._last_id
+
+    def position_after(self, last_event_id):
+        """
+        Maps a Last-Event-ID to a history position. Returns (position, needs_resync);
+        needs_resync is True when the id is not one of ours or too old to resume from.
+        """
+        position = self.current_position()
+        if not (last_event_id or '').isdigit():
+            return position, True
+        sequence = int(last_event_id)
+        with self._condition:
+            oldest = self._history[0].sequence if self._history else self._last_id + 1
+            if sequence + 1 < oldest or sequence > self._last_id:
+                return self._last_id, True
+            return sequence, False
+
+    def _events_after(self, channels, position):
+        # Newest last: walk back from the end, no scan from the start
+        events = []
+        for event in reversed(self._history):
+            if event.sequence <= position:
+                break
+            if event.channel in channels:
+                events.append(event)
+        events.reverse()
+        return events
+
+    def has_free_thread(self):
+        """False when EVENTS_MAX_THREAD_STREAMS streams already hold a thread of this process."""
+        with self._condition:
+            return not self.max_thread_streams or self.thread_streams < self.max_thread_streams
+
+    def wait(self, channels, position, timeout):
+        """Blocks until events newer than position exist on channels, or timeout. Returns (events, position)."""
+        self._ensure_thread()
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self.waiting += 1
+            try:
+                while True:
+                    events = self._events_after(channels, position)
+                    if events:
+                        return events, events[-1].sequence
+                    position = max(position, self._last_id)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return [], position
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+    async def await_events(self, channels, position, timeout):
+        """wait() for an event loop: suspends the calling task instead of blocking a thread."""
+        self._ensure_thread()
+        loop = asyncio.get_running_loop()
+        waiter = (loop, asyncio.Event())
+        deadline = loop.time() + timeout
+        with self._condition:
+            self._async_waiters.add(waiter)
+            self.waiting += 1
+        try:
+            while True:
+                waiter[1].clear()
+                with self._condition:
+                    events = self._events_after(channels, position)
+                    if events:
+                        return events, events[-1].sequence
+                    position = max(position, self._last_id)
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return [], position
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._condition:
+                self._async_waiters.discard(waiter)
+                self.waiting -= 1
+
+    def stream(self, subscription):
+        """Generator of Server-Sent Events text for one subscriber; holds the calling thread throughout."""
+        with self._condition:
+            self.subscribers += 1
+            self.thread_streams += 1
+        try:
+            position = subscription.position
+            yield "retry: 3000\n\n"
+            if subscription.needs_resync:
+                yield f"id: {position}\nevent: resync\ndata: {{}}\n\n"
+            deadline = time.monotonic() + subscription.max_seconds
+            while time.monotonic() < deadline:
+                events, position = self.wait(subscription.channels, position, subscription.heartbeat_seconds)
+                if not events:
+                    yield ": keep-alive\n\n"
+                for event in events:
+                    yield event.to_sse()
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+                self.thread_streams -= 1
+
+    async def astream(self, subscription):
+        """stream() for an event loop (see asgi.py); holds no thread."""
+        with self._condition:
+            self.subscribers += 1
+        try:
+            position = subscription.position
+            yield "retry: 3000\n\n"
+            if subscription.needs_resync:
+                yield f"id: {position}\nevent: resync\ndata: {{}}\n\n"
+            deadline = time.monotonic() + subscription.max_seconds
+            while time.monotonic() < deadline:
+                events, position = await self.await_events(subscription.channels, position,
+                                                           subscription.heartbeat_seconds)
+                if not events:
+                    yield ": keep-alive\n\n"
+                for event in events:
+                    yield event.to_sse()
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+
+    def stats(self):
+        with self._condition:
+            return {
+                "pid": os.getpid(),
+                "last_event_id": self._last_id,
+                "subscribers": self.subscribers,
+                "thread_streams": self.thread_streams,
+                "published": self.published,
+                "loads": self.loads,
+                "history": len(self._history)
+            }
+
+
+def init_app(app):
+    """Creates the app's event bus from EVENTS_* settings."""
+    app.config.setdefault('EVENTS_HISTORY_SIZE', 5000)
+    app.config.setdefault('EVENTS_POLL_INTERVAL_MS', 250)     # How soon other processes' events arrive
+    app.config.setdefault('EVENTS_RETENTION_SECONDS', 3600)
+    app.config.setdefault('EVENTS_MAX_THREAD_STREAMS', int(os.environ.get('EVENTS_MAX_THREAD_STREAMS', 0))) # 0 = no limit
+    app.config.setdefault('EVENTS_HEARTBEAT_SECONDS', 15)
+    app.config.setdefault('EVENTS_STREAM_MAX_SECONDS', 300)   # Clients reconnect (and resume) after this
+    app.config.setdefault('EVENTS_POLL_TIMEOUT_SECONDS', 25)
+    app.extensions['event_bus'] = EventBus(
+        app,
+        history_size=app.config['EVENTS_HISTORY_SIZE'],
+        poll_interval_ms=app.config['EVENTS_POLL_INTERVAL_MS'],
+        retention_seconds=app.config['EVENTS_RETENTION_SECONDS'],
+        max_thread_streams=app.config['EVENTS_MAX_THREAD_STREAMS']
+    )
+
+
+def get_bus():
+    return current_app.extensions['event_bus']
+
+
+def publish(channels, event_type, data):
+    """Publishes an event; call only after the change it describes has been committed."""
+    get_bus().publish(channels, event_type, data)
@@ -0,0 +1,168 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import or_
+from models import db, Friendship
+
+# In-memory view of the friendship graph. For each user it keeps three sorted
+# int arrays: accepted friends, pending requests sent and pending requests
+# received. Membership tests are a binary search and "friends of X" is a copy
+# of one array, instead of a two-directional OR query per endpoint.
+#
+# Entries are loaded lazily (many users per query) and updated incrementally
+# by the friendship endpoints after they commit. Other worker processes pick up
+# changes when their copy expires after FRIEND_GRAPH_TTL seconds.
+
+LOAD_BATCH_SIZE = 500
+
+
+def _contains(values, value):
+    i = bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+
+def _add(values, value):
+    if not _contains(values, value):
+        insort(values, value)
+
+
+def _remove(values, value):
+    i = bisect_left(values, value)
+    if i < len(values) and values[i] == value:
+        del values[i]
+
+
+class Adjacency:
+    """Sorted neighbour arrays of one user."""
+    __slots__ = ('friends', 'pending_sent', 'pending_received', 'expires_at')
+
+    def __init__(self, expires_at):
+        self.friends = array('i')
+        self.pending_sent = array('i')
+        self.pending_received = array('i')
+        self.expires_at = expires_at
+
+
+class FriendGraph:
+    def __init__(self, ttl=30, max_users=100000):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, user_ids):
+        """Loads adjacency for user_ids from the database in batched queries."""
+        expires_at = time.monotonic() + self.ttl
+        loaded = {user_id: Adjacency(expires_at) for user_id in user_ids}
+        ids = list(loaded)
+        for start in range(0, len(ids), LOAD_BATCH_SIZE):
+            batch = ids[start:start + LOAD_BATCH_SIZE]
+            rows = db.session.query(Friendship.user1_id, Friendship.user2_id, Friendship.status).filter(
+                or_(Friendship.user1_id.in_(batch), Friendship.user2_id.in_(batch)),
+                Friendship.status.in_(('accepted', 'pending'))
+            ).all()
+            for requester_id, target_id, status in rows:
+                if requester_id in loaded:
+                    entry = loaded[requester_id]
+                    entry_list = entry.friends if status == 'accepted' else entry.pending_sent
+                    entry_list.append(target_id)
+                if target_id in loaded:
+                    entry = loaded[target_id]
+                    entry_list = entry.friends if status == 'accepted' else entry.pending_received
+                    entry_list.append(requester_id)
+        for entry in loaded.values():
+            for name in ('friends', 'pending_sent', 'pending_received'):
+                setattr(entry, name, array('i', sorted(set(getattr(entry, name)))))
+        return loaded
+
+    def adjacency_many(self, user_ids):
+        """Returns {user_id: Adjacency} for all user_ids, loading missing or expired ones together."""
+        now = time.monotonic()
+        result, missing = {}, []
+        with self._lock:
+            for user_id in set(user_ids):
+                entry = self._entries.get(user_id)
+                if entry is not None and entry.expires_at >= now:
+                    self._entries.move_to_end(user_id)
+                    result[user_id] = entry
+                else:
+                    missing.append(user_id)
+        if missing:
+            loaded = self._load(missing)
+            with self._lock:
+                self._entries.update(loaded)
+                while len(self._entries) > self.max_users:
+                    self._entries.popitem(last=False)
+            result.update(loaded)
+        return result
+
+    def adjacency(self, user_id):
+        return self.adjacency_many([user_id])[user_id]
+
+    def friends_of(self, user_id):
+        """Sorted array of user_id's accepted friends."""
+        return array('i', self.adjacency(user_id).friends)
+
+    def are_friends(self, user_a_id, user_b_id):
+        return _contains(self.adjacency(user_a_id).friends, user_b_id)
+
+    def relationship_status(self, viewer_id, other_id):
+        """'self', 'friends', 'pending_sent', 'pending_received' or 'none', from viewer_id's side."""
+        if viewer_id == other_id:
+            return 'self'
+        entry = self.adjacency(viewer_id)
+        if _contains(entry.friends, other_id):
+            return 'friends'
+        if _contains(entry.pending_sent, other_id):
+            return 'pending_sent'
+        if _contains(entry.pending_received, other_id):
+            return 'pending_received'
+        return 'none'
+
+    # --- Incremental updates (call after the change is committed) ---
+
+    def _cached(self, user_id):
+        entry = self._entries.get(user_id)
+        return entry if entry is not None and entry.expires_at >= time.monotonic() else None
+
+    def request_sent(self, requester_id, target_id):
+        with self._lock:
+            if (entry := self._cached(requester_id)) is not None:
+                _add(entry.pending_sent, target_id)
+            if (entry := self._cached(target_id)) is not None:
+                _add(entry.pending_received, requester_id)
+
+    def request_answered(self, requester_id, target_id, accepted):
+        with self._lock:
+            if (entry := self._cached(requester_id)) is not None:
+                _remove(entry.pending_sent, target_id)
+                if accepted:
+                    _add(entry.friends, target_id)
+            if (entry := self._cached(target_id)) is not None:
+                _remove(entry.pending_received, requester_id)
+                if accepted:
+                    _add(entry.friends, requester_id)
+
+    def user_deleted(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            for neighbour in self._entries.values():
+                _remove(neighbour.friends, user_id)
+                _remove(neighbour.pending_sent, user_id)
+                _remove(neighbour.pending_received, user_id)
+
+
+def init_app(app):
+    """Creates the app's friend graph from FRIEND_GRAPH_* settings."""
+    app.config.setdefault('FRIEND_GRAPH_TTL', 30)
+    app.config.setdefault('FRIEND_GRAPH_MAX_USERS', 100000)
+    app.extensions['friend_graph'] = FriendGraph(
+        ttl=app.config['FRIEND_GRAPH_TTL'], max_users=app.config['FRIEND_GRAPH_MAX_USERS']
+    )
+
+
+def get_graph():
+    return current_app.extensions['friend_graph']
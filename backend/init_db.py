@@ -1,6 +1,7 @@
 import sqlite3
 import os
 from passlib.hash import sha256_crypt # For hashing admin password
+import schema_migrations
 
 # Determine the absolute path to the project root directory
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -13,8 +14,8 @@ ADMIN_PASSWORD = "6094" # Plain text password
 
 def initialize_database():
     """
-    Initializes the database by creating tables from the schema.sql file
-    and creates an admin user if one doesn't exist.
+    Initializes the database by creating tables from the schema.sql file,
+    applies pending schema migrations and creates an admin user if one doesn't exist.
     """
     conn = None
     try:
@@ -33,6 +34,12 @@ def initialize_database():
         conn.commit()
         print("Database schema initialized successfully.")
 
+        # Bring existing databases up to date (columns, indexes, backfills)
+        applied_migrations = schema_migrations.migrate(conn)
+        for version, description in applied_migrations:
+            print(f"Applied migration {version}: {description}")
+        print(f"Database schema is at version {schema_migrations.current_version(conn)}.")
+
         # Check if admin user exists
         cursor.execute("SELECT id FROM users WHERE email = ?", (ADMIN_EMAIL,))
         admin_exists = cursor.fetchone()
@@ -46,6 +53,10 @@ def initialize_database():
                 "INSERT INTO users (full_name, email, password_hash, bio, created_at) VALUES (?, ?, ?, ?, ?)",
                 (ADMIN_FULL_NAME, ADMIN_EMAIL, hashed_password, "Default admin user account.", current_timestamp)
             )
+            cursor.execute(
+                "INSERT INTO users_fts (rowid, full_name, email) VALUES (?, ?, ?)",
+                (cursor.lastrowid, ADMIN_FULL_NAME, ADMIN_EMAIL)
+            )
             conn.commit()
             print(f"Admin user '{ADMIN_EMAIL}' created successfully.")
         else:
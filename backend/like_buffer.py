@@ -0,0 +1,253 @@
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import tuple_
+from database import db, insert_ignore
+from models import Post, Like
+import counters
+import response_cache
+
+# Optional write-behind mode for likes (LIKE_WRITE_BEHIND = True).
+#
+# A like toggle on a hot post otherwise takes SQLite's write lock and commits on
+# every request. In write-behind mode the toggle only records the user's intent
+# in memory; intents for the same (user, post) are coalesced (last write wins,
+# and a like undone before it was written disappears) and a background thread
+# writes them every LIKE_FLUSH_INTERVAL_MS in one transaction: one bulk INSERT
+# ... ON CONFLICT DO NOTHING, one DELETE, and one recount of the touched posts.
+#
+# The acting user sees their own pending likes right away: toggles read the
+# pending state before the database, and feed/profile like counts are adjusted
+# by overlay(). Other users see them after the flush. Pending intents are
+# flushed on shutdown (atexit and gunicorn's worker_exit), but a killed process
+# loses up to one interval of likes; the buffer is per process.
+
+
+class LikeBuffer:
+    def __init__(self, app, interval_ms=200, max_pending=10000):
+        self.app = app
+        self.interval = interval_ms / 1000.0
+        self.max_pending = max_pending
+        self._pending = {}    # (user_id, post_id) -> (liked, liked in the database, queued at)
+        self._flushing = {}   # Intents being written by the current flush
+        self._user_versions = defaultdict(int)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+        # Metrics
+        self.recorded = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flushed_intents = 0
+        self.failures = 0
+        self.last_flush_size = 0
+        self.max_flush_size = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def _ensure_thread(self):
+        # Started on first use so it runs in the serving process, not a pre-fork master
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='like-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def state(self, user_id, post_id):
+        """The user's pending like state for a post, or None if nothing is pending."""
+        key = (user_id, post_id)
+        with self._lock:
+            intent = self._pending.get(key) or self._flushing.get(key)
+        return intent[0] if intent else None
+
+    def record(self, user_id, post_id, liked, liked_in_database):
+        """Queues a like (liked=True) or unlike; liked_in_database is the state the caller read."""
+        key = (user_id, post_id)
+        with self._lock:
+            current = self._pending.get(key)
+            queued_at = time.monotonic()
+            if current is not None:
+                _, liked_in_database, queued_at = current
+                self.coalesced += 1
+            elif key in self._flushing:
+                liked_in_database = self._flushing[key][0] # The state the running flush is writing
+            if liked == liked_in_database:
+                self._pending.pop(key, None) # Undone before it was written
+            else:
+                self._pending[key] = (liked, liked_in_database, queued_at)
+            self._user_versions[user_id] += 1
+            self.recorded += 1
+            full = len(self._pending) >= self.max_pending
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def user_version(self, user_id):
+        """Changes whenever the user records an intent; part of the ETag of responses showing like counts."""
+        with self._lock:
+            return self._user_versions.get(user_id, 0)
+
+    def overlay(self, user_id, items):
+        """Adjusts likes_count of post dicts (with "id") for the user's own pending intents."""
+        with self._lock:
+            if not self._pending and not self._flushing:
+                return items
+            deltas = defaultdict(int)
+            for intents in (self._flushing, self._pending):
+                for (intent_user_id, post_id), (liked, liked_in_database, _) in intents.items():
+                    if intent_user_id == user_id:
+                        deltas[post_id] += int(liked) - int(liked_in_database)
+        for item in items:
+            if deltas.get(item.get('id')) and 'likes_count' in item:
+                item['likes_count'] += deltas[item['id']]
+        return items
+
+    def take(self, user_id, post_ids):
+        """
+        Removes and returns {post_id: intent} of the user's pending intents, for
+        callers writing likes directly. Waits for a flush in progress, so the
+        database already holds everything that isn't returned. If the caller's
+        transaction fails, hand the intents back with restore().
+        """
+        with self._flush_lock, self._lock:
+            return {post_id: self._pending.pop((user_id, post_id))
+                    for post_id in post_ids if (user_id, post_id) in self._pending}
+
+    def restore(self, user_id, intents):
+        """Queues intents returned by take() again; intents recorded since then win."""
+        if not intents:
+            return
+        with self._lock:
+            for post_id, intent in intents.items():
+                self._pending.setdefault((user_id, post_id), intent)
+            self._user_versions[user_id] += 1
+        self._ensure_thread()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                self.flush()
+
+    def flush(self):
+        """Writes every pending intent in one transaction (call inside an app context). Returns the number written."""
+        with self._flush_lock:
+            with self._lock:
+                intents, self._pending = self._pending, {}
+                self._flushing = intents
+            if not intents:
+                return 0
+            try:
+                self._write(intents)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                with self._lock:
+                    for key, intent in intents.items():
+                        self._pending.setdefault(key, intent) # Newer intents win
+                    self._flushing = {}
+                self.failures += 1
+                current_app.logger.error(f"Error flushing {len(intents)} buffered likes: {e}")
+                return 0
+
+            lag_ms = (time.monotonic() - min(intent[2] for intent in intents.values())) * 1000
+            with self._lock:
+                self._flushing = {}
+                pending_users = {user_id for user_id, _ in self._pending}
+                for user_id in [u for u in self._user_versions if u not in pending_users]:
+                    del self._user_versions[user_id]
+                self.flushes += 1
+                self.flushed_intents += len(intents)
+                self.last_flush_size = len(intents)
+                self.max_flush_size = max(self.max_flush_size, len(intents))
+                self.last_lag_ms = lag_ms
+                self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            return len(intents)
+
+    def _write(self, intents):
+        post_ids = {post_id for _, post_id in intents}
+        authors = dict(db.session.query(Post.id, Post.user_id).filter(Post.id.in_(post_ids)))
+        now = datetime.utcnow()
+        insert_ignore(Like, [{"user_id": user_id, "post_id": post_id, "created_at": now}
+                             for (user_id, post_id), intent in intents.items() if intent[0] and post_id in authors],
+                      ['user_id', 'post_id'])
+        removed = [key for key, intent in intents.items() if not intent[0]]
+        if removed:
+            Like.query.filter(tuple_(Like.user_id, Like.post_id).in_(removed)).delete(synchronize_session=False)
+        counters.recount(set(authors))
+        response_cache.bump(*{response_cache.user_scope(author_id) for author_id in authors.values()})
+
+    def shutdown(self):
+        """Stops the flusher and writes whatever is still pending."""
+        self._stopped = True
+        self._wakeup.set()
+        if self._pending:
+            with self.app.app_context():
+                self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "recorded": self.recorded,
+                "coalesced": self.coalesced,
+                "flushes": self.flushes,
+                "flushed_intents": self.flushed_intents,
+                "failures": self.failures,
+                "last_flush_size": self.last_flush_size,
+                "max_flush_size": self.max_flush_size,
+                "last_lag_ms": round(self.last_lag_ms, 1),
+                "max_lag_ms": round(self.max_lag_ms, 1)
+            }
+
+
+def init_app(app):
+    """Creates the app's like buffer when LIKE_WRITE_BEHIND is enabled."""
+    app.config.setdefault('LIKE_WRITE_BEHIND', os.environ.get('LIKE_WRITE_BEHIND', '').lower() in ('1', 'true'))
+    app.config.setdefault('LIKE_FLUSH_INTERVAL_MS', 200)
+    app.config.setdefault('LIKE_BUFFER_MAX_PENDING', 10000) # Flush early once this many intents are queued
+    app.extensions['like_buffer'] = LikeBuffer(
+        app,
+        interval_ms=app.config['LIKE_FLUSH_INTERVAL_MS'],
+        max_pending=app.config['LIKE_BUFFER_MAX_PENDING']
+    ) if app.config['LIKE_WRITE_BEHIND'] else None
+
+
+def get_buffer():
+    """The app's like buffer, or None when likes are written directly."""
+    return current_app.extensions['like_buffer']
+
+
+def state(user_id, post_id):
+    buffer = get_buffer()
+    return buffer.state(user_id, post_id) if buffer is not None else None
+
+
+def overlay(user_id, items):
+    buffer = get_buffer()
+    return buffer.overlay(user_id, items) if buffer is not None else items
+
+
+def user_version(user_id):
+    buffer = get_buffer()
+    return buffer.user_version(user_id) if buffer is not None else 0
+
+
+def take(user_id, post_ids):
+    buffer = get_buffer()
+    return buffer.take(user_id, post_ids) if buffer is not None else {}
+
+
+def restore(user_id, intents):
+    buffer = get_buffer()
+    if buffer is not None:
+        buffer.restore(user_id, intents)
@@ -0,0 +1,322 @@
+import os
+import re
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from flask import current_app, has_app_context
+from sqlalchemy import event, select, update
+from database import RoutingSession, upsert
+from models import db, MediaObject
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError: # Only needed for MEDIA_BACKEND=s3
+    boto3 = None
+
+# Content-addressed storage for uploaded media.
+#
+# An object's key is derived from the SHA-256 of its bytes
+# ("posts/ab/cd/abcd...ef.jpg"), so identical uploads are stored once. The
+# media_objects table counts how many posts and avatars reference each key;
+# references are taken and dropped in the same transaction as the post or
+# profile change, and once that transaction commits with a key at zero the
+# object and its derived files (resized variants, "<key stem>_*") are deleted.
+#
+# An upload of content that is already stored doesn't write it again, but it
+# refreshes the object's modification time before taking its reference, and
+# objects modified in the last MEDIA_COLLECT_GRACE_SECONDS are never deleted
+# after commit. So when the last reference to an object is dropped while a new
+# upload of the same bytes is being committed, the object survives; if no
+# reference arrives, `flask gc-media` removes it later.
+#
+# Storage goes through a MediaBackend: a local directory (the default, served
+# from /static/uploads) or any S3-compatible service such as MinIO.
+
+KEY_PATTERN = re.compile(r'^(posts|avatars)/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.(png|jpg|gif|webp)$')
+
+# Objects and the files derived from them ("<stem>_<width>.webp"); their content never changes
+STORED_FILE_PATTERN = re.compile(r'^(posts|avatars)/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(_\d+)?\.(png|jpg|gif|webp)$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def object_key(kind, digest, extension):
+    """Sharded key of an object, e.g. posts/ab/cd/<digest>.jpg."""
+    return f"{kind}/{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+
+def key_stem(key):
+    return key.rsplit('.', 1)[0]
+
+
+class MediaBackend(ABC):
+    """Blob storage interface used by MediaStore."""
+
+    @abstractmethod
+    def exists(self, key):
+        """Whether an object is stored under key."""
+
+    @abstractmethod
+    def put_file(self, path, key, content_type):
+        """Copies the local file at path to key."""
+
+    @abstractmethod
+    def touch(self, key, content_type):
+        """Sets an object's modification time to now. Returns False if there is no object under key."""
+
+    @abstractmethod
+    def delete(self, key):
+        """Deletes the object under key, if any."""
+
+    @abstractmethod
+    def list_keys(self, prefix=''):
+        """Yields (key, modified_at_epoch_seconds) for every object under prefix."""
+
+    @abstractmethod
+    def url(self, key):
+        """The public URL of key."""
+
+
+class LocalMediaBackend(MediaBackend):
+    def __init__(self, root, base_url):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def put_file(self, path, key, content_type):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(path, temp_path)
+        os.replace(temp_path, target) # Readers never see a partially written object
+
+    def touch(self, key, content_type):
+        try:
+            os.utime(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list_keys(self, prefix=''):
+        directory = prefix.rpartition('/')[0]
+        start = self._path(directory) if directory else self.root
+        for dirpath, _, filenames in os.walk(start):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if key.startswith(prefix) and not filename.endswith('.tmp'):
+                    yield key, os.path.getmtime(path)
+
+    def url(self, key):
+        return f"{self.base_url}/{key}"
+
+
+class S3MediaBackend(MediaBackend):
+    def __init__(self, bucket, public_url, endpoint_url=None, region=None):
+        if boto3 is None:
+            raise RuntimeError("MEDIA_BACKEND=s3 requires boto3 (pip install boto3).")
+        self.bucket = bucket
+        self.public_url = public_url.rstrip('/')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put_file(self, path, key, content_type):
+        self.client.upload_file(path, self.bucket, key, ExtraArgs={
+            'ContentType': content_type,
+            'CacheControl': IMMUTABLE_CACHE_CONTROL # Keys are content hashes, so objects never change
+        })
+
+    def touch(self, key, content_type):
+        # S3 has no touch: copying the object onto itself sets LastModified
+        try:
+            self.client.copy_object(Bucket=self.bucket, Key=key, CopySource={'Bucket': self.bucket, 'Key': key},
+                                    MetadataDirective='REPLACE', ContentType=content_type,
+                                    CacheControl=IMMUTABLE_CACHE_CONTROL)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list_keys(self, prefix=''):
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'], item['LastModified'].timestamp()
+
+    def url(self, key):
+        return f"{self.public_url}/{key}"
+
+
+class MediaStore:
+    def __init__(self, backend, collect_grace_seconds=300):
+        self.backend = backend
+        self.collect_grace_seconds = collect_grace_seconds
+
+    def url(self, key):
+        return self.backend.url(key)
+
+    def key_for_url(self, url):
+        """The key of a content-addressed object URL, or None for anything else (e.g. legacy uploads)."""
+        prefix = self.backend.url('')
+        if not url or not url.startswith(prefix):
+            return None
+        key = url[len(prefix):]
+        return key if KEY_PATTERN.match(key) else None
+
+    def put(self, path, key, content_type):
+        """
+        Stores a local file under key, or only refreshes the modification time of
+        an identical object that is already stored. Returns True if written.
+        """
+        if self.backend.touch(key, content_type):
+            return False # Now too recent for collect() to delete before the caller's reference commits
+        self.backend.put_file(path, key, content_type)
+        return True
+
+    # --- References (run inside the caller's transaction) ---
+
+    def add_reference(self, key, size, content_type):
+        """Counts a new reference to a just-stored object, creating its row on first use."""
+        upsert(MediaObject, {'key': key, 'size': size, 'content_type': content_type, 'refcount': 1},
+               ['key'], {'refcount': MediaObject.refcount + 1})
+
+    def acquire(self, url):
+        """
+        Counts a reference to an already stored object (e.g. an image_url pointing at one).
+        Returns False if url names a stored object that has since been deleted; other
+        URLs (legacy uploads, external images) aren't counted and return True.
+        """
+        key = self.key_for_url(url)
+        if not key:
+            return True
+        result = db.session.execute(update(MediaObject).where(MediaObject.key == key, MediaObject.refcount > 0)
+                                    .values(refcount=MediaObject.refcount + 1))
+        return result.rowcount == 1
+
+    def release(self, url):
+        """Drops a reference; the object is deleted after commit if it was the last one."""
+        key = self.key_for_url(url)
+        if not key:
+            return
+        db.session.execute(update(MediaObject).where(MediaObject.key == key, MediaObject.refcount > 0)
+                           .values(refcount=MediaObject.refcount - 1))
+        deleted = db.session.query(MediaObject).filter(MediaObject.key == key, MediaObject.refcount <= 0)\
+                            .delete(synchronize_session=False)
+        if deleted:
+            db.session.info.setdefault('media_garbage', set()).add(key)
+
+    # --- Deletion ---
+
+    def delete_object(self, key):
+        """Deletes an object and every file derived from it."""
+        for derived_key, _ in list(self.backend.list_keys(key_stem(key) + '_')):
+            self.backend.delete(derived_key)
+        self.backend.delete(key)
+
+    def collect(self, keys):
+        """
+        Deletes the objects for keys that are still unreferenced (a new upload may
+        have revived one), except those modified in the last collect_grace_seconds.
+        """
+        # Runs after commit, when the session can't emit SQL, so check on a connection of its own
+        with db.engine.connect() as conn:
+            revived = set(conn.scalars(select(MediaObject.key).where(MediaObject.key.in_(keys))))
+        cutoff = time.time() - self.collect_grace_seconds
+        for key in set(keys) - revived:
+            modified_at = dict(self.backend.list_keys(key)).get(key)
+            if modified_at is None or modified_at < cutoff: # Recent ones are left to sweep()
+                self.delete_object(key)
+
+    def sweep(self, grace_seconds=3600):
+        """
+        Deletes stored objects without a media_objects row that are older than
+        grace_seconds, i.e. uploads whose request failed before committing.
+        Returns the number of objects deleted.
+        """
+        cutoff = time.time() - grace_seconds
+        candidates = [key for key, modified_at in self.backend.list_keys()
+                      if KEY_PATTERN.match(key) and modified_at < cutoff]
+        referenced = set()
+        for start in range(0, len(candidates), 500):
+            batch = candidates[start:start + 500]
+            referenced.update(key for (key,) in db.session.query(MediaObject.key).filter(MediaObject.key.in_(batch)))
+        orphans = [key for key in candidates if key not in referenced]
+        for key in orphans:
+            self.delete_object(key)
+        return len(orphans)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _collect_garbage(db_session):
+    keys = db_session.info.pop('media_garbage', None)
+    if not keys or not has_app_context():
+        return
+    try:
+        get_store().collect(keys)
+    except Exception as e:
+        # The objects stay behind until the next sweep (flask gc-media)
+        current_app.logger.error(f"Error deleting unreferenced media {sorted(keys)}: {e}")
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_garbage(db_session):
+    db_session.info.pop('media_garbage', None)
+
+
+def init_app(app):
+    """Creates the app's media store from MEDIA_* settings."""
+    app.config.setdefault('MEDIA_BACKEND', os.environ.get('MEDIA_BACKEND', 'local'))
+    app.config.setdefault('MEDIA_URL', '/static/uploads')
+    app.config.setdefault('MEDIA_S3_BUCKET', os.environ.get('MEDIA_S3_BUCKET'))
+    app.config.setdefault('MEDIA_S3_ENDPOINT_URL', os.environ.get('MEDIA_S3_ENDPOINT_URL')) # e.g. a local MinIO
+    app.config.setdefault('MEDIA_S3_PUBLIC_URL', os.environ.get('MEDIA_S3_PUBLIC_URL'))
+    app.config.setdefault('MEDIA_S3_REGION', os.environ.get('MEDIA_S3_REGION'))
+    app.config.setdefault('MEDIA_COLLECT_GRACE_SECONDS', 300)
+    if app.config['MEDIA_BACKEND'] == 's3':
+        backend = S3MediaBackend(
+            bucket=app.config['MEDIA_S3_BUCKET'],
+            public_url=app.config['MEDIA_S3_PUBLIC_URL']
+                or f"{app.config['MEDIA_S3_ENDPOINT_URL']}/{app.config['MEDIA_S3_BUCKET']}",
+            endpoint_url=app.config['MEDIA_S3_ENDPOINT_URL'],
+            region=app.config['MEDIA_S3_REGION']
+        )
+    else:
+        os.makedirs(app.config['MEDIA_ROOT'], exist_ok=True)
+        backend = LocalMediaBackend(app.config['MEDIA_ROOT'], app.config['MEDIA_URL'])
+    app.extensions['media_store'] = MediaStore(backend, collect_grace_seconds=app.config['MEDIA_COLLECT_GRACE_SECONDS'])
+
+
+def get_store():
+    return current_app.extensions['media_store']
+
+
+def acquire(url):
+    return get_store().acquire(url)
+
+
+def release(url):
+    get_store().release(url)
@@ -0,0 +1,396 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from database import RoutingSession, db
+
+# Prometheus metrics, served at GET /metrics in the text exposition format.
+#
+# Counters and histograms live in a small in-process registry: recording a
+# value is a dict update under the metric's own lock. Gauges and the cache
+# counters kept by other modules are read from callbacks when metrics are
+# collected. Exported:
+#
+#   http_requests_total, http_request_errors_total (status >= 400)
+#   http_request_duration_seconds, http_request_size_bytes, http_response_size_bytes
+#     (by route pattern, e.g. /api/profile/<int:user_id>; streamed responses are
+#     timed until their first byte)
+#   db_commit_duration_seconds, db_pool_connections
+#   cache_requests_total (user_cache, response_cache), uploads_total, upload_bytes_total
+#
+# /metrics requires `Authorization: Bearer <METRICS_AUTH_TOKEN>`; without a
+# token it answers 401 unless METRICS_ALLOW_ANONYMOUS is set, e.g. when only
+# a private network can reach the app.
+#
+# With several worker processes (gunicorn, uvicorn --workers) set METRICS_DIR
+# to a directory shared by them. Every process then writes its values to
+# METRICS_DIR/metrics-<pid>-<random id>.json every METRICS_WRITE_SECONDS and
+# when it exits (the random id stops a later process that is given the same
+# pid from overwriting the file of an exited one), and /metrics adds up the
+# files of all processes: counters and histograms include workers that have
+# exited (so totals don't drop when a worker is recycled), gauges only running
+# ones. Workers never delete files: a
+# new one can start at any time (uvicorn --workers, or gunicorn without
+# preloading) and must not drop the totals of exited ones. The directory is
+# emptied when the server starts instead, by serve.py or `flask clear-metrics`.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels -> [count per bucket (last is +Inf)..., sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+            entry[index] += 1
+            entry[-1] += value
+
+    def samples(self):
+        with self._lock:
+            return [(labels, list(entry)) for labels, entry in self._values.items()]
+
+
+class CallbackMetric:
+    """A counter or gauge whose samples ([(labels, value)]) are read from function() at collection time."""
+
+    def __init__(self, kind, name, help_text, labelnames, function):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.function = function
+
+    def samples(self):
+        return list(self.function())
+
+
+class Registry:
+    def __init__(self, directory=None, write_seconds=5.0):
+        self.directory = directory
+        self.write_seconds = write_seconds
+        self.metrics = []
+        self._thread = None
+        self._pid = None
+        self._file_pid = None
+        self._file_name = None
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """This process's values, as written to METRICS_DIR."""
+        snapshot = {}
+        for metric in self.metrics:
+            entry = {"type": metric.kind, "help": metric.help, "labelnames": list(metric.labelnames),
+                     "samples": [[list(labels), value] for labels, value in metric.samples()]}
+            if isinstance(metric, Histogram):
+                entry["buckets"] = list(metric.buckets)
+            snapshot[metric.name] = entry
+        return snapshot
+
+    # --- Multi-process aggregation ---
+
+    def _own_path(self):
+        with self._lock:
+            if self._file_pid != os.getpid(): # First write in this process (or in a forked worker)
+                self._file_pid = os.getpid()
+                self._file_name = f'metrics-{self._file_pid}-{uuid.uuid4().hex[:12]}.json'
+        return os.path.join(self.directory, self._file_name)
+
+    def ensure_writer(self):
+        # Started on first use so it runs in the serving process, not a pre-fork master
+        if not self.directory or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.write)
+
+    def _run(self):
+        while True:
+            time.sleep(self.write_seconds)
+            self.write()
+
+    def write(self):
+        """Writes this process's snapshot to METRICS_DIR."""
+        if not self.directory:
+            return
+        path = self._own_path()
+        temp_path = f'{path}.tmp'
+        try:
+            with open(temp_path, 'w') as out:
+                json.dump(self.snapshot(), out)
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            if has_app_context():
+                current_app.logger.error(f"Error writing metrics snapshot {path}: {e}")
+
+    def remove_files(self):
+        """
+        Deletes every snapshot in METRICS_DIR, resetting the totals. Only for the
+        launcher, before any worker starts: removing the files of exited workers
+        while others run would make counters go backwards. Returns the number removed.
+        """
+        removed = 0
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json*')): # Including .tmp leftovers
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def collect(self):
+        """{name: snapshot entry} with the values of every process (see the module comment)."""
+        merged = self.snapshot()
+        if not self.directory:
+            return merged
+        own_path = self._own_path()
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            if path == own_path:
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue # Being replaced, or left half-written by a killed process
+            running = _is_running(_pid_of(path))
+            for name, entry in snapshot.items():
+                if entry["type"] == 'gauge' and not running:
+                    continue
+                target = merged.setdefault(name, {**entry, "samples": []})
+                _add_samples(target, entry["samples"])
+        return merged
+
+
+def _pid_of(path):
+    try:
+        return int(os.path.basename(path).split('-')[1]) # metrics-<pid>-<random id>.json
+    except (IndexError, ValueError):
+        return None
+
+
+def _is_running(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _add_samples(target, samples):
+    by_labels = {tuple(labels): index for index, (labels, _) in enumerate(target["samples"])}
+    for labels, value in samples:
+        index = by_labels.get(tuple(labels))
+        if index is None:
+            by_labels[tuple(labels)] = len(target["samples"])
+            target["samples"].append([labels, value])
+        elif isinstance(value, list):
+            target["samples"][index][1] = [a + b for a, b in zip(target["samples"][index][1], value)]
+        else:
+            target["samples"][index][1] += value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(collected):
+    """The Prometheus text exposition of collect()."""
+    lines = []
+    for name, entry in collected.items():
+        lines.append(f'# HELP {name} {entry["help"]}')
+        lines.append(f'# TYPE {name} {entry["type"]}')
+        names = entry["labelnames"]
+        for labels, value in entry["samples"]:
+            if entry["type"] != 'histogram':
+                lines.append(f'{name}{_labels(names, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(entry["buckets"]) + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(float(bound))
+                lines.append(f'{name}_bucket{_labels(names, labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(names, labels)} {_number(float(value[-1]))}')
+            lines.append(f'{name}_count{_labels(names, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class AppMetrics:
+    """The API's metrics and the request hooks that record them."""
+
+    def __init__(self, app, registry):
+        self.registry = registry
+        self.requests = registry.register(Counter(
+            'http_requests_total', 'HTTP requests by route and status.', ('method', 'route', 'status')))
+        self.errors = registry.register(Counter(
+            'http_request_errors_total', 'HTTP responses with status >= 400.', ('method', 'route', 'status')))
+        self.duration = registry.register(Histogram(
+            'http_request_duration_seconds', 'Time to produce a response.', ('method', 'route')))
+        self.request_size = registry.register(Histogram(
+            'http_request_size_bytes', 'Request body sizes.', ('route',), SIZE_BUCKETS))
+        self.response_size = registry.register(Histogram(
+            'http_response_size_bytes', 'Response body sizes (when known up front).', ('route',), SIZE_BUCKETS))
+        self.commit_duration = registry.register(Histogram(
+            'db_commit_duration_seconds', 'Database session commit time.'))
+        self.uploads = registry.register(Counter('uploads_total', 'Stored image uploads.', ('kind',)))
+        self.upload_bytes = registry.register(Counter('upload_bytes_total', 'Bytes of stored image uploads.', ('kind',)))
+        registry.register(CallbackMetric(
+            'gauge', 'db_pool_connections', 'Database pool connections by state.', ('bind', 'state'),
+            lambda: _pool_samples(app)))
+        registry.register(CallbackMetric(
+            'counter', 'cache_requests_total', 'Cache lookups by result.', ('cache', 'result'),
+            lambda: _cache_samples(app)))
+
+    def before_request(self):
+        self.registry.ensure_writer()
+        g.metrics_started = time.perf_counter()
+
+    def after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        status = str(response.status_code)
+        self.duration.observe((request.method, route), time.perf_counter() - started)
+        self.requests.inc((request.method, route, status))
+        if response.status_code >= 400:
+            self.errors.inc((request.method, route, status))
+        self.request_size.observe((route,), request.content_length or 0)
+        if response.content_length is not None:
+            self.response_size.observe((route,), response.content_length)
+        return response
+
+
+def _pool_samples(app):
+    samples = []
+    with app.app_context():
+        engines = dict(db.engines)
+    for bind, engine in engines.items():
+        pool = engine.pool
+        if not hasattr(pool, 'checkedout'):
+            continue # e.g. the single-connection pool of in-memory SQLite
+        bind = bind or 'primary'
+        samples.append(((bind, 'checked_out'), pool.checkedout()))
+        samples.append(((bind, 'idle'), pool.checkedin()))
+        samples.append(((bind, 'overflow'), max(0, pool.overflow())))
+    return samples
+
+
+def _cache_samples(app):
+    users = app.extensions['user_cache'].stats()
+    responses = app.extensions['response_cache'].stats()
+    return [
+        (('user_cache', 'hit'), users['hits']),
+        (('user_cache', 'miss'), users['misses']),
+        (('response_cache', 'hit'), responses['body_hits']),
+        (('response_cache', 'miss'), responses['body_misses']),
+        (('response_cache', 'not_modified'), responses['not_modified']),
+    ]
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _commit_started(db_session):
+    db_session.info['metrics_commit_started'] = time.perf_counter()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _commit_finished(db_session):
+    started = db_session.info.pop('metrics_commit_started', None)
+    if started is not None and has_app_context():
+        metrics = current_app.extensions.get('metrics')
+        if metrics is not None:
+            metrics.commit_duration.observe((), time.perf_counter() - started)
+
+
+def init_app(app):
+    """Creates the app's metrics and request hooks from METRICS_* settings."""
+    app.config.setdefault('METRICS_ENABLED', os.environ.get('METRICS_ENABLED', '1').lower() in ('1', 'true'))
+    app.config.setdefault('METRICS_DIR', os.environ.get('METRICS_DIR'))      # Shared by worker processes
+    app.config.setdefault('METRICS_WRITE_SECONDS', 5.0)
+    app.config.setdefault('METRICS_AUTH_TOKEN', os.environ.get('METRICS_AUTH_TOKEN')) # Bearer token required by /metrics
+    app.config.setdefault('METRICS_ALLOW_ANONYMOUS',
+                          os.environ.get('METRICS_ALLOW_ANONYMOUS', '').lower() in ('1', 'true'))
+    if not app.config['METRICS_ENABLED']:
+        app.extensions['metrics'] = None
+        return
+
+    directory = app.config['METRICS_DIR']
+    registry = Registry(directory=directory, write_seconds=app.config['METRICS_WRITE_SECONDS'])
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    metrics = app.extensions['metrics'] = AppMetrics(app, registry)
+    app.before_request(metrics.before_request)
+    app.after_request(metrics.after_request)
+
+
+def get_metrics():
+    """The app's metrics, or None when METRICS_ENABLED is off."""
+    return current_app.extensions['metrics']
+
+
+def count_upload(kind, size):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.uploads.inc((kind,))
+        metrics.upload_bytes.inc((kind,), size)
@@ -1,6 +1,6 @@
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-from app import db
+from database import db
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -40,6 +40,14 @@ class Post(db.Model):
     content = db.Column(db.Text, nullable=False)
     image_url = db.Column(db.String(255), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Denormalized counters, maintained by counters.py
+    likes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comments_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.Index('ix_posts_user_created', 'user_id', 'created_at'),
+        db.Index('ix_posts_created', 'created_at', 'id'),
+    )
 
     likes = db.relationship('Like', backref='post', lazy=True, cascade="all, delete-orphan")
     comments = db.relationship('Comment', backref='post', lazy=True, cascade="all, delete-orphan")
@@ -52,7 +60,11 @@ class Friendship(db.Model):
     status = db.Column(db.String(20), nullable=False, default='pending') # 'pending', 'accepted', 'declined'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    __table_args__ = (db.UniqueConstraint('user1_id', 'user2_id', name='_user1_user2_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('user1_id', 'user2_id', name='_user1_user2_uc'),
+        db.Index('ix_friendships_user1_status', 'user1_id', 'status'),
+        db.Index('ix_friendships_user2_status', 'user2_id', 'status'),
+    )
 
 class Group(db.Model):
     __tablename__ = 'groups'
@@ -73,7 +85,10 @@ class GroupMember(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    __table_args__ = (db.UniqueConstraint('group_id', 'user_id', name='_group_user_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('group_id', 'user_id', name='_group_user_uc'),
+        db.Index('ix_group_members_user', 'user_id'),
+    )
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -89,16 +104,21 @@ class Message(db.Model):
             '(receiver_id IS NOT NULL AND group_id IS NULL) OR (receiver_id IS NULL AND group_id IS NOT NULL)',
             name='message_target_check'
         ),
+        db.Index('ix_messages_direct', 'sender_id', 'receiver_id', 'created_at'),
+        db.Index('ix_messages_group_created', 'group_id', 'created_at'),
     )
 
 class PasswordResetToken(db.Model):
+    """A user's outstanding password reset; the token itself is never stored, see reset_tokens.py."""
     __tablename__ = 'password_resets'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    token = db.Column(db.String(255), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), unique=True, nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False) # SHA-256 hex digest
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     expires_at = db.Column(db.DateTime, nullable=False)
 
+    __table_args__ = (db.Index('ix_password_resets_expires', 'expires_at'),)
+
 
 class Like(db.Model):
     __tablename__ = 'likes'
@@ -107,7 +127,10 @@ class Like(db.Model):
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'post_id', name='_user_post_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='_user_post_uc'),
+        db.Index('ix_likes_post', 'post_id'),
+    )
 
 class Comment(db.Model):
     __tablename__ = 'comments'
@@ -115,4 +138,55 @@ class Comment(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_comments_post_created', 'post_id', 'created_at'),)
+
+class TimelineEntry(db.Model):
+    __tablename__ = 'timeline_entries'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False) # Owner of the timeline
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False) # Copied from the post so a page is a single range scan
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'post_id', name='_timeline_user_post_uc'),
+        db.Index('ix_timeline_user_created', 'user_id', 'created_at', 'post_id'),
+    )
+
+class MediaObject(db.Model):
+    __tablename__ = 'media_objects'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    key = db.Column(db.String(255), unique=True, nullable=False) # Content-addressed storage key, see media_store.py
+    size = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(50), nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0) # Posts and avatars using this object
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+    scope = db.Column(db.String(100), primary_key=True) # e.g. "user:5", see response_cache.py
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class TokenRevocation(db.Model):
+    """A revoked bearer token (jti) or every token of a user issued up to the second of revoked_before, see tokens.py."""
+    __tablename__ = 'token_revocations'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    jti = db.Column(db.String(32), nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    revoked_before = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False) # Kept until the revoked tokens have expired anyway
+
+    __table_args__ = (db.Index('ix_token_revocations_expires', 'expires_at'),)
+
+class RealtimeEvent(db.Model):
+    """One event on one channel of the real-time bus; the id is its Last-Event-ID, see events.py."""
+    __tablename__ = 'realtime_events'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    channel = db.Column(db.String(50), nullable=False) # e.g. "user:5"
+    type = db.Column(db.String(50), nullable=False)
+    data = db.Column(db.Text, nullable=False) # JSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_realtime_events_created', 'created_at'),)
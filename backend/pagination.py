@@ -0,0 +1,87 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+# Keyset ("cursor") pagination. Instead of OFFSET + COUNT(*), each page remembers
+# the sort key of its last row and the next page starts strictly after it, so deep
+# pages cost the same as the first one. Listings opt in with ?cursor= (empty for
+# the first page) or ?before_id=<id>; the classic page/limit responses are unchanged.
+
+def wants_cursor(args):
+    """True if the request opted into cursor pagination."""
+    return 'cursor' in args or 'before_id' in args
+
+
+def encode_cursor(values):
+    """Encodes a sort key (datetimes and ints) into an opaque URL-safe cursor."""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor produced by encode_cursor. Raises ValueError if it is malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor.")
+    if not isinstance(payload, list) or not payload:
+        raise ValueError("Invalid cursor.")
+    return [_decode_value(v) for v in payload]
+
+
+def _decode_value(value):
+    # Sort keys are only ever ints and datetimes; anything else would be bound into the query as is
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    raise ValueError("Invalid cursor.")
+
+
+def position_from_args(args, anchor_for_id=None):
+    """
+    Returns the sort key to continue after, or None for the first page.
+    `anchor_for_id` maps a ?before_id= row id to that row's sort key.
+    Raises ValueError for a malformed cursor or an unknown before_id.
+    """
+    cursor = args.get('cursor')
+    if cursor:
+        return decode_cursor(cursor)
+    if 'before_id' in args:
+        before_id = args.get('before_id', type=int)
+        anchor = anchor_for_id(before_id) if before_id is not None and anchor_for_id else None
+        if anchor is None:
+            raise ValueError("Invalid before_id.")
+        return list(anchor)
+    return None
+
+
+def _after(columns, position, descending):
+    """Builds the row-value comparison `(c1, c2, ...) < (v1, v2, ...)` portably."""
+    clauses = []
+    for i, column in enumerate(columns):
+        equal_prefix = [columns[j] == position[j] for j in range(i)]
+        beyond = column < position[i] if descending else column > position[i]
+        clauses.append(and_(*equal_prefix, beyond))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, columns, limit, position=None, key=None, descending=True):
+    """
+    Fetches one page of `query` (already ordered by `columns`) after `position`.
+    `key` extracts the sort key from a result row. Returns (items, next_cursor);
+    next_cursor is None on the last page.
+    """
+    if position is not None:
+        if len(position) != len(columns):
+            raise ValueError("Invalid cursor.")
+        query = query.filter(_after(columns, position, descending))
+    rows = query.limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = encode_cursor(key(items[-1])) if len(rows) > limit and items else None
+    return items, next_cursor
@@ -0,0 +1,212 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from passlib.hash import sha256_crypt
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Password hashing and login throttling.
+#
+# Hashing and verification are deliberately slow, so they run in a small pool
+# of worker processes (PASSWORD_HASH_WORKERS) instead of on request threads, and
+# at most PASSWORD_HASH_MAX_PENDING jobs may wait for it: beyond that requests
+# get 503 instead of queueing up behind a login storm.
+#
+# New hashes use PASSWORD_HASH_METHOD (any werkzeug method, e.g. "scrypt" or
+# "pbkdf2:sha256:600000"). Existing werkzeug hashes with other parameters and
+# passlib sha256_crypt hashes ("$5$...", written by init_db.py) still verify,
+# and are replaced with the configured scheme on the next successful login.
+#
+# LoginThrottle limits attempts per client IP and failed attempts per email,
+# and is checked before any hashing work is done.
+
+
+class HasherBusy(Exception):
+    """Too many hashing jobs are already waiting."""
+
+
+def _scheme_of(stored_hash):
+    return stored_hash.split('$', 1)[0]
+
+
+def _verify(stored_hash, password, method, method_tag):
+    """Runs in a worker process. Returns (valid, replacement hash or None)."""
+    if stored_hash.startswith('$5$'):
+        valid = sha256_crypt.verify(password, stored_hash)
+    else:
+        valid = check_password_hash(stored_hash, password)
+    if valid and _scheme_of(stored_hash) != method_tag:
+        return True, generate_password_hash(password, method)
+    return valid, None
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', workers=2, max_pending=64, wait_seconds=2.0):
+        self.method = method
+        self.method_tag = _scheme_of(generate_password_hash('', method)) # e.g. "scrypt:32768:8:1"
+        self.workers = workers
+        self.wait_seconds = wait_seconds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.rehashed = 0
+
+    def _get_executor(self):
+        # Created on first use, in the serving process (not a pre-fork master)
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                # forkserver: worker processes don't inherit this process's threads and locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver')
+                )
+            return self._executor
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        if not self._slots.acquire(timeout=self.wait_seconds):
+            self.rejected += 1
+            raise HasherBusy()
+        try:
+            return self._get_executor().submit(function, *args).result()
+        except BrokenProcessPool:
+            with self._lock:
+                self._executor = None # A worker died; start a fresh pool next time
+            raise
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        """Returns (valid, replacement hash or None); a replacement means the stored scheme is outdated."""
+        if not stored_hash:
+            return False, None
+        valid, new_hash = self._run(_verify, stored_hash, password, self.method, self.method_tag)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def stats(self):
+        return {"method": self.method_tag, "workers": self.workers, "rejected": self.rejected, "rehashed": self.rehashed}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _normalize_email(email):
+    return str(email).strip().lower()
+
+
+class LoginThrottle:
+    """
+    Sliding-window limits: at most ip_attempts login attempts per IP and
+    email_failures failed attempts per (email, IP) pair within window_seconds.
+    Failures are counted per pair so that nobody can lock an account out by
+    failing logins for it from their own address.
+    """
+
+    def __init__(self, ip_attempts=30, email_failures=5, window_seconds=300, max_tracked=100000):
+        self.ip_attempts = ip_attempts
+        self.email_failures = email_failures
+        self.window = window_seconds
+        self.max_tracked = max_tracked
+        self._ips = OrderedDict()      # ip -> deque of attempt times
+        self._emails = OrderedDict()   # (email, ip) -> deque of failure times
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def _recent(self, table, key, now):
+        times = table.get(key)
+        if times is None:
+            return None
+        while times and times[0] <= now - self.window:
+            times.popleft()
+        return times
+
+    def _record(self, table, key, now):
+        times = self._recent(table, key, now)
+        if times is None:
+            times = table[key] = deque()
+        times.append(now)
+        table.move_to_end(key)
+        while len(table) > self.max_tracked:
+            table.popitem(last=False)
+
+    def attempt(self, email, ip):
+        """Counts an attempt. Returns None if allowed, otherwise the seconds to wait before retrying."""
+        now = time.monotonic()
+        pair = (_normalize_email(email), ip)
+        with self._lock:
+            for table, key, limit in ((self._ips, ip, self.ip_attempts), (self._emails, pair, self.email_failures)):
+                times = self._recent(table, key, now)
+                if times is not None and len(times) >= limit:
+                    self.throttled += 1
+                    return max(1, int(times[0] + self.window - now) + 1)
+            self._record(self._ips, ip, now)
+        return None
+
+    def failed(self, email, ip):
+        with self._lock:
+            self._record(self._emails, (_normalize_email(email), ip), time.monotonic())
+
+    def succeeded(self, email, ip):
+        with self._lock:
+            self._emails.pop((_normalize_email(email), ip), None)
+
+    def stats(self):
+        with self._lock:
+            return {"tracked_ips": len(self._ips), "tracked_email_ips": len(self._emails), "throttled": self.throttled}
+
+
+def init_app(app):
+    """Creates the app's password hasher and login throttle from PASSWORD_*/LOGIN_* settings."""
+    app.config.setdefault('PASSWORD_HASH_METHOD', os.environ.get('PASSWORD_HASH_METHOD', 'scrypt'))
+    app.config.setdefault('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)) # 0 hashes on the request thread
+    app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 64)
+    app.config.setdefault('PASSWORD_HASH_WAIT_SECONDS', 2.0)  # Wait this long for a slot before answering 503
+    app.config.setdefault('LOGIN_MAX_ATTEMPTS_PER_IP', 30)
+    app.config.setdefault('LOGIN_MAX_FAILURES_PER_EMAIL', 5)
+    app.config.setdefault('LOGIN_WINDOW_SECONDS', 300)
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        wait_seconds=app.config['PASSWORD_HASH_WAIT_SECONDS']
+    )
+    app.extensions['login_throttle'] = LoginThrottle(
+        ip_attempts=app.config['LOGIN_MAX_ATTEMPTS_PER_IP'],
+        email_failures=app.config['LOGIN_MAX_FAILURES_PER_EMAIL'],
+        window_seconds=app.config['LOGIN_WINDOW_SECONDS']
+    )
+
+
+def get_hasher():
+    return current_app.extensions['password_hasher']
+
+
+def get_throttle():
+    return current_app.extensions['login_throttle']
+
+
+def hash_password(password):
+    return get_hasher().hash(password)
+
+
+def verify_password(stored_hash, password):
+    return get_hasher().verify(stored_hash, password)
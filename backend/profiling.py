@@ -0,0 +1,207 @@
+import cProfile
+import heapq
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from flask import current_app, g, request
+from sqlalchemy import event
+from database import db
+
+# Request profiling (PROFILING = True, off by default).
+#
+# Every request records its wall time and, through SQLAlchemy engine events,
+# each SQL statement it runs: the number of queries, their total time, the
+# slowest few (PROFILING_SLOW_QUERIES) and how often each statement shape was
+# repeated. Shapes ignore bound values and the length of IN lists, so a shape
+# run PROFILING_N_PLUS_ONE_THRESHOLD times or more in one request is flagged as
+# a likely N+1 (a query per row of an earlier result).
+#
+# The totals are sent in a Server-Timing header (shown in the browser's network
+# panel), aggregated per endpoint for GET /api/admin/profile-stats, and logged
+# for requests slower than PROFILING_SLOW_REQUEST_MS or with an N+1 pattern.
+# A PROFILING_CPROFILE_SAMPLE_RATE fraction of requests also runs under
+# cProfile, and the hottest functions of those requests are logged.
+
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|\$\d+")       # psycopg2 / asyncpg style parameters
+_PARAMETER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")   # Expanded IN (?, ?, ...) lists
+
+
+def statement_shape(statement):
+    """The statement with every bound parameter list collapsed to a single "?"."""
+    return _PARAMETER_LIST.sub('?', _PLACEHOLDER.sub('?', statement))
+
+
+class RequestProfile:
+    def __init__(self, slow_queries):
+        self.started = time.perf_counter()
+        self.slow_queries = slow_queries
+        self.query_count = 0
+        self.sql_seconds = 0.0
+        self.slowest = []          # Heap of (seconds, statement), at most slow_queries long
+        self.shapes = Counter()
+        self.profiler = None
+
+    def record(self, statement, seconds):
+        self.query_count += 1
+        self.sql_seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+        if len(self.slowest) < self.slow_queries:
+            heapq.heappush(self.slowest, (seconds, statement))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, statement))
+
+    def repeated(self, threshold):
+        """[(count, shape)] of statement shapes run at least threshold times."""
+        return [(count, shape) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def slowest_queries(self):
+        return [{"ms": round(seconds * 1000, 2), "statement": statement}
+                for seconds, statement in sorted(self.slowest, reverse=True)]
+
+
+class Profiler:
+    def __init__(self, slow_queries=5, n_plus_one_threshold=5, slow_request_ms=500, sample_rate=0.0,
+                 recent_requests=50):
+        self.slow_queries = slow_queries
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.slow_request_ms = slow_request_ms
+        self.sample_rate = sample_rate
+        self._endpoints = {}   # endpoint -> aggregate dict
+        self._flagged = deque(maxlen=recent_requests)   # Recent slow or N+1 requests
+        self._lock = threading.Lock()
+
+    def before_request(self):
+        g.profile = profile = RequestProfile(self.slow_queries)
+        if self.sample_rate and random.random() < self.sample_rate:
+            profile.profiler = cProfile.Profile()
+            try:
+                profile.profiler.enable()
+            except ValueError: # Another profiler is already active in this process
+                profile.profiler = None
+
+    def after_request(self, response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        wall_ms = (time.perf_counter() - profile.started) * 1000
+        sql_ms = profile.sql_seconds * 1000
+        repeated = profile.repeated(self.n_plus_one_threshold)
+        response.headers.add('Server-Timing', f'app;dur={wall_ms:.1f}')
+        response.headers.add('Server-Timing', f'db;dur={sql_ms:.1f};desc="{profile.query_count} queries"')
+
+        endpoint = request.endpoint or request.path
+        with self._lock:
+            totals = self._endpoints.setdefault(endpoint, {
+                "requests": 0, "total_ms": 0.0, "max_ms": 0.0, "total_queries": 0, "max_queries": 0,
+                "sql_ms": 0.0, "n_plus_one_requests": 0
+            })
+            totals["requests"] += 1
+            totals["total_ms"] += wall_ms
+            totals["max_ms"] = max(totals["max_ms"], wall_ms)
+            totals["total_queries"] += profile.query_count
+            totals["max_queries"] = max(totals["max_queries"], profile.query_count)
+            totals["sql_ms"] += sql_ms
+            totals["n_plus_one_requests"] += bool(repeated)
+
+        if repeated or wall_ms >= self.slow_request_ms:
+            details = {
+                "method": request.method,
+                "path": request.full_path.rstrip('?'),
+                "status": response.status_code,
+                "ms": round(wall_ms, 1),
+                "sql_ms": round(sql_ms, 1),
+                "queries": profile.query_count,
+                "slowest_queries": profile.slowest_queries(),
+                "repeated_statements": [{"count": count, "statement": shape} for count, shape in repeated]
+            }
+            with self._lock:
+                self._flagged.append(details)
+            current_app.logger.warning(f"Slow request or N+1 queries: {details}")
+
+        if profile.profiler is not None:
+            profile.profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(profile.profiler, stream=output).sort_stats('cumulative').print_stats(25)
+            current_app.logger.warning(f"cProfile of {request.method} {request.path} ({wall_ms:.1f} ms):\n"
+                                       f"{output.getvalue()}")
+        return response
+
+    def teardown_request(self, exc):
+        # after_request doesn't run when the view raised; don't leave the profiler running
+        profile = g.pop('profile', None)
+        if profile is not None and profile.profiler is not None:
+            profile.profiler.disable()
+
+    def stats(self):
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    "requests": totals["requests"],
+                    "avg_ms": round(totals["total_ms"] / totals["requests"], 1),
+                    "max_ms": round(totals["max_ms"], 1),
+                    "avg_queries": round(totals["total_queries"] / totals["requests"], 1),
+                    "max_queries": totals["max_queries"],
+                    "avg_sql_ms": round(totals["sql_ms"] / totals["requests"], 1),
+                    "n_plus_one_requests": totals["n_plus_one_requests"]
+                }
+                for endpoint, totals in self._endpoints.items()
+            }
+            return {"endpoints": endpoints, "flagged_requests": list(self._flagged)}
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profiling_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('profiling_started')
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    profile = g.get('profile') # Only set inside a profiled request (not for background flushes)
+    if profile is not None:
+        profile.record(statement, seconds)
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get('profiling_started') \
+        if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def init_app(app):
+    """Installs the request and SQL hooks when PROFILING is enabled (call after database.init_app)."""
+    app.config.setdefault('PROFILING', os.environ.get('PROFILING', '').lower() in ('1', 'true'))
+    app.config.setdefault('PROFILING_SLOW_QUERIES', 5)           # Slowest statements kept per request
+    app.config.setdefault('PROFILING_N_PLUS_ONE_THRESHOLD', 5)   # Repeats of one statement shape in a request
+    app.config.setdefault('PROFILING_SLOW_REQUEST_MS', 500)
+    app.config.setdefault('PROFILING_CPROFILE_SAMPLE_RATE', float(os.environ.get('PROFILING_CPROFILE_SAMPLE_RATE', 0)))
+    if not app.config['PROFILING']:
+        app.extensions['profiler'] = None
+        return
+
+    profiler = app.extensions['profiler'] = Profiler(
+        slow_queries=app.config['PROFILING_SLOW_QUERIES'],
+        n_plus_one_threshold=app.config['PROFILING_N_PLUS_ONE_THRESHOLD'],
+        slow_request_ms=app.config['PROFILING_SLOW_REQUEST_MS'],
+        sample_rate=app.config['PROFILING_CPROFILE_SAMPLE_RATE']
+    )
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+    app.teardown_request(profiler.teardown_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(engine, 'handle_error', _handle_error)
+
+
+def get_profiler():
+    """The app's profiler, or None when PROFILING is off."""
+    return current_app.extensions['profiler']
@@ -0,0 +1,143 @@
+import atexit
+import hashlib
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from database import db, upsert
+from models import User, PasswordResetToken
+
+# Password reset tokens.
+#
+# A token is 32 random bytes handed to the user once; the password_resets
+# table only stores its SHA-256, so a leaked table can't be used to reset
+# passwords. The digest is unique-indexed: checking a token is one indexed
+# query that also loads the user. Each user has at most one outstanding
+# token (user_id is unique), and requesting a new one replaces it in a single
+# upsert.
+#
+# Tokens expire after PASSWORD_RESET_TTL_SECONDS. Expired rows are deleted in
+# bulk by a background thread every PASSWORD_RESET_SWEEP_SECONDS (0 disables
+# it; `flask sweep-reset-tokens` does the same once). The thread starts the
+# first time a process issues or checks a token.
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class ResetTokenStore:
+    def __init__(self, app, ttl_seconds=3600, sweep_seconds=300):
+        self.app = app
+        self.ttl = ttl_seconds
+        self.sweep_seconds = sweep_seconds
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # Metrics
+        self.issued = 0
+        self.verified = 0
+        self.rejected = 0
+        self.sweeps = 0
+        self.swept = 0
+        self.last_sweep_ms = 0.0
+
+    def _ensure_thread(self):
+        # Started on first use so it runs in the serving process, not a pre-fork master
+        if not self.sweep_seconds:
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='reset-token-sweeper', daemon=True)
+            self._thread.start()
+        atexit.register(self._stop.set)
+
+    def issue(self, user_id):
+        """Creates the user's reset token, replacing any previous one; commit the session afterwards."""
+        self._ensure_thread()
+        token = secrets.token_urlsafe(32)
+        now = datetime.utcnow()
+        values = {"user_id": user_id, "token_hash": hash_token(token), "created_at": now,
+                  "expires_at": now + timedelta(seconds=self.ttl)}
+        upsert(PasswordResetToken, values, ['user_id'],
+               {name: value for name, value in values.items() if name != 'user_id'})
+        self.issued += 1
+        return token
+
+    def lookup(self, token):
+        """The User an unexpired token belongs to, or None."""
+        self._ensure_thread()
+        user = None
+        if token and isinstance(token, str):
+            user = User.query.join(PasswordResetToken, PasswordResetToken.user_id == User.id)\
+                .filter(PasswordResetToken.token_hash == hash_token(token),
+                        PasswordResetToken.expires_at > datetime.utcnow()).first()
+        if user is None:
+            self.rejected += 1
+        else:
+            self.verified += 1
+        return user
+
+    def consume(self, user_id, token):
+        """Deletes a token once it has been used; False if a concurrent request already did. Commit afterwards."""
+        return PasswordResetToken.query.filter_by(user_id=user_id, token_hash=hash_token(token))\
+            .delete(synchronize_session=False) == 1
+
+    def sweep(self):
+        """Deletes every expired token (call inside an app context). Returns the number deleted."""
+        started = time.monotonic()
+        try:
+            deleted = PasswordResetToken.query.filter(PasswordResetToken.expires_at <= datetime.utcnow())\
+                .delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error sweeping expired password reset tokens: {e}")
+            return 0
+        self.sweeps += 1
+        self.swept += deleted
+        self.last_sweep_ms = (time.monotonic() - started) * 1000
+        return deleted
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_seconds):
+            with self.app.app_context():
+                self.sweep()
+
+    def stats(self):
+        now = datetime.utcnow()
+        rows, expired = db.session.query(
+            func.count(PasswordResetToken.id),
+            func.count(PasswordResetToken.id).filter(PasswordResetToken.expires_at <= now)
+        ).one()
+        return {
+            "rows": rows,
+            "expired_rows": expired,
+            "issued": self.issued,
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "sweeps": self.sweeps,
+            "swept": self.swept,
+            "last_sweep_ms": round(self.last_sweep_ms, 1)
+        }
+
+
+def init_app(app):
+    """Creates the app's reset token store from PASSWORD_RESET_* settings."""
+    app.config.setdefault('PASSWORD_RESET_TTL_SECONDS', 3600)
+    app.config.setdefault('PASSWORD_RESET_SWEEP_SECONDS', 300)
+    app.extensions['reset_tokens'] = ResetTokenStore(
+        app,
+        ttl_seconds=app.config['PASSWORD_RESET_TTL_SECONDS'],
+        sweep_seconds=app.config['PASSWORD_RESET_SWEEP_SECONDS']
+    )
+
+
+def get_store():
+    return current_app.extensions['reset_tokens']
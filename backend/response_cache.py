@@ -0,0 +1,144 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, current_app, g, make_response, request
+from database import upsert
+from models import db, CacheVersion
+
+# Conditional GETs for read endpoints.
+#
+# Every cached endpoint declares the "scopes" its response depends on (e.g. the
+# profile of user 5 depends on "user:5"). Write endpoints bump the version of
+# the scopes they change, in the same transaction as the change itself. A
+# response's weak ETag is a hash of the endpoint, viewer, arguments and the
+# current versions of its scopes, so answering If-None-Match costs one small
+# query on cache_versions instead of the endpoint's own queries. Rendered
+# bodies are also kept in a bounded LRU and reused while their ETag is current.
+#
+# Every ETag includes GLOBAL_SCOPE, which admin deletions bump because they
+# touch rows all over the database. USERS_SCOPE covers names and avatars that
+# responses show for other users.
+
+GLOBAL_SCOPE = 'global'
+USERS_SCOPE = 'users'
+
+
+def user_scope(user_id):
+    """A user's profile: their fields, posts (with counters) and friendships."""
+    return f"user:{user_id}"
+
+
+def user_groups_scope(user_id):
+    return f"user_groups:{user_id}"
+
+
+def group_scope(group_id):
+    return f"group:{group_id}"
+
+
+def post_comments_scope(post_id):
+    return f"post_comments:{post_id}"
+
+
+def bump(*scopes):
+    """Invalidates responses depending on scopes; call inside the transaction making the change."""
+    for scope in set(scopes):
+        upsert(CacheVersion, {'scope': scope, 'version': 1}, ['scope'], {'version': CacheVersion.version + 1})
+
+
+def current_versions(scopes):
+    rows = db.session.query(CacheVersion.scope, CacheVersion.version).filter(CacheVersion.scope.in_(scopes))
+    versions = dict.fromkeys(scopes, 0)
+    versions.update(rows)
+    return versions
+
+
+class ResponseCache:
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+        self.not_modified = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._bodies.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._bodies.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, etag, body, mimetype):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._bodies[key] = (etag, body, mimetype)
+            self._bodies.move_to_end(key)
+            while len(self._bodies) > self.max_entries:
+                self._bodies.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "not_modified": self.not_modified,
+                "body_hits": self.hits,
+                "body_misses": self.misses,
+                "size": len(self._bodies)
+            }
+
+
+def _private(response, etag):
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True # Browsers may store it but must revalidate with the ETag
+    return response
+
+
+def cached_response(scopes, stamp=None):
+    """
+    Serves the decorated endpoint with ETag/304 support. scopes(**view_args) returns
+    the scopes the response depends on; stamp() may return extra values (e.g. a
+    time bucket) that are part of the ETag. Place below login_required/admin_required.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not current_app.config['RESPONSE_CACHE_ENABLED']:
+                return f(*args, **kwargs)
+            cache = get_cache()
+            scope_list = sorted(set(scopes(**kwargs)) | {GLOBAL_SCOPE})
+            key = (request.endpoint, g.current_user.id, tuple(sorted(kwargs.items())),
+                   tuple(sorted(request.args.items(multi=True))))
+            fingerprint = repr((key, sorted(current_versions(scope_list).items()), stamp() if stamp else None))
+            etag = hashlib.sha1(fingerprint.encode()).hexdigest()[:20]
+
+            if request.if_none_match.contains_weak(etag):
+                cache.not_modified += 1
+                return _private(Response(status=304), etag)
+            cached = cache.get(key, etag)
+            if cached is not None:
+                return _private(Response(cached[1], mimetype=cached[2]), etag)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            cache.set(key, etag, response.get_data(), response.mimetype)
+            return _private(response, etag)
+        return decorated_function
+    return decorator
+
+
+def init_app(app):
+    """Creates the app's response body cache from RESPONSE_CACHE_* settings."""
+    app.config.setdefault('RESPONSE_CACHE_ENABLED', True)
+    app.config.setdefault('RESPONSE_CACHE_SIZE', 2000) # Rendered bodies kept; 0 keeps only ETags
+    app.extensions['response_cache'] = ResponseCache(max_entries=app.config['RESPONSE_CACHE_SIZE'])
+
+
+def get_cache():
+    return current_app.extensions['response_cache']
@@ -4,7 +4,8 @@ CREATE TABLE IF NOT EXISTS users (
     email TEXT UNIQUE NOT NULL,
     password_hash TEXT NOT NULL,
     profile_picture TEXT,
-    bio TEXT
+    bio TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 CREATE TABLE IF NOT EXISTS posts (
@@ -13,9 +14,14 @@ CREATE TABLE IF NOT EXISTS posts (
     content TEXT NOT NULL,
     image_url TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    likes_count INTEGER NOT NULL DEFAULT 0,
+    comments_count INTEGER NOT NULL DEFAULT 0,
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
+CREATE INDEX IF NOT EXISTS ix_posts_user_created ON posts (user_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_posts_created ON posts (created_at, id);
+
 CREATE TABLE IF NOT EXISTS friendships (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user1_id INTEGER NOT NULL,
@@ -27,6 +33,9 @@ CREATE TABLE IF NOT EXISTS friendships (
     UNIQUE(user1_id, user2_id)
 );
 
+CREATE INDEX IF NOT EXISTS ix_friendships_user1_status ON friendships (user1_id, status);
+CREATE INDEX IF NOT EXISTS ix_friendships_user2_status ON friendships (user2_id, status);
+
 CREATE TABLE IF NOT EXISTS groups (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT NOT NULL,
@@ -46,6 +55,8 @@ CREATE TABLE IF NOT EXISTS group_members (
     UNIQUE(group_id, user_id)
 );
 
+CREATE INDEX IF NOT EXISTS ix_group_members_user ON group_members (user_id);
+
 CREATE TABLE IF NOT EXISTS messages (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     sender_id INTEGER NOT NULL,
@@ -59,14 +70,19 @@ CREATE TABLE IF NOT EXISTS messages (
     CHECK((receiver_id IS NOT NULL AND group_id IS NULL) OR (receiver_id IS NULL AND group_id IS NOT NULL))
 );
 
+CREATE INDEX IF NOT EXISTS ix_messages_direct ON messages (sender_id, receiver_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_messages_group_created ON messages (group_id, created_at);
+
+-- At most one outstanding reset per user; only the SHA-256 of the token is stored, see reset_tokens.py
 CREATE TABLE IF NOT EXISTS password_resets (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    token TEXT UNIQUE NOT NULL,
+    user_id INTEGER UNIQUE NOT NULL,
+    token_hash CHAR(64) UNIQUE NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     expires_at TIMESTAMP NOT NULL,
     FOREIGN KEY (user_id) REFERENCES users(id)
 );
+CREATE INDEX IF NOT EXISTS ix_password_resets_expires ON password_resets (expires_at);
 
 CREATE TABLE IF NOT EXISTS likes (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -78,6 +94,8 @@ CREATE TABLE IF NOT EXISTS likes (
     UNIQUE(user_id, post_id)
 );
 
+CREATE INDEX IF NOT EXISTS ix_likes_post ON likes (post_id);
+
 CREATE TABLE IF NOT EXISTS comments (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
@@ -87,3 +105,63 @@ CREATE TABLE IF NOT EXISTS comments (
     FOREIGN KEY (user_id) REFERENCES users(id),
     FOREIGN KEY (post_id) REFERENCES posts(id)
 );
+
+CREATE INDEX IF NOT EXISTS ix_comments_post_created ON comments (post_id, created_at);
+
+CREATE TABLE IF NOT EXISTS timeline_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    post_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (post_id) REFERENCES posts(id),
+    FOREIGN KEY (author_id) REFERENCES users(id),
+    UNIQUE(user_id, post_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_timeline_user_created ON timeline_entries (user_id, created_at, post_id);
+
+-- Content-addressed uploads and how many posts/avatars reference them, maintained by media_store.py
+CREATE TABLE IF NOT EXISTS media_objects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key VARCHAR(255) NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    content_type VARCHAR(50) NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Version counters behind the ETags of cached read endpoints, bumped by response_cache.py
+CREATE TABLE IF NOT EXISTS cache_versions (
+    scope VARCHAR(100) PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+-- Revoked bearer tokens (by jti, or all of a user's tokens issued up to the second of revoked_before), see tokens.py
+CREATE TABLE IF NOT EXISTS token_revocations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    jti VARCHAR(32),
+    user_id INTEGER,
+    revoked_before TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_token_revocations_expires ON token_revocations (expires_at);
+
+-- Events of the real-time bus, shared by every worker process (the id is the SSE event id), see events.py
+CREATE TABLE IF NOT EXISTS realtime_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel VARCHAR(50) NOT NULL,
+    type VARCHAR(50) NOT NULL,
+    data TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_realtime_events_created ON realtime_events (created_at);
+
+-- Full-text index for user search (rowid = users.id), maintained by search.py
+CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+    full_name,
+    email,
+    prefix = '2 3',
+    tokenize = 'unicode61 remove_diacritics 2'
+);
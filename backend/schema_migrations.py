@@ -0,0 +1,189 @@
+import sqlite3
+
+# Versioned schema migrations for the SQLite database.
+#
+# schema.sql only creates missing tables, so anything that changes an existing
+# table (new columns, indexes, backfills) lives here as a numbered migration.
+# The version applied last is stored in SQLite's `PRAGMA user_version`;
+# init_db.py runs the pending migrations after loading schema.sql.
+#
+# Every migration must also be safe on a fresh database built from the current
+# schema.sql, since that already contains the end state.
+
+
+def _column_names(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _add_column_if_missing(conn, table, column, definition):
+    if column not in _column_names(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+
+def _reconcile_models(conn):
+    """Adds columns declared in models.py that older databases lack."""
+    # users.created_at is used by admin_dashboard_stats but was missing from the
+    # original schema.sql. Existing users keep NULL (unknown signup time).
+    _add_column_if_missing(conn, "users", "created_at", "TIMESTAMP")
+
+    added_likes = _add_column_if_missing(conn, "posts", "likes_count", "INTEGER NOT NULL DEFAULT 0")
+    added_comments = _add_column_if_missing(conn, "posts", "comments_count", "INTEGER NOT NULL DEFAULT 0")
+    if added_likes or added_comments:
+        conn.execute(
+            "UPDATE posts SET "
+            "likes_count = (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id), "
+            "comments_count = (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id)"
+        )
+
+
+def _hot_path_indexes(conn):
+    """Composite indexes for the feed, profile, message, like/comment and friendship lookups."""
+    statements = [
+        # Profile posts and per-author timeline backfill: WHERE user_id = ? ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS ix_posts_user_created ON posts (user_id, created_at)",
+        # Admin post listing: ORDER BY created_at DESC, id DESC
+        "CREATE INDEX IF NOT EXISTS ix_posts_created ON posts (created_at, id)",
+        # Direct messages: WHERE sender_id = ? AND receiver_id = ? ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS ix_messages_direct ON messages (sender_id, receiver_id, created_at)",
+        # Group messages: WHERE group_id = ? ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS ix_messages_group_created ON messages (group_id, created_at)",
+        # Likes/comments per post (the unique (user_id, post_id) index only covers lookups by user)
+        "CREATE INDEX IF NOT EXISTS ix_likes_post ON likes (post_id)",
+        "CREATE INDEX IF NOT EXISTS ix_comments_post_created ON comments (post_id, created_at)",
+        # Friend lists: WHERE user1_id = ? / user2_id = ? AND status = ?
+        "CREATE INDEX IF NOT EXISTS ix_friendships_user1_status ON friendships (user1_id, status)",
+        "CREATE INDEX IF NOT EXISTS ix_friendships_user2_status ON friendships (user2_id, status)",
+        # Groups of a user: WHERE group_members.user_id = ?
+        "CREATE INDEX IF NOT EXISTS ix_group_members_user ON group_members (user_id)",
+    ]
+    for statement in statements:
+        conn.execute(statement)
+
+
+def _backfill_timelines(conn):
+    """Fills timeline_entries for databases that had posts before feed timelines existed."""
+    conn.execute(
+        "INSERT OR IGNORE INTO timeline_entries (user_id, post_id, author_id, created_at) "
+        "SELECT user_id, id, user_id, created_at FROM posts"
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO timeline_entries (user_id, post_id, author_id, created_at) "
+        "SELECT f.user1_id, p.id, p.user_id, p.created_at FROM posts p "
+        "JOIN friendships f ON f.user2_id = p.user_id AND f.status = 'accepted'"
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO timeline_entries (user_id, post_id, author_id, created_at) "
+        "SELECT f.user2_id, p.id, p.user_id, p.created_at FROM posts p "
+        "JOIN friendships f ON f.user1_id = p.user_id AND f.status = 'accepted'"
+    )
+
+
+def _user_search_index(conn):
+    """Creates the FTS5 user search index and fills it from the users table."""
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+        "full_name, email, prefix = '2 3', tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    conn.execute("DELETE FROM users_fts")
+    conn.execute("INSERT INTO users_fts (rowid, full_name, email) SELECT id, full_name, email FROM users")
+
+
+def _media_objects(conn):
+    """Creates the reference-counting table for content-addressed uploads."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS media_objects ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, key VARCHAR(255) NOT NULL UNIQUE, size INTEGER NOT NULL, "
+        "content_type VARCHAR(50) NOT NULL, refcount INTEGER NOT NULL DEFAULT 0, "
+        "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
+
+
+def _cache_versions(conn):
+    """Creates the version counters used for response ETags."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS cache_versions ("
+        "scope VARCHAR(100) PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)"
+    )
+
+
+def _token_revocations(conn):
+    """Creates the revocation list for bearer tokens."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS token_revocations ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, jti VARCHAR(32), user_id INTEGER, "
+        "revoked_before TIMESTAMP, expires_at TIMESTAMP NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_token_revocations_expires ON token_revocations (expires_at)")
+
+
+def _hashed_password_resets(conn):
+    """Rebuilds password_resets to store token hashes, one row per user."""
+    if "token_hash" in _column_names(conn, "password_resets"):
+        return
+    # Outstanding tokens were stored in plain text and expire within the hour; they are dropped
+    conn.execute("DROP TABLE password_resets")
+    conn.execute(
+        "CREATE TABLE password_resets ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE NOT NULL, "
+        "token_hash CHAR(64) UNIQUE NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+        "expires_at TIMESTAMP NOT NULL, FOREIGN KEY (user_id) REFERENCES users(id))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_password_resets_expires ON password_resets (expires_at)")
+
+
+def _realtime_events(conn):
+    """Creates the table the real-time event bus is shared through."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS realtime_events ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, channel VARCHAR(50) NOT NULL, type VARCHAR(50) NOT NULL, "
+        "data TEXT NOT NULL, created_at TIMESTAMP NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_realtime_events_created ON realtime_events (created_at)")
+
+
+# (version, description, function). Append only; never renumber.
+MIGRATIONS = [
+    (1, "Reconcile users/posts columns with models.py", _reconcile_models),
+    (2, "Add composite indexes for hot query paths", _hot_path_indexes),
+    (3, "Backfill feed timelines", _backfill_timelines),
+    (4, "Create full-text user search index", _user_search_index),
+    (5, "Create media_objects for deduplicated uploads", _media_objects),
+    (6, "Create cache_versions for response ETags", _cache_versions),
+    (7, "Create token_revocations for bearer tokens", _token_revocations),
+    (8, "Store password reset token hashes", _hashed_password_resets),
+    (9, "Create realtime_events for the cross-process event bus", _realtime_events),
+]
+
+
+def current_version(conn):
+    """Returns the schema version stored in the database."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Applies every pending migration, each in its own transaction.
+    Returns the list of (version, description) that were applied.
+    """
+    applied = []
+    previous_isolation_level = conn.isolation_level
+    conn.isolation_level = None # Manage transactions explicitly so DDL is rolled back on failure
+    try:
+        version = current_version(conn)
+        for migration_version, description, apply in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            conn.execute("BEGIN")
+            try:
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {int(migration_version)}")
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append((migration_version, description))
+    finally:
+        conn.isolation_level = previous_isolation_level
+    return applied
@@ -0,0 +1,77 @@
+import re
+from sqlalchemy import or_, text
+from models import db, User
+
+# User search backed by an SQLite FTS5 index (users_fts, created by
+# schema_migrations.py). Each word of the query is matched as a prefix against
+# the words of full_name and email, using FTS5 prefix indexes so typeahead
+# lookups stay a few index probes regardless of table size. Results are ranked
+# by bm25 with name matches weighted above email matches.
+#
+# The index is kept in sync explicitly by the code paths that create, rename
+# or delete users (register_user, update_user_profile, admin_delete_user).
+
+FTS_TABLE = 'users_fts'
+NAME_WEIGHT = 10.0
+EMAIL_WEIGHT = 1.0
+MAX_QUERY_TERMS = 8
+
+_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def _uses_fts():
+    return db.session.get_bind().dialect.name == 'sqlite'
+
+
+def match_expression(query):
+    """Turns free text into an FTS5 query where every word must match as a prefix."""
+    terms = _TERM_PATTERN.findall(query.lower())[:MAX_QUERY_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def index_user(user):
+    """Adds or refreshes a user's entry in the search index (call before commit)."""
+    if not _uses_fts():
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": user.id})
+    db.session.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, full_name, email) VALUES (:id, :full_name, :email)"),
+        {"id": user.id, "full_name": user.full_name, "email": user.email}
+    )
+
+
+def remove_user(user_id):
+    """Drops a user from the search index (call before commit)."""
+    if not _uses_fts():
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": user_id})
+
+
+def search_users(query, limit, offset=0):
+    """Returns up to `limit` ranked rows (id, full_name, email, profile_picture) matching query."""
+    if not _uses_fts():
+        # Other databases: plain substring match, but still bounded
+        return db.session.query(User.id, User.full_name, User.email, User.profile_picture).filter(
+            or_(User.full_name.ilike(f"%{query}%"), User.email.ilike(f"%{query}%"))
+        ).order_by(User.full_name, User.id).limit(limit).offset(offset).all()
+
+    expression = match_expression(query)
+    if not expression:
+        return []
+    return db.session.execute(text(
+        f"SELECT users.id, users.full_name, users.email, users.profile_picture "
+        f"FROM {FTS_TABLE} JOIN users ON users.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH :expression "
+        f"ORDER BY bm25({FTS_TABLE}, {NAME_WEIGHT}, {EMAIL_WEIGHT}), users.id "
+        f"LIMIT :limit OFFSET :offset"
+    ), {"expression": expression, "limit": limit, "offset": offset}).all()
+
+
+def rebuild_index():
+    """Rebuilds the whole index from the users table. Returns the number of indexed users."""
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    db.session.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, full_name, email) SELECT id, full_name, email FROM users"
+    ))
+    db.session.commit()
+    return db.session.execute(text(f"SELECT COUNT(*) FROM {FTS_TABLE}")).scalar()
@@ -0,0 +1,174 @@
+from datetime import date
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy.orm import aliased
+from models import User, Post, Message, Comment, Group
+import uploads
+
+try:
+    import orjson
+except ImportError: # Optional; the standard library encoder is used without it
+    orjson = None
+
+# Declarative response schemas for listing endpoints.
+#
+# A schema maps each output field to the column it comes from, so an endpoint
+# selects exactly those columns (`db.session.query(*schema.columns(...))`)
+# and turns the result rows into dicts without building ORM objects or
+# loading relationships. Fields computed in Python (image variant URLs) name
+# the fields they are derived from. Clients can ask for a subset of fields
+# with ?fields=id,content,created_at; only those columns are queried.
+#
+# Datetimes are left to the JSON provider, which writes them as ISO 8601
+# (natively and much faster when orjson is installed).
+
+
+class Schema:
+    def __init__(self, columns, derived=None):
+        """columns: {field: column} in output order; derived: {field: (source fields, function(row mapping))}."""
+        self.column_map = columns
+        self.derived = derived or {}
+        self.field_names = list(columns) + list(self.derived)
+
+    def fields_from_args(self, args):
+        """The fields requested with ?fields= (all by default). Raises ValueError for unknown names."""
+        requested = args.get('fields')
+        if not requested:
+            return self.field_names
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.column_map and name not in self.derived]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}.")
+        return [name for name in self.field_names if name in names]
+
+    def columns(self, fields, required=()):
+        """Labeled columns for fields, plus any needed by derived fields or listed in required (e.g. sort keys)."""
+        needed = [name for name in fields if name in self.column_map]
+        for name in fields:
+            if name in self.derived:
+                needed.extend(self.derived[name][0])
+        needed.extend(required)
+        return [self.column_map[name].label(name) for name in dict.fromkeys(needed)]
+
+    def dump(self, row, fields):
+        mapping = row._mapping
+        return {name: self.derived[name][1](mapping) if name in self.derived else mapping[name] for name in fields}
+
+    def dump_all(self, rows, fields):
+        return [self.dump(row, fields) for row in rows]
+
+
+def _variants(field):
+    return ((field,), lambda row: uploads.variant_urls(row[field]))
+
+
+Sender = aliased(User, name='sender')
+Receiver = aliased(User, name='receiver')
+Owner = aliased(User, name='owner')
+
+_POST_COLUMNS = {
+    'id': Post.id,
+    'user_id': Post.user_id,
+    'author_full_name': User.full_name,
+    'author_profile_picture': User.profile_picture,
+    'content': Post.content,
+    'image_url': Post.image_url,
+    'created_at': Post.created_at,
+    'likes_count': Post.likes_count,
+    'comments_count': Post.comments_count,
+}
+
+# Posts joined with their author (User)
+FEED_POST = Schema(_POST_COLUMNS, derived={
+    'author_profile_picture_variants': _variants('author_profile_picture'),
+    'image_variants': _variants('image_url'),
+})
+ADMIN_POST = Schema({name: column for name, column in _POST_COLUMNS.items() if name != 'author_profile_picture'})
+# A user's own posts (no join)
+PROFILE_POST = Schema({name: _POST_COLUMNS[name] for name in
+                       ('id', 'content', 'image_url', 'created_at', 'likes_count', 'comments_count')},
+                      derived={'image_variants': _variants('image_url')})
+
+USER_SUMMARY = Schema({
+    'id': User.id,
+    'full_name': User.full_name,
+    'email': User.email,
+    'profile_picture': User.profile_picture,
+})
+ADMIN_USER = Schema({**USER_SUMMARY.column_map, 'bio': User.bio, 'created_at': User.created_at})
+GROUP_MEMBER = Schema({'id': User.id, 'full_name': User.full_name, 'profile_picture': User.profile_picture})
+
+# Comments joined with their author (User)
+COMMENT = Schema({
+    'id': Comment.id,
+    'user_id': Comment.user_id,
+    'author_full_name': User.full_name,
+    'author_profile_picture': User.profile_picture,
+    'post_id': Comment.post_id,
+    'content': Comment.content,
+    'created_at': Comment.created_at,
+}, derived={'author_profile_picture_variants': _variants('author_profile_picture')})
+
+# Groups joined with their creator (Owner)
+GROUP = Schema({
+    'id': Group.id,
+    'name': Group.name,
+    'description': Group.description,
+    'created_by_user_id': Group.created_by_user_id,
+    'owner_name': Owner.full_name,
+    'created_at': Group.created_at,
+})
+
+_MESSAGE_COLUMNS = {
+    'id': Message.id,
+    'sender_id': Message.sender_id,
+    'sender_name': Sender.full_name,
+    'sender_profile_picture': Sender.profile_picture,
+}
+
+# Messages joined with their Sender (and, for direct messages, outer-joined with their Receiver)
+DIRECT_MESSAGE = Schema({
+    **_MESSAGE_COLUMNS,
+    'receiver_id': Message.receiver_id,
+    'receiver_name': Receiver.full_name,
+    'receiver_profile_picture': Receiver.profile_picture,
+    'content': Message.content,
+    'created_at': Message.created_at,
+})
+GROUP_MESSAGE = Schema({
+    **_MESSAGE_COLUMNS,
+    'group_id': Message.group_id,
+    'content': Message.content,
+    'created_at': Message.created_at,
+})
+
+
+def _default(o):
+    if isinstance(o, date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask JSON provider writing dates as ISO 8601; uses orjson when it is installed."""
+    default = staticmethod(_default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS),
+                                        mimetype=self.mimetype)
+
+
+def init_app(app):
+    app.json = JSONProvider(app)
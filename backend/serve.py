@@ -0,0 +1,110 @@
+import multiprocessing
+import os
+import tempfile
+from gunicorn.app.base import BaseApplication
+from sqlalchemy.orm import configure_mappers
+from app import create_app
+from database import db
+
+# Production launcher: python serve.py (run from the backend directory).
+#
+# Runs the app under gunicorn with several worker processes, each serving
+# WEB_THREADS requests concurrently. The app, its models and its extensions are
+# built once in the master and inherited by the workers on fork; the master
+# closes its database connections before forking and each worker drops the
+# pool it inherited, so no connection is ever shared between processes.
+#
+# Every key can be overridden in app.config or through an environment variable
+# of the same name.
+DEFAULT_CONFIG = {
+    'WEB_BIND': '127.0.0.1:5000',
+    'WEB_WORKERS': multiprocessing.cpu_count() * 2 + 1,
+    'WEB_THREADS': 8,                     # Requests served concurrently per worker
+    'WEB_TIMEOUT': 60,                    # Workers silent for longer are killed and restarted
+    'WEB_GRACEFUL_TIMEOUT': 30,           # Time given to finish in-flight requests on restart/shutdown
+    'WEB_KEEPALIVE': 5,
+    'WEB_MAX_REQUESTS': 0,                # Recycle workers after this many requests (0 = never)
+    'WEB_MAX_REQUESTS_JITTER': 0,
+}
+
+
+def _setting(key, default):
+    value = os.environ.get(key)
+    if value is None:
+        return default
+    return type(default)(value)
+
+
+def _dispose_engines(app, close):
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=close)
+
+
+def gunicorn_options(config):
+    """Maps WEB_* settings to gunicorn options."""
+    return {
+        'bind': config['WEB_BIND'],
+        'workers': config['WEB_WORKERS'],
+        'threads': config['WEB_THREADS'],
+        'worker_class': 'gthread',
+        'timeout': config['WEB_TIMEOUT'],
+        'graceful_timeout': config['WEB_GRACEFUL_TIMEOUT'],
+        'keepalive': config['WEB_KEEPALIVE'],
+        'max_requests': config['WEB_MAX_REQUESTS'],
+        'max_requests_jitter': config['WEB_MAX_REQUESTS_JITTER'],
+        'preload_app': True,
+    }
+
+
+class Server(BaseApplication):
+    def __init__(self, app):
+        self.application = app
+        super().__init__()
+
+    def load_config(self):
+        for key, value in gunicorn_options(self.application.config).items():
+            self.cfg.set(key, value)
+        self.cfg.set('post_fork', self._post_fork)
+        self.cfg.set('worker_exit', self._worker_exit)
+
+    def load(self):
+        # Runs once in the master (preload_app): close anything opened while
+        # building the app so the forked workers start without live connections.
+        configure_mappers()
+        _dispose_engines(self.application, close=True)
+        return self.application
+
+    def _post_fork(self, server, worker):
+        # Forget (without closing) any pooled connections copied from the master
+        _dispose_engines(self.application, close=False)
+
+    def _worker_exit(self, server, worker):
+        # Write likes still queued in write-behind mode before the worker goes away
+        buffer = self.application.extensions.get('like_buffer')
+        if buffer is not None:
+            buffer.shutdown()
+        # Record the worker's final counts so the remaining workers keep reporting them
+        app_metrics = self.application.extensions.get('metrics')
+        if app_metrics is not None:
+            app_metrics.registry.write()
+
+
+def main():
+    # Workers share their metrics through files; /metrics is served by any one of them
+    os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp(prefix='connectu-metrics-'))
+    # Each open event stream holds a thread; keep at least half of them for other requests
+    os.environ.setdefault('EVENTS_MAX_THREAD_STREAMS', str(max(1, _setting('WEB_THREADS', DEFAULT_CONFIG['WEB_THREADS']) // 2)))
+    app = create_app()
+    # Start from zero: snapshots left by a previous run would be added to the totals.
+    # Only the master does this, before forking; workers keep exited workers' files.
+    app_metrics = app.extensions.get('metrics')
+    if app_metrics is not None:
+        app_metrics.registry.remove_files()
+    for key, default in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, _setting(key, default))
+    Server(app).run()
+
+
+if __name__ == '__main__':
+    main()
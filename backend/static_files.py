@@ -0,0 +1,131 @@
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from flask import Response, abort, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+import media_store
+
+# Serving of uploaded media and the frontend scripts.
+#
+# Files whose URL changes whenever their content does are sent with a one-year
+# immutable Cache-Control, so browsers never revalidate them: content-addressed
+# uploads (see media_store.py) and scripts requested with the "?v=<fingerprint>"
+# that `flask fingerprint-assets` writes into the HTML pages. Everything else
+# gets STATIC_MAX_AGE and is revalidated with its ETag. Werkzeug answers
+# If-None-Match / If-Modified-Since with 304 and Range requests with 206.
+#
+# Behind nginx, set MEDIA_ACCEL_REDIRECT to an internal location mapped to the
+# media directory and uploads are handed to nginx with X-Accel-Redirect instead
+# of being read by a worker. USE_X_SENDFILE (Flask) does the same for
+# Apache/lighttpd.
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_SCRIPT_SRC = re.compile(r'(<script\s+src=")(static/js/[\w.-]+\.js)(?:\?v=[0-9a-f]*)?(")')
+
+
+class Fingerprints:
+    """Content hashes of files, recomputed when a file's mtime or size changes."""
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._cache.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        with open(path, 'rb') as f:
+            fingerprint = hashlib.sha256(f.read()).hexdigest()[:12]
+        with self._lock:
+            self._cache[path] = (signature, fingerprint)
+        return fingerprint
+
+
+def _cacheable(response, immutable):
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = current_app.config['STATIC_MAX_AGE']
+    return response
+
+
+def serve_media(key):
+    """Uploads from the local media backend."""
+    immutable = bool(media_store.STORED_FILE_PATTERN.match(key))
+    accel_prefix = current_app.config['MEDIA_ACCEL_REDIRECT']
+    if accel_prefix:
+        if safe_join(current_app.config['MEDIA_ROOT'], key) is None:
+            abort(404)
+        response = Response(mimetype=mimetypes.guess_type(key)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + key
+        return _cacheable(response, immutable)
+    max_age = IMMUTABLE_MAX_AGE if immutable else current_app.config['STATIC_MAX_AGE']
+    return _cacheable(send_from_directory(current_app.config['MEDIA_ROOT'], key, max_age=max_age), immutable)
+
+
+def serve_script(filename):
+    """Frontend scripts from static/js; immutable when requested with their current fingerprint."""
+    directory = current_app.config['FRONTEND_JS_DIR']
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    immutable = request.args.get('v') == current_app.extensions['static_fingerprints'].get(path)
+    max_age = IMMUTABLE_MAX_AGE if immutable else current_app.config['STATIC_MAX_AGE']
+    return _cacheable(send_from_directory(directory, filename, max_age=max_age), immutable)
+
+
+def serve_static(filename):
+    """Anything else under backend/static."""
+    return _cacheable(send_from_directory(current_app.config['BACKEND_STATIC_DIR'], filename,
+                                          max_age=current_app.config['STATIC_MAX_AGE']), False)
+
+
+def fingerprint_pages(pages_dir, js_dir, fingerprints=None):
+    """
+    Rewrites `<script src="static/js/x.js">` in the HTML pages of pages_dir to
+    `static/js/x.js?v=<fingerprint>`. Returns the list of pages changed.
+    """
+    fingerprints = fingerprints or Fingerprints()
+
+    def versioned(match):
+        path = os.path.join(js_dir, match.group(2)[len('static/js/'):])
+        if not os.path.isfile(path):
+            return match.group(0)
+        return f"{match.group(1)}{match.group(2)}?v={fingerprints.get(path)}{match.group(3)}"
+
+    changed = []
+    for name in sorted(os.listdir(pages_dir)):
+        if not name.endswith('.html'):
+            continue
+        page_path = os.path.join(pages_dir, name)
+        with open(page_path, encoding='utf-8', newline='') as f: # Keep the pages' line endings
+            html = f.read()
+        rewritten = _SCRIPT_SRC.sub(versioned, html)
+        if rewritten != html:
+            with open(page_path, 'w', encoding='utf-8', newline='') as f:
+                f.write(rewritten)
+            changed.append(name)
+    return changed
+
+
+def init_app(app, project_root):
+    """Registers the /static routes; the app must be created with static_folder=None."""
+    app.config.setdefault('STATIC_MAX_AGE', 300)
+    app.config.setdefault('MEDIA_ACCEL_REDIRECT', os.environ.get('MEDIA_ACCEL_REDIRECT')) # e.g. /_media/
+    app.config.setdefault('FRONTEND_PAGES_DIR', project_root)
+    app.config.setdefault('FRONTEND_JS_DIR', os.path.join(project_root, 'static', 'js'))
+    app.config.setdefault('BACKEND_STATIC_DIR', os.path.join(project_root, 'backend', 'static'))
+    app.extensions['static_fingerprints'] = Fingerprints()
+
+    if app.config['MEDIA_BACKEND'] == 'local':
+        app.add_url_rule(f"{app.config['MEDIA_URL'].rstrip('/')}/<path:key>", 'media', serve_media)
+    app.add_url_rule('/static/js/<path:filename>', 'frontend_js', serve_script)
+    app.add_url_rule('/static/<path:filename>', 'static', serve_static)
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import friend_graph
+
+# Friend-of-friend suggestions ranked by mutual-friend count.
+#
+# All friend sets involved are fetched from the friend graph in one batched
+# load, and candidates are counted with a single pass over them. Results are
+# cached per user; once an entry is older than SUGGESTIONS_REFRESH_SECONDS it
+# is still served while a background worker recomputes it, so requests never
+# wait on a recomputation after the first one.
+
+
+def mutual_friend_count(graph, user_a_id, user_b_id):
+    """Number of friends user_a and user_b have in common."""
+    adjacency = graph.adjacency_many([user_a_id, user_b_id])
+    return len(set(adjacency[user_a_id].friends).intersection(adjacency[user_b_id].friends))
+
+
+def compute_suggestions(graph, user_id, limit):
+    """Returns [(candidate_id, mutual_count), ...] ranked by mutual friends, then id."""
+    own = graph.adjacency(user_id)
+    friend_ids = list(own.friends)
+    excluded = set(friend_ids) | set(own.pending_sent) | set(own.pending_received) | {user_id}
+    counts = Counter()
+    for adjacency in graph.adjacency_many(friend_ids).values():
+        counts.update(candidate_id for candidate_id in adjacency.friends if candidate_id not in excluded)
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return ranked[:limit]
+
+
+class SuggestionCache:
+    def __init__(self, refresh_seconds=300, max_users=10000, workers=1):
+        self.refresh_seconds = refresh_seconds
+        self.max_users = max_users
+        self._results = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='suggestions')
+
+    def get(self, app, graph, user_id, limit):
+        """Cached suggestions for user_id; stale entries are refreshed in the background."""
+        with self._lock:
+            cached = self._results.get(user_id)
+        if cached is None or cached[1] < limit:
+            return self._store(user_id, limit, compute_suggestions(graph, user_id, limit))
+        computed_at, cached_limit, ranked = cached
+        if time.monotonic() - computed_at > self.refresh_seconds:
+            self._schedule_refresh(app, graph, user_id, cached_limit)
+        return ranked[:limit]
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._results.pop(user_id, None)
+
+    def _store(self, user_id, limit, ranked):
+        with self._lock:
+            if len(self._results) >= self.max_users:
+                self._results.pop(next(iter(self._results)))
+            self._results[user_id] = (time.monotonic(), limit, ranked)
+        return ranked
+
+    def _schedule_refresh(self, app, graph, user_id, limit):
+        with self._lock:
+            if user_id in self._refreshing:
+                return
+            self._refreshing.add(user_id)
+        self._executor.submit(self._refresh, app, graph, user_id, limit)
+
+    def _refresh(self, app, graph, user_id, limit):
+        try:
+            with app.app_context():
+                self._store(user_id, limit, compute_suggestions(graph, user_id, limit))
+        except Exception as e:
+            app.logger.error(f"Error refreshing friend suggestions for user {user_id}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(user_id)
+
+
+def init_app(app):
+    """Creates the app's suggestion cache from SUGGESTIONS_* settings."""
+    app.config.setdefault('SUGGESTIONS_REFRESH_SECONDS', 300)
+    app.config.setdefault('SUGGESTIONS_MAX_USERS', 10000)
+    app.config.setdefault('SUGGESTIONS_LIMIT', 20)
+    app.extensions['suggestions'] = SuggestionCache(
+        refresh_seconds=app.config['SUGGESTIONS_REFRESH_SECONDS'],
+        max_users=app.config['SUGGESTIONS_MAX_USERS']
+    )
+
+
+def get_suggestions(user_id, limit):
+    """Ranked (candidate_id, mutual_count) pairs for user_id."""
+    app = current_app._get_current_object()
+    return app.extensions['suggestions'].get(app, friend_graph.get_graph(), user_id, limit)
+
+
+def invalidate(*user_ids):
+    """Forgets cached suggestions, e.g. after users become friends."""
+    current_app.extensions['suggestions'].invalidate(*user_ids)
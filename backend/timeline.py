@@ -0,0 +1,81 @@
+from sqlalchemy import and_, exists, insert, literal, or_, select, union
+from models import db, Post, Friendship, TimelineEntry
+
+# Feed timelines are materialized on write: every post is copied into the
+# timeline of its author and of each accepted friend, so reading a page of the
+# feed is a single range scan over (user_id, created_at) instead of an IN (...)
+# over every friend's posts.
+#
+# Fan-out reads the friendships table rather than the per-process friend graph:
+# the graph can lag behind a friendship accepted in another worker, and a post
+# missed here would never reach that friend's timeline.
+
+def fan_out_post(post):
+    """Copies a freshly flushed post into its author's and friends' timelines."""
+    friend_ids = union(
+        select(Friendship.user2_id).where(Friendship.user1_id == post.user_id, Friendship.status == 'accepted'),
+        select(Friendship.user1_id).where(Friendship.user2_id == post.user_id, Friendship.status == 'accepted')
+    )
+    recipient_ids = set(db.session.execute(friend_ids).scalars()) | {post.user_id}
+    db.session.execute(insert(TimelineEntry), [{
+        "user_id": recipient_id,
+        "post_id": post.id,
+        "author_id": post.user_id,
+        "created_at": post.created_at
+    } for recipient_id in recipient_ids])
+
+
+def _copy_posts_into_timeline(owner_id, author_id):
+    """Inserts every post by author_id into owner_id's timeline, skipping existing entries."""
+    already_present = exists().where(and_(
+        TimelineEntry.user_id == owner_id,
+        TimelineEntry.post_id == Post.id
+    ))
+    posts_select = select(
+        literal(owner_id), Post.id, Post.user_id, Post.created_at
+    ).where(Post.user_id == author_id, ~already_present)
+    db.session.execute(insert(TimelineEntry).from_select(
+        ['user_id', 'post_id', 'author_id', 'created_at'], posts_select
+    ))
+
+
+def backfill_friendship(user_a_id, user_b_id):
+    """Backfills both timelines with each other's existing posts after a friend request is accepted."""
+    _copy_posts_into_timeline(user_a_id, user_b_id)
+    _copy_posts_into_timeline(user_b_id, user_a_id)
+
+
+def prune_post(post_id):
+    """Removes a post from every timeline it was fanned out to."""
+    TimelineEntry.query.filter_by(post_id=post_id).delete(synchronize_session=False)
+
+
+def prune_user(user_id):
+    """Removes a user's own timeline and their posts from everyone else's."""
+    TimelineEntry.query.filter(
+        or_(TimelineEntry.user_id == user_id, TimelineEntry.author_id == user_id)
+    ).delete(synchronize_session=False)
+
+
+def timeline_query(user_id):
+    """Query for the posts in a user's timeline, newest first."""
+    return Post.query.join(TimelineEntry, TimelineEntry.post_id == Post.id)\
+                     .filter(TimelineEntry.user_id == user_id)\
+                     .order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc())
+
+
+def rebuild_all():
+    """Rebuilds every timeline from the posts and friendships tables. Returns the number of entries."""
+    TimelineEntry.query.delete(synchronize_session=False)
+    columns = ['user_id', 'post_id', 'author_id', 'created_at']
+    entries = [select(Post.user_id.label('user_id'), Post.id, Post.user_id.label('author_id'), Post.created_at)]
+    for owner_column, friend_column in ((Friendship.user1_id, Friendship.user2_id),
+                                        (Friendship.user2_id, Friendship.user1_id)):
+        entries.append(select(owner_column.label('user_id'), Post.id, Post.user_id.label('author_id'), Post.created_at)
+                       .join(Friendship, friend_column == Post.user_id)
+                       .where(Friendship.status == 'accepted'))
+    # UNION drops the duplicates of a pair stored in both directions (or of a
+    # friendship with oneself), which would break the (user_id, post_id) constraint
+    db.session.execute(insert(TimelineEntry).from_select(columns, union(*entries)))
+    db.session.commit()
+    return TimelineEntry.query.count()
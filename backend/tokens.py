@@ -0,0 +1,186 @@
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import event, select
+from database import RoutingSession
+from models import db, TokenRevocation
+
+# Signed bearer tokens.
+#
+# A token carries its claims ({"uid": user id, "adm": admin flag, "jti": token
+# id}) and its issue time, signed with HMAC by itsdangerous. login_required
+# checks the signature and age (AUTH_TOKEN_MAX_AGE) in memory, so an
+# authenticated request needs neither a session nor a database lookup to
+# establish who is calling and whether they are an admin.
+#
+# Keys rotate through AUTH_TOKEN_SECRET_KEYS (oldest first): tokens are signed
+# with the last key and accepted if any key verifies them, so a new key can be
+# introduced first and an old one dropped once its tokens have expired.
+#
+# Revocation (logout, password reset, account deletion) is recorded in the
+# token_revocations table, either for one token (jti) or for every token of a
+# user issued up to a time, which also ends the cookie sessions the user
+# signed in to by then (see session_revoked). Issue times only have whole
+# seconds, so a user revocation covers the whole second it was made in: a token
+# issued moments before a password reset can't slip through, at the cost of
+# also rejecting one issued in the same second after it. Each process keeps the
+# unexpired revocations in memory: its own once their transaction commits (a
+# rolled-back revocation never takes effect), and new rows from the table at
+# most every AUTH_REVOCATION_REFRESH_SECONDS, so revocations made by another
+# process take effect within that delay.
+
+SALT = 'session-token'
+
+
+def _epoch(value):
+    """Seconds since the epoch of a naive UTC datetime."""
+    return (value - datetime(1970, 1, 1)).total_seconds()
+
+
+class RevocationList:
+    def __init__(self, refresh_seconds=2.0):
+        self.refresh_seconds = refresh_seconds
+        self._jtis = {}           # jti -> expires at (epoch)
+        self._users = {}          # user_id -> (last revoked second, expires at) (epoch)
+        self._last_id = 0
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def add(self, jti, user_id, revoked_before, expires_at):
+        with self._lock:
+            if jti:
+                self._jtis[jti] = expires_at
+            if user_id is not None:
+                current = self._users.get(user_id)
+                if current is None or current[0] < revoked_before:
+                    self._users[user_id] = (revoked_before, expires_at)
+
+    def refresh(self, force=False):
+        """Loads revocations recorded since the last refresh (by any process)."""
+        if not force and time.monotonic() < self._next_refresh:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return # Another thread is refreshing
+        try:
+            # On a connection of its own: the caller's session may hold uncommitted revocations
+            with db.engine.connect() as connection:
+                rows = connection.execute(
+                    select(TokenRevocation.id, TokenRevocation.jti, TokenRevocation.user_id,
+                           TokenRevocation.revoked_before, TokenRevocation.expires_at)
+                    .where(TokenRevocation.id > self._last_id, TokenRevocation.expires_at > datetime.utcnow())
+                    .order_by(TokenRevocation.id)).all()
+            for row_id, jti, user_id, revoked_before, expires_at in rows:
+                self.add(jti, user_id, _epoch(revoked_before) if revoked_before else None, _epoch(expires_at))
+                self._last_id = max(self._last_id, row_id)
+            now = time.time()
+            with self._lock:
+                self._jtis = {jti: expires_at for jti, expires_at in self._jtis.items() if expires_at > now}
+                self._users = {user_id: entry for user_id, entry in self._users.items() if entry[1] > now}
+            self._next_refresh = time.monotonic() + self.refresh_seconds
+        finally:
+            self._refresh_lock.release()
+
+    def is_revoked(self, claims, issued_at):
+        with self._lock:
+            if claims.get('jti') in self._jtis:
+                return True
+            entry = self._users.get(claims.get('uid'))
+        return entry is not None and issued_at <= entry[0]
+
+    def __len__(self):
+        return len(self._jtis) + len(self._users)
+
+
+class TokenAuthority:
+    def __init__(self, secret_keys, max_age, refresh_seconds=2.0):
+        self.max_age = max_age
+        self.serializer = URLSafeTimedSerializer(secret_keys, salt=SALT)
+        self.revocations = RevocationList(refresh_seconds)
+        self.verified = 0
+        self.rejected = 0
+
+    def issue(self, user_id, is_admin=False):
+        return self.serializer.dumps({"uid": user_id, "adm": bool(is_admin), "jti": secrets.token_urlsafe(9)})
+
+    def verify(self, token):
+        """Returns the token's claims, or None if it is invalid, expired or revoked."""
+        try:
+            claims, issued_at = self.serializer.loads(token, max_age=self.max_age, return_timestamp=True)
+        except BadSignature: # Includes SignatureExpired
+            self.rejected += 1
+            return None
+        if not isinstance(claims, dict) or not isinstance(claims.get('uid'), int):
+            self.rejected += 1 # Tokens from before claims were added hold a bare user id
+            return None
+        self.revocations.refresh()
+        if self.revocations.is_revoked(claims, issued_at.timestamp()):
+            self.rejected += 1
+            return None
+        self.verified += 1
+        return claims
+
+    def session_revoked(self, user_id, issued_at):
+        """Whether a user revocation covers a cookie session signed in at issued_at (epoch seconds)."""
+        self.revocations.refresh()
+        return self.revocations.is_revoked({"uid": user_id}, issued_at)
+
+    def _record(self, jti=None, user_id=None, revoked_before=None):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.max_age)
+        TokenRevocation.query.filter(TokenRevocation.expires_at <= now).delete(synchronize_session=False)
+        db.session.add(TokenRevocation(jti=jti, user_id=user_id, revoked_before=revoked_before, expires_at=expires_at))
+        # Applied in memory by _apply_revocations once the caller commits
+        db.session.info.setdefault('token_revocations', []).append(
+            (self.revocations, (jti, user_id, _epoch(revoked_before) if revoked_before else None, _epoch(expires_at))))
+
+    def revoke(self, claims):
+        """Revokes one token (by its claims); commit the session afterwards."""
+        self._record(jti=claims['jti'])
+
+    def revoke_user(self, user_id):
+        """Revokes every token of a user issued until now, this second included; commit the session afterwards."""
+        self._record(user_id=user_id, revoked_before=datetime.utcnow().replace(microsecond=0))
+
+    def stats(self):
+        return {"verified": self.verified, "rejected": self.rejected, "revocations": len(self.revocations)}
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _apply_revocations(db_session):
+    for revocations, entry in db_session.info.pop('token_revocations', ()):
+        revocations.add(*entry)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_revocations(db_session):
+    db_session.info.pop('token_revocations', None)
+
+
+def init_app(app):
+    """Creates the app's token authority from AUTH_TOKEN_* settings."""
+    keys = os.environ.get('AUTH_TOKEN_SECRET_KEYS')
+    app.config.setdefault('AUTH_TOKEN_SECRET_KEYS', keys.split(',') if keys else [app.config['SECRET_KEY']])
+    app.config.setdefault('AUTH_TOKEN_MAX_AGE', 7 * 24 * 3600)
+    app.config.setdefault('AUTH_REVOCATION_REFRESH_SECONDS', 2.0)
+    app.extensions['tokens'] = TokenAuthority(
+        secret_keys=app.config['AUTH_TOKEN_SECRET_KEYS'],
+        max_age=app.config['AUTH_TOKEN_MAX_AGE'],
+        refresh_seconds=app.config['AUTH_REVOCATION_REFRESH_SECONDS']
+    )
+
+
+def get_authority():
+    return current_app.extensions['tokens']
+
+
+def issue(user_id, is_admin=False):
+    return get_authority().issue(user_id, is_admin)
+
+
+def verify(token):
+    return get_authority().verify(token)
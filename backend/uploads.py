@@ -0,0 +1,191 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import media_store
+import metrics
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Pillow is optional; without it no resized variants are generated
+    Image = None
+
+# Image upload pipeline for post images and avatars.
+#
+# The upload is copied to a temporary file in chunks, hashed on the way, and
+# rejected once it exceeds UPLOAD_MAX_BYTES; its type is taken from the file's
+# magic bytes, not from the client's filename. The file is then stored
+# content-addressed through media_store (identical uploads are kept once), and
+# resized WebP variants ("<key stem>_<width>.webp") are generated by a
+# background pool so the request doesn't wait on decoding and resizing.
+# Payloads list a variant set only once it has been written, so clients can
+# always fall back to the original URL.
+
+CHUNK_SIZE = 64 * 1024
+
+# Widths of the generated variants; avatars are cropped square
+VARIANT_SIZES = {
+    'avatars': (64, 128),
+    'posts': (480, 1080),
+}
+
+CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'gif': 'image/gif', 'webp': 'image/webp'}
+
+
+def variant_key(key, width):
+    return f"{media_store.key_stem(key)}_{width}.webp"
+
+
+def sniff_image_type(header):
+    """Returns the file extension for an image's leading bytes, or None if it isn't a supported image."""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class UploadPipeline:
+    def __init__(self, store, max_bytes=10 * 1024 * 1024, workers=2, webp_quality=80, temp_dir=None,
+                 max_tracked=50000, recheck_seconds=30):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.webp_quality = webp_quality
+        self.temp_dir = temp_dir
+        self.max_tracked = max_tracked
+        self.recheck_seconds = recheck_seconds
+        self._variants = OrderedDict() # key -> (variants exist, checked at)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='uploads')
+
+    def save(self, file_storage, kind):
+        """
+        Stores an uploaded image and counts the caller's reference to it (committed
+        with the caller's transaction). Returns (url, error, status_code); url is None on error.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        extension = None
+        fd, temp_path = tempfile.mkstemp(prefix='upload-', dir=self.temp_dir)
+        handed_off = False
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = file_storage.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if extension is None:
+                        extension = sniff_image_type(chunk[:16])
+                        if extension is None:
+                            return None, "Invalid image file type.", 400
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        return None, f"Image exceeds the {self.max_bytes // (1024 * 1024)} MB size limit.", 413
+                    digest.update(chunk)
+                    out.write(chunk)
+            if extension is None:
+                return None, "Invalid image file type.", 400
+
+            key = media_store.object_key(kind, digest.hexdigest(), extension)
+            self.store.put(temp_path, key, CONTENT_TYPES[extension])
+            self.store.add_reference(key, size, CONTENT_TYPES[extension])
+            if Image is not None and not self._variants_ready(key):
+                self._executor.submit(self._make_variants, current_app._get_current_object(), kind, key, temp_path)
+                handed_off = True # The worker reads the temporary file and removes it
+        finally:
+            if not handed_off and os.path.exists(temp_path):
+                os.remove(temp_path)
+        metrics.count_upload(kind, size)
+        return self.store.url(key), None, None
+
+    def _make_variants(self, app, kind, key, source_path):
+        try:
+            with Image.open(source_path) as image:
+                image = ImageOps.exif_transpose(image)
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+                for width in VARIANT_SIZES[kind]:
+                    if kind == 'avatars':
+                        variant = ImageOps.fit(image, (width, width))
+                    elif image.width > width:
+                        variant = image.resize((width, max(1, round(image.height * width / image.width))))
+                    else:
+                        variant = image # Never upscale
+                    fd, temp_path = tempfile.mkstemp(prefix='variant-', suffix='.webp', dir=self.temp_dir)
+                    try:
+                        with os.fdopen(fd, 'wb') as out:
+                            variant.save(out, 'WEBP', quality=self.webp_quality)
+                        self.store.backend.put_file(temp_path, variant_key(key, width), 'image/webp')
+                    finally:
+                        os.remove(temp_path)
+        except Exception as e:
+            app.logger.error(f"Error generating variants for {key}: {e}")
+            return
+        finally:
+            os.remove(source_path)
+        self._remember(key, True)
+
+    def _remember(self, key, ready):
+        with self._lock:
+            self._variants[key] = (ready, time.monotonic())
+            self._variants.move_to_end(key)
+            while len(self._variants) > self.max_tracked:
+                self._variants.popitem(last=False)
+
+    def _variants_ready(self, key):
+        """Whether key's variants exist. Positive answers are kept; negative ones are rechecked after a while."""
+        with self._lock:
+            known = self._variants.get(key)
+        if known is not None and (known[0] or time.monotonic() - known[1] < self.recheck_seconds):
+            return known[0]
+        # Generated by an earlier process, or not finished yet
+        ready = self.store.backend.exists(variant_key(key, VARIANT_SIZES[key.split('/', 1)[0]][-1]))
+        self._remember(key, ready)
+        return ready
+
+    def variant_urls(self, url):
+        """{width: url} of the WebP variants of an uploaded image; empty until they are generated."""
+        if Image is None:
+            return {}
+        key = self.store.key_for_url(url)
+        if key is None or not self._variants_ready(key):
+            return {}
+        kind = key.split('/', 1)[0]
+        return {str(width): self.store.url(variant_key(key, width)) for width in VARIANT_SIZES[kind]}
+
+
+def init_app(app):
+    """Creates the app's upload pipeline from UPLOAD_* settings; needs media_store to be set up first."""
+    app.config.setdefault('UPLOAD_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('UPLOAD_WORKERS', 2)
+    app.config.setdefault('UPLOAD_WEBP_QUALITY', 80)
+    app.config.setdefault('UPLOAD_TEMP_DIR', None) # System default temporary directory
+    # Lets Werkzeug refuse far larger bodies before reading them (leaves room for the other form fields)
+    app.config.setdefault('MAX_CONTENT_LENGTH', app.config['UPLOAD_MAX_BYTES'] + 1024 * 1024)
+    app.extensions['uploads'] = UploadPipeline(
+        store=app.extensions['media_store'],
+        max_bytes=app.config['UPLOAD_MAX_BYTES'],
+        workers=app.config['UPLOAD_WORKERS'],
+        webp_quality=app.config['UPLOAD_WEBP_QUALITY'],
+        temp_dir=app.config['UPLOAD_TEMP_DIR']
+    )
+
+
+def get_pipeline():
+    return current_app.extensions['uploads']
+
+
+def save_upload(file_storage, kind):
+    """Stores an uploaded image of the given kind ('posts' or 'avatars'). Returns (url, error, status_code)."""
+    return get_pipeline().save(file_storage, kind)
+
+
+def variant_urls(url):
+    return get_pipeline().variant_urls(url)
@@ -0,0 +1,142 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, namedtuple
+from flask import current_app
+from models import db, User
+
+# Cache of the authenticated user's identity. login_required runs on nearly every
+# API call, so instead of a primary-key query per request it reads the handful
+# of user fields endpoints need from this cache.
+#
+# The default backend is an in-process LRU with a TTL. Writes that change these
+# fields invalidate the entry; in multi-process deployments other workers can
+# serve a stale entry for at most USER_CACHE_TTL seconds unless a shared backend
+# (USER_CACHE_BACKEND, any UserCacheBackend implementation) is configured.
+
+CachedUser = namedtuple('CachedUser', ['id', 'full_name', 'email', 'profile_picture', 'bio', 'created_at'])
+
+_CACHED_COLUMNS = [User.id, User.full_name, User.email, User.profile_picture, User.bio, User.created_at]
+
+
+class UserCacheBackend(ABC):
+    """Storage interface for the user cache. Implement this to share the cache between processes."""
+
+    @abstractmethod
+    def get(self, user_id):
+        """The cached CachedUser, or None."""
+
+    @abstractmethod
+    def set(self, user_id, user):
+        """Stores a CachedUser."""
+
+    @abstractmethod
+    def delete(self, user_id):
+        """Drops user_id's entry, if any."""
+
+
+class LocalUserCache(UserCacheBackend):
+    """Thread-safe in-process LRU with per-entry expiry."""
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def set(self, user_id, user):
+        with self._lock:
+            self._entries[user_id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class UserCache:
+    """Read-through cache of CachedUser records with hit/miss accounting."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock() # Guards the counters, which request threads update concurrently
+
+    def get_user(self, user_id):
+        """Returns the CachedUser for user_id, loading it on a miss, or None if the user doesn't exist."""
+        user = self.backend.get(user_id)
+        with self._lock:
+            if user is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if user is not None:
+            return user
+        row = db.session.query(*_CACHED_COLUMNS).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        user = CachedUser(*row)
+        self.backend.set(user_id, user)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self.invalidations += 1
+        self.backend.delete(user_id)
+
+    def stats(self):
+        with self._lock:
+            hits, misses, invalidations = self.hits, self.misses, self.invalidations
+        lookups = hits + misses
+        stats = {
+            "hits": hits,
+            "misses": misses,
+            "invalidations": invalidations,
+            "hit_ratio": round(hits / lookups, 4) if lookups else None
+        }
+        if isinstance(self.backend, LocalUserCache):
+            stats["size"] = len(self.backend)
+        return stats
+
+
+def init_app(app):
+    """Creates the app's user cache from USER_CACHE_* settings."""
+    app.config.setdefault('USER_CACHE_SIZE', 10000)
+    app.config.setdefault('USER_CACHE_TTL', 60)
+    backend = app.config.get('USER_CACHE_BACKEND') or LocalUserCache(
+        max_size=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL']
+    )
+    app.extensions['user_cache'] = UserCache(backend)
+
+
+def get_cache():
+    return current_app.extensions['user_cache']
+
+
+def get_user(user_id):
+    """Returns the cached identity of user_id (see CachedUser), or None."""
+    return get_cache().get_user(user_id)
+
+
+def invalidate(user_id):
+    """Drops user_id from the cache; call after committing a change to their cached fields."""
+    get_cache().invalidate(user_id)
@@ -0,0 +1,7 @@
+from app import create_app
+
+# WSGI entry point for servers that import an app object, e.g.
+# `gunicorn wsgi:app` (run from the backend directory); `flask run` loads it
+# too. serve.py and asgi.py build their own app with create_app() instead.
+
+app = create_app()
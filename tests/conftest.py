@@ -0,0 +1,43 @@
+import os
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+sys.path.insert(0, BACKEND_DIR)
+
+import schema_migrations  # noqa: E402
+
+
+def make_database(path):
+    """Creates an empty, fully migrated SQLite database at path."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    with open(os.path.join(BACKEND_DIR, 'schema.sql')) as f:
+        conn.executescript(f.read())
+    schema_migrations.migrate(conn)
+    conn.close()
+
+
+@pytest.fixture
+def app_config(tmp_path, monkeypatch):
+    """Settings for a test app on a scratch primary database (tmp_path/primary.db)."""
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.delenv('DATABASE_REPLICA_URL', raising=False)
+    primary = tmp_path / 'primary.db'
+    make_database(primary)
+    return {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{primary}',
+        'MEDIA_ROOT': str(tmp_path / 'media'),
+        'PASSWORD_HASH_WORKERS': 0,
+    }
+
+
+def copy_database(source, target):
+    """A consistent copy of a (WAL-mode) SQLite database, e.g. to stand in for a replica."""
+    shutil.copy(source, target)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(f'{source}{suffix}'):
+            shutil.copy(f'{source}{suffix}', f'{target}{suffix}')
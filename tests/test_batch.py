@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+import like_buffer
+from app import create_app
+from database import db
+
+# POST /api/batch likes in write-behind mode: the batch writes the user's
+# queued intents itself, and hands them back to the buffer if it fails.
+
+
+@pytest.fixture
+def app(app_config, tmp_path):
+    conn = sqlite3.connect(tmp_path / 'primary.db')
+    conn.executemany("INSERT INTO users (id, full_name, email, password_hash) VALUES (?, ?, ?, 'x')",
+                     [(1, 'Ann', 'a@example.com'), (2, 'Bob', 'b@example.com')])
+    conn.executemany("INSERT INTO posts (id, user_id, content) VALUES (?, 2, 'post')", [(1,), (2,)])
+    conn.commit()
+    conn.close()
+    # A long interval keeps the background flush out of the way
+    app = create_app({**app_config, 'LIKE_WRITE_BEHIND': True, 'LIKE_FLUSH_INTERVAL_MS': 600000})
+    yield app
+    with app.app_context():
+        like_buffer.get_buffer().shutdown()
+
+
+def _client(app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
+
+
+def _likes(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'primary.db')
+    rows = set(conn.execute("SELECT user_id, post_id FROM likes"))
+    conn.close()
+    return rows
+
+
+def test_batch_writes_queued_intents(app, tmp_path):
+    with app.app_context():
+        like_buffer.get_buffer().record(1, 1, True, False)
+    operations = [{'op': 'like', 'post_id': 2}, {'op': 'toggle_like', 'post_id': 1}]
+    response = _client(app).post('/api/batch', json={'operations': operations})
+    assert response.status_code == 200
+    assert _likes(tmp_path) == {(1, 2)}
+    with app.app_context():
+        assert like_buffer.state(1, 1) is None
+
+
+def test_failed_batch_requeues_intents(app, tmp_path, monkeypatch):
+    with app.app_context():
+        like_buffer.get_buffer().record(1, 1, True, False)
+
+    def fail():
+        raise RuntimeError("disk I/O error")
+    monkeypatch.setattr(db.session, 'commit', fail)
+    operations = [{'op': 'like', 'post_id': 2}, {'op': 'toggle_like', 'post_id': 1}]
+    response = _client(app).post('/api/batch', json={'operations': operations})
+    assert response.status_code == 500
+    monkeypatch.undo()
+
+    assert _likes(tmp_path) == set()
+    with app.app_context():
+        assert like_buffer.state(1, 1) is True
+        assert like_buffer.get_buffer().flush() == 1
+    assert _likes(tmp_path) == {(1, 1)}
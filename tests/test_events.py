@@ -0,0 +1,87 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import events
+from app import create_app
+
+# The real-time event bus shared through the realtime_events table: two apps on
+# one database stand in for two worker processes.
+
+
+@pytest.fixture
+def make_client(app_config, tmp_path):
+    conn = sqlite3.connect(tmp_path / 'primary.db')
+    conn.executemany("INSERT INTO users (id, full_name, email, password_hash) VALUES (?, ?, ?, 'x')",
+                     [(1, 'Ann', 'a@example.com'), (2, 'Bob', 'b@example.com')])
+    conn.commit()
+    conn.close()
+
+    def make(**config):
+        app = create_app({**app_config, 'EVENTS_POLL_INTERVAL_MS': 20, **config})
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = 1
+        return app, client
+    return make
+
+
+def _poll(client, last_event_id, timeout=2):
+    return client.get(f'/api/events/poll?timeout={timeout}', headers={'Last-Event-ID': last_event_id}).get_json()
+
+
+def test_event_published_by_another_process(make_client):
+    publisher, _ = make_client()
+    _, client = make_client()
+    start = _poll(client, '', timeout=0)['last_event_id']
+
+    with publisher.app_context():
+        events.publish([events.user_channel(2)], 'message', {"content": "not for Ann"})
+        events.publish([events.user_channel(1)], 'message', {"content": "hi"})
+    body = _poll(client, start)
+    assert body['resync'] is False
+    assert [(event['type'], event['data']) for event in body['events']] == [('message', {"content": "hi"})]
+
+    # The id resumes on any process
+    _, other = make_client()
+    assert _poll(other, start, timeout=0)['events'] == body['events']
+    assert _poll(other, body['last_event_id'], timeout=0) == {"events": [], "last_event_id": body['last_event_id'],
+                                                              "resync": False}
+
+
+def test_unknown_or_old_ids_resync(make_client):
+    _, client = make_client()
+    assert _poll(client, 'a1b2c3d4-7', timeout=0)['resync'] is True
+    assert _poll(client, '999', timeout=0)['resync'] is True
+
+
+def test_async_stream(make_client):
+    app, _ = make_client()
+    with app.app_context():
+        bus = events.get_bus()
+        position = bus.current_position()
+        events.publish([events.user_channel(1)], 'comment', {"id": 5})
+
+    async def first_chunks():
+        subscription = events.Subscription({events.user_channel(1)}, position, False,
+                                           heartbeat_seconds=2, max_seconds=2)
+        chunks = bus.astream(subscription)
+        try:
+            return [await chunks.__anext__(), await chunks.__anext__()]
+        finally:
+            await chunks.aclose()
+    assert asyncio.run(first_chunks()) == ["retry: 3000\n\n", f'id: {position + 1}\nevent: comment\ndata: {{"id": 5}}\n\n']
+    assert bus.stats()['subscribers'] == 0
+
+
+def test_streams_holding_threads_are_limited(make_client):
+    _, client = make_client(EVENTS_MAX_THREAD_STREAMS=1)
+    stream = client.get('/api/events/stream', buffered=False)
+    assert next(stream.response) == b"retry: 3000\n\n"
+    response = client.get('/api/events/stream')
+    assert response.status_code == 503
+    stream.close()
+    stream = client.get('/api/events/stream', buffered=False)
+    assert stream.status_code == 200
+    stream.close()
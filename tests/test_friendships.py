@@ -0,0 +1,92 @@
+import sqlite3
+
+import pytest
+
+from app import create_app
+
+# Friendship writes when this process's friend graph is stale: each test loads
+# both users into the graph, then changes the friendships table directly, the
+# way a request handled by another worker would.
+
+
+@pytest.fixture
+def primary(app_config, tmp_path):
+    path = tmp_path / 'primary.db'
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (id, full_name, email, password_hash) VALUES (1, 'Ann', 'a@example.com', 'x')")
+    conn.execute("INSERT INTO users (id, full_name, email, password_hash) VALUES (2, 'Bob', 'b@example.com', 'x')")
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def client(app_config, primary):
+    app = create_app(app_config)
+    client = app.test_client()
+    for user_id in (1, 2):
+        _log_in(client, user_id)
+        assert client.get('/api/friends').status_code == 200 # Caches the user's (empty) adjacency
+    return client
+
+
+def _log_in(client, user_id):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+
+def _execute(path, statement):
+    conn = sqlite3.connect(path)
+    conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+
+def test_post_reaches_friend_accepted_elsewhere(client, primary):
+    _execute(primary, "INSERT INTO friendships (user1_id, user2_id, status) VALUES (1, 2, 'accepted')")
+    _log_in(client, 1)
+    response = client.post('/api/posts', json={'content': 'hello'})
+    assert response.status_code == 201
+    post_id = response.get_json()['post']['id']
+
+    conn = sqlite3.connect(primary)
+    owners = {row[0] for row in conn.execute("SELECT user_id FROM timeline_entries WHERE post_id = ?", (post_id,))}
+    conn.close()
+    assert owners == {1, 2}
+
+
+def test_request_to_friend_accepted_elsewhere(client, primary):
+    _execute(primary, "INSERT INTO friendships (user1_id, user2_id, status) VALUES (1, 2, 'accepted')")
+    _log_in(client, 2)
+    response = client.post('/api/friend-request', json={'user_id': 1})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == "You are already friends with this user."
+
+
+def test_reverse_request_while_pending_elsewhere(client, primary):
+    _execute(primary, "INSERT INTO friendships (user1_id, user2_id, status) VALUES (1, 2, 'pending')")
+    _log_in(client, 2)
+    response = client.post('/api/friend-request', json={'user_id': 1})
+    assert response.status_code == 400
+
+    conn = sqlite3.connect(primary)
+    assert conn.execute("SELECT COUNT(*) FROM friendships").fetchone()[0] == 1
+    conn.close()
+
+
+def test_duplicate_request_sent_elsewhere(client, primary):
+    _execute(primary, "INSERT INTO friendships (user1_id, user2_id, status) VALUES (1, 2, 'pending')")
+    _log_in(client, 1)
+    response = client.post('/api/friend-request', json={'user_id': 2})
+    assert response.status_code == 400
+
+
+def test_request_after_decline(client, primary):
+    _execute(primary, "INSERT INTO friendships (user1_id, user2_id, status) VALUES (1, 2, 'declined')")
+    _log_in(client, 1)
+    response = client.post('/api/friend-request', json={'user_id': 2})
+    assert response.status_code == 201
+
+    conn = sqlite3.connect(primary)
+    assert conn.execute("SELECT status FROM friendships").fetchall() == [('pending',)]
+    conn.close()
@@ -0,0 +1,54 @@
+import pytest
+
+from app import create_app
+import auth
+
+# POST /api/login throttling (passwords.LoginThrottle) and the client address
+# it is keyed on.
+
+
+@pytest.fixture
+def make_client(app_config):
+    def make(**config):
+        app = create_app({**app_config, 'LOGIN_MAX_FAILURES_PER_EMAIL': 3, **config})
+        with app.app_context():
+            auth.register_user('Victim', 'victim@example.com', 'correct horse')
+        return app.test_client()
+    return make
+
+
+def _login(client, password, ip='10.0.0.1', forwarded_for=None):
+    headers = {'X-Forwarded-For': forwarded_for} if forwarded_for else {}
+    return client.post('/api/login', json={'email': 'victim@example.com', 'password': password},
+                       headers=headers, environ_base={'REMOTE_ADDR': ip})
+
+
+def test_failures_lock_out_the_failing_address(make_client):
+    client = make_client()
+    for _ in range(3):
+        assert _login(client, 'wrong').status_code == 401
+    response = _login(client, 'correct horse')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+
+def test_failures_do_not_lock_out_other_addresses(make_client):
+    client = make_client()
+    for _ in range(3):
+        _login(client, 'wrong', ip='10.0.0.66')
+    assert _login(client, 'correct horse', ip='10.0.0.1').status_code == 200
+
+
+def test_forwarded_for_ignored_without_trusted_proxy(make_client):
+    client = make_client()
+    for _ in range(3):
+        _login(client, 'wrong', ip='127.0.0.1', forwarded_for='10.0.0.66')
+    assert _login(client, 'correct horse', ip='127.0.0.1', forwarded_for='10.0.0.1').status_code == 429
+
+
+def test_forwarded_for_used_behind_trusted_proxy(make_client):
+    client = make_client(TRUSTED_PROXY_COUNT=1)
+    for _ in range(3):
+        _login(client, 'wrong', ip='127.0.0.1', forwarded_for='10.0.0.66')
+    assert _login(client, 'correct horse', ip='127.0.0.1', forwarded_for='10.0.0.66').status_code == 429
+    assert _login(client, 'correct horse', ip='127.0.0.1', forwarded_for='10.0.0.1').status_code == 200
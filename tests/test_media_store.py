@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+import media_store
+from app import create_app
+from database import db
+from models import MediaObject
+
+# media_store reference counting around the release of an object's last
+# reference, with the local backend on a scratch MEDIA_ROOT.
+
+KEY = media_store.object_key('posts', 'ab' * 32, 'png')
+
+
+@pytest.fixture
+def app(app_config):
+    return create_app(app_config)
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'upload.png'
+    path.write_bytes(b'\x89PNG\r\n\x1a\n' + b'\x00' * 64)
+    return str(path)
+
+
+def _age(store, key, seconds):
+    path = store.backend._path(key)
+    os.utime(path, (time.time() - seconds, time.time() - seconds))
+
+
+def _stored_with_reference(store, source, age_seconds):
+    store.put(source, KEY, 'image/png')
+    store.add_reference(KEY, 72, 'image/png')
+    db.session.commit()
+    _age(store, KEY, age_seconds)
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        media_store.MediaBackend()
+
+
+def test_release_of_last_reference_deletes_object(app, source):
+    with app.app_context():
+        store = media_store.get_store()
+        _stored_with_reference(store, source, age_seconds=3600)
+        store.release(store.url(KEY))
+        db.session.commit()
+        assert not store.backend.exists(KEY)
+
+
+def test_upload_during_release_keeps_object(app, source):
+    with app.app_context():
+        store = media_store.get_store()
+        _stored_with_reference(store, source, age_seconds=3600)
+
+        # A second upload of the same bytes finds the object stored...
+        assert store.put(source, KEY, 'image/png') is False
+        # ...and the last existing reference is released and committed before its own reference is
+        with app.app_context():
+            store.release(store.url(KEY))
+            db.session.commit()
+        store.add_reference(KEY, 72, 'image/png')
+        db.session.commit()
+
+        assert store.backend.exists(KEY)
+        assert db.session.query(MediaObject.refcount).filter_by(key=KEY).scalar() == 1
+
+
+def test_put_rewrites_missing_object(app, source):
+    with app.app_context():
+        store = media_store.get_store()
+        assert store.put(source, KEY, 'image/png') is True
+        store.backend.delete(KEY)
+        assert store.put(source, KEY, 'image/png') is True
+        assert store.backend.exists(KEY)
+
+
+def test_acquire_of_deleted_object(app, source):
+    with app.app_context():
+        store = media_store.get_store()
+        _stored_with_reference(store, source, age_seconds=3600)
+        url = store.url(KEY)
+        assert store.acquire(url) is True
+        db.session.commit()
+        assert db.session.query(MediaObject.refcount).filter_by(key=KEY).scalar() == 2
+
+        store.release(url)
+        store.release(url)
+        db.session.commit()
+        assert store.acquire(url) is False
+        assert store.acquire('https://example.com/picture.png') is True
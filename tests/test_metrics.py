@@ -0,0 +1,66 @@
+import pytest
+
+import metrics
+from app import create_app
+
+# GET /metrics access control, and the aggregation of per-process snapshot
+# files in METRICS_DIR.
+
+
+@pytest.fixture
+def make_client(app_config, monkeypatch):
+    monkeypatch.delenv('METRICS_AUTH_TOKEN', raising=False)
+    monkeypatch.delenv('METRICS_ALLOW_ANONYMOUS', raising=False)
+
+    def make(**config):
+        return create_app({**app_config, **config}).test_client()
+    return make
+
+
+def test_metrics_need_a_token_by_default(make_client):
+    assert make_client().get('/metrics').status_code == 401
+
+
+def test_metrics_with_token(make_client):
+    client = make_client(METRICS_AUTH_TOKEN='s3cret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert 'http_requests_total' in response.text
+
+
+def test_metrics_anonymous_when_allowed(make_client):
+    assert make_client(METRICS_ALLOW_ANONYMOUS=True).get('/metrics').status_code == 200
+
+
+def _requests_total(registry):
+    return sum(value for _, value in registry.collect()['requests_total']['samples'])
+
+
+def test_process_reusing_a_pid_keeps_exited_totals(tmp_path):
+    # Two registries in one process stand in for an exited worker and a new one given the same pid
+    exited = metrics.Registry(directory=str(tmp_path))
+    exited.register(metrics.Counter('requests_total', 'Requests.')).inc(amount=5)
+    exited.write()
+
+    current = metrics.Registry(directory=str(tmp_path))
+    current.register(metrics.Counter('requests_total', 'Requests.')).inc(amount=1)
+    current.write()
+
+    assert len(list(tmp_path.glob('metrics-*.json'))) == 2
+    assert _requests_total(current) == 6
+
+
+def test_new_worker_keeps_exited_workers_files(app_config, tmp_path, monkeypatch):
+    directory = tmp_path / 'metrics'
+    directory.mkdir()
+    exited = metrics.Registry(directory=str(directory))
+    exited.register(metrics.Counter('requests_total', 'Requests.')).inc(amount=5)
+    exited.write()
+    # Pretend its process has exited
+    monkeypatch.setattr(metrics, '_is_running', lambda pid: False)
+
+    create_app({**app_config, 'METRICS_DIR': str(directory)})
+    assert len(list(directory.glob('metrics-*.json'))) == 1
+    assert exited.remove_files() == 1
@@ -0,0 +1,51 @@
+import base64
+import json
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import pagination
+from app import create_app
+
+# Cursor decoding and ?before_id= on the keyset-paginated listings.
+
+
+def _cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def test_cursor_round_trip():
+    values = [datetime(2024, 5, 1, 12, 30, 15, 250), 42]
+    assert pagination.decode_cursor(pagination.encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize('payload', [[{"a": 1}], [[1]], [None], [True], [1.5], ["not a date"], {"a": 1}, []])
+def test_cursor_rejects_other_values(payload):
+    with pytest.raises(ValueError):
+        pagination.decode_cursor(_cursor(payload))
+
+
+@pytest.fixture
+def admin_client(app_config, tmp_path):
+    conn = sqlite3.connect(tmp_path / 'primary.db')
+    conn.executemany("INSERT INTO users (id, full_name, email, password_hash) VALUES (?, ?, ?, 'x')",
+                     [(i, f'User {i}', f'user{i}@example.com') for i in range(1, 6)])
+    conn.commit()
+    conn.close()
+    client = create_app(app_config).test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['is_admin'] = True
+    return client
+
+
+def test_admin_users_before_id(admin_client):
+    response = admin_client.get('/api/admin/users?before_id=3&limit=10')
+    assert response.status_code == 200
+    assert [user['id'] for user in response.get_json()['items']] == [4, 5]
+    assert admin_client.get('/api/admin/users?before_id=99').status_code == 400
+
+
+def test_admin_users_malformed_cursor(admin_client):
+    assert admin_client.get('/api/admin/users?cursor=' + _cursor([{"a": 1}])).status_code == 400
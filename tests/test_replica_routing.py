@@ -0,0 +1,152 @@
+import sqlite3
+import time
+
+import pytest
+from flask import jsonify
+from sqlalchemy import update
+
+import tokens
+from app import create_app
+from auth import login_required
+from conftest import copy_database
+from database import db, replica_reads
+from models import User
+
+# database.RoutingSession, with a stale copy of the primary SQLite file standing
+# in for the read replica: the user is called "Stale" on the replica and
+# "Fresh" on the primary, so each probe endpoint's answer shows which database
+# served its read.
+
+
+@pytest.fixture
+def databases(app_config, tmp_path):
+    primary = tmp_path / 'primary.db'
+    replica = tmp_path / 'replica.db'
+    conn = sqlite3.connect(primary)
+    conn.execute("INSERT INTO users (id, full_name, email, password_hash) VALUES (1, 'Stale', 'a@example.com', 'x')")
+    conn.execute("INSERT INTO users (id, full_name, email, password_hash) VALUES (2, 'Other', 'b@example.com', 'x')")
+    conn.commit()
+    conn.close()
+    copy_database(primary, replica)
+    conn = sqlite3.connect(primary)
+    conn.execute("UPDATE users SET full_name = 'Fresh' WHERE id = 1")
+    conn.commit()
+    conn.close()
+    return primary, replica
+
+
+def _name():
+    return db.session.query(User.full_name).filter(User.id == 1).scalar()
+
+
+def _add_probes(app):
+    @app.route('/_probe/replica-read')
+    @replica_reads
+    def replica_read():
+        return jsonify(name=_name())
+
+    @app.route('/_probe/primary-read')
+    def primary_read():
+        return jsonify(name=_name())
+
+    @app.route('/_probe/flush-then-read')
+    @replica_reads
+    def flush_then_read():
+        db.session.get(User, 2).bio = 'flushed'
+        db.session.flush()
+        return jsonify(name=_name())
+
+    @app.route('/_probe/execute-then-read')
+    @replica_reads
+    def execute_then_read():
+        db.session.execute(update(User).where(User.id == 2).values(bio='executed'))
+        name = _name()
+        db.session.commit()
+        return jsonify(name=name)
+
+    @app.route('/_probe/write', methods=['POST'])
+    def write():
+        db.session.execute(update(User).where(User.id == 2).values(bio='written'))
+        db.session.commit()
+        return jsonify(ok=True)
+
+    @app.route('/_probe/user/replica-read')
+    @login_required
+    @replica_reads
+    def user_replica_read():
+        return jsonify(name=_name())
+
+    @app.route('/_probe/user/write', methods=['POST'])
+    @login_required
+    def user_write():
+        return write()
+    return app
+
+
+@pytest.fixture
+def make_app(app_config, databases):
+    def make(**config):
+        _, replica = databases
+        return _add_probes(create_app({**app_config, 'DATABASE_REPLICA_URL': f'sqlite:///{replica}', **config}))
+    return make
+
+
+def test_replica_reads_endpoint_reads_from_replica(make_app):
+    client = make_app().test_client()
+    assert client.get('/_probe/replica-read').json['name'] == 'Stale'
+
+
+def test_other_endpoints_read_from_primary(make_app):
+    client = make_app().test_client()
+    assert client.get('/_probe/primary-read').json['name'] == 'Fresh'
+
+
+def test_reads_after_a_flush_go_to_primary(make_app):
+    client = make_app().test_client()
+    assert client.get('/_probe/flush-then-read').json['name'] == 'Fresh'
+
+
+def test_executed_write_goes_to_primary_with_later_reads(make_app, databases):
+    primary, replica = databases
+    client = make_app().test_client()
+    assert client.get('/_probe/execute-then-read').json['name'] == 'Fresh'
+    assert sqlite3.connect(primary).execute("SELECT bio FROM users WHERE id = 2").fetchone() == ('executed',)
+    assert sqlite3.connect(replica).execute("SELECT bio FROM users WHERE id = 2").fetchone() == (None,)
+
+
+def test_reads_stick_to_primary_after_a_commit(make_app):
+    client = make_app(DB_REPLICA_STICKY_SECONDS=0.5).test_client()
+    assert client.get('/_probe/replica-read').json['name'] == 'Stale'
+    client.post('/_probe/write')
+    assert client.get('/_probe/replica-read').json['name'] == 'Fresh'
+    time.sleep(0.6)
+    assert client.get('/_probe/replica-read').json['name'] == 'Stale'
+
+
+def test_stickiness_is_per_client(make_app):
+    app = make_app()
+    writer, other = app.test_client(), app.test_client()
+    writer.post('/_probe/write')
+    assert writer.get('/_probe/replica-read').json['name'] == 'Fresh'
+    assert other.get('/_probe/replica-read').json['name'] == 'Stale'
+
+
+def test_bearer_token_clients_stick_by_user(make_app):
+    # Clients sending only Authorization (no cookie jar) are recognised by user id
+    app = make_app()
+    with app.app_context():
+        writer, other = tokens.issue(1), tokens.issue(2)
+
+    def get(token):
+        client = app.test_client(use_cookies=False)
+        return client.get('/_probe/user/replica-read', headers={'Authorization': f'Bearer {token}'}).json['name']
+    app.test_client(use_cookies=False).post('/_probe/user/write', headers={'Authorization': f'Bearer {writer}'})
+    assert get(writer) == 'Fresh'
+    assert get(other) == 'Stale'
+
+
+def test_without_replica_everything_reads_from_primary(app_config, databases):
+    client = _add_probes(create_app(app_config)).test_client()
+    assert client.get('/_probe/replica-read').json['name'] == 'Fresh'
+    client.post('/_probe/write')
+    assert client.get('/_probe/replica-read').json['name'] == 'Fresh'
@@ -0,0 +1,26 @@
+import sqlite3
+
+import timeline
+from app import create_app
+
+# timeline.rebuild_all on friendships as they can exist in the table.
+
+
+def test_rebuild_with_friendship_stored_in_both_directions(app_config, tmp_path):
+    conn = sqlite3.connect(tmp_path / 'primary.db')
+    conn.executemany("INSERT INTO users (id, full_name, email, password_hash) VALUES (?, ?, ?, 'x')",
+                     [(1, 'Ann', 'a@example.com'), (2, 'Bob', 'b@example.com'), (3, 'Cid', 'c@example.com')])
+    conn.executemany("INSERT INTO posts (id, user_id, content) VALUES (?, ?, 'post')", [(1, 1), (2, 2), (3, 3)])
+    conn.executemany("INSERT INTO friendships (user1_id, user2_id, status) VALUES (?, ?, ?)",
+                     [(1, 2, 'accepted'), (2, 1, 'accepted'), (3, 1, 'pending')])
+    conn.commit()
+    conn.close()
+
+    app = create_app(app_config)
+    with app.app_context():
+        assert timeline.rebuild_all() == 5
+
+    conn = sqlite3.connect(tmp_path / 'primary.db')
+    entries = set(conn.execute("SELECT user_id, post_id, author_id FROM timeline_entries"))
+    conn.close()
+    assert entries == {(1, 1, 1), (1, 2, 2), (2, 2, 2), (2, 1, 1), (3, 3, 3)}
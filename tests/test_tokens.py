@@ -0,0 +1,77 @@
+import sqlite3
+import time
+
+import flask
+import pytest
+
+import auth
+import tokens
+from app import create_app
+from database import db
+
+# Revocation of every token of a user (password reset, account deletion), and
+# of the user's cookie sessions.
+
+
+@pytest.fixture
+def app(app_config):
+    return create_app(app_config)
+
+
+def _start_of_a_second():
+    # Issue and revoke within one second of the clock, as a token obtained just before a reset would be
+    time.sleep(1 - time.time() % 1)
+
+
+def test_revoke_user_covers_tokens_issued_in_the_same_second(app):
+    with app.app_context():
+        authority = tokens.get_authority()
+        _start_of_a_second()
+        token = authority.issue(1)
+        authority.revoke_user(1)
+        db.session.commit()
+        assert authority.verify(token) is None
+
+
+def test_revoke_user_keeps_later_tokens_and_other_users(app):
+    with app.app_context():
+        authority = tokens.get_authority()
+        other = authority.issue(2)
+        authority.revoke_user(1)
+        db.session.commit()
+        time.sleep(1.1)
+        assert authority.verify(authority.issue(1))['uid'] == 1
+        assert authority.verify(other)['uid'] == 2
+
+
+def test_rolled_back_revocation_takes_no_effect(app):
+    with app.app_context():
+        authority = tokens.get_authority()
+        token = authority.issue(1)
+        time.sleep(1.1)
+        authority.revoke_user(1)
+        authority.revoke(authority.verify(token))
+        db.session.rollback()
+        authority.revocations.refresh(force=True)
+        assert authority.verify(token)['uid'] == 1
+
+
+def test_revoke_user_ends_cookie_sessions(app, tmp_path):
+    conn = sqlite3.connect(tmp_path / 'primary.db')
+    conn.execute("INSERT INTO users (id, full_name, email, password_hash) VALUES (1, 'Ann', 'a@example.com', 'x')")
+    conn.commit()
+    conn.close()
+    client = app.test_client()
+    with app.test_request_context():
+        auth.start_session(1)
+        signed_in = dict(flask.session)
+    with client.session_transaction() as session:
+        session.update(signed_in)
+    assert client.get('/api/me').status_code == 200
+
+    with app.app_context():
+        tokens.get_authority().revoke_user(1)
+        db.session.commit()
+    assert client.get('/api/me').status_code == 401
+    with client.session_transaction() as session:
+        assert 'user_id' not in session